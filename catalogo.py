@@ -0,0 +1,168 @@
+import re
+import threading
+import unicodedata
+from typing import List, Dict, Optional, Tuple, Iterable
+
+import db
+
+# Catálogo de productos en memoria, indexado por ID, nombre exacto, nombre sin distinguir
+# mayúsculas (casefold) y categoría. Se carga de la BD en la primera consulta y db lo
+# invalida cada vez que este proceso modifica productos (save_product, delete_product,
+# update_product_stock, set_product_category, restauraciones masivas...). Los cambios
+# hechos desde otra terminal se detectan con refresh_if_stale().
+#
+# Los registros devueltos son compartidos por el caché y de solo lectura: para modificar
+# uno, usar .copy(), que devuelve un db.Product normal.
+
+_lock = threading.Lock()
+_estado: Optional[Dict[str, object]] = None
+# Aumenta con cada invalidate(); una carga que empezó antes no se guarda
+_generacion = 0
+
+
+class CatalogProduct(db.Product):
+    """Producto del catálogo compartido: leerlo como un db.Product, pero no modificarlo."""
+
+    __slots__ = ()
+
+    def __setitem__(self, clave, valor):
+        raise TypeError("Los productos del catálogo son de solo lectura; usar .copy()")
+
+    def __delitem__(self, clave):
+        raise TypeError("Los productos del catálogo son de solo lectura; usar .copy()")
+
+    def copy(self) -> db.Product:
+        return db.Product.from_mapping(self)
+
+
+def invalidate():
+    """Descarta el catálogo; la próxima consulta lo vuelve a cargar de la BD."""
+    global _estado, _generacion
+    with _lock:
+        _estado = None
+        _generacion += 1
+
+
+def _normalizar(texto: str) -> str:
+    """Minúsculas y sin acentos ("Salmón" → "salmon")."""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).casefold()
+
+
+def _cargar() -> Dict[str, object]:
+    version = db.table_versions().get('products')
+    productos = [CatalogProduct.from_mapping(p) for p in db.load_products()]
+    por_id: Dict[str, db.Product] = {}
+    por_nombre: Dict[str, db.Product] = {}
+    por_nombre_casefold: Dict[str, db.Product] = {}
+    por_categoria: Dict[str, List[db.Product]] = {}
+    texto_busqueda: Dict[str, Tuple[str, str]] = {}
+    for p in productos:
+        por_id[str(p['id'])] = p
+        nombre = p['nombre'] or ''
+        por_nombre.setdefault(nombre, p)
+        por_nombre_casefold.setdefault(nombre.casefold(), p)
+        por_categoria.setdefault(p['categoria'], []).append(p)
+        texto_busqueda[str(p['id'])] = (_normalizar(nombre),
+                                        _normalizar(f"{p['descripcion'] or ''} {p['categoria'] or ''}"))
+    return {
+        'version': version,
+        'productos': productos,
+        'por_id': por_id,
+        'por_nombre': por_nombre,
+        'por_nombre_casefold': por_nombre_casefold,
+        'por_categoria': por_categoria,
+        'texto_busqueda': texto_busqueda,
+    }
+
+
+def _catalogo() -> Dict[str, object]:
+    global _estado
+    estado = _estado
+    if estado is None:
+        with _lock:
+            generacion = _generacion
+        estado = _cargar()
+        with _lock:
+            # Si se invalidó durante la carga, puede faltarle ese cambio: se usa para esta
+            # consulta pero no se guarda, y la próxima vuelve a cargar
+            if _generacion == generacion and _estado is None:
+                _estado = estado
+    return estado
+
+
+def refresh_if_stale() -> bool:
+    """Invalida el catálogo si la tabla products cambió (p. ej. desde otra terminal).
+
+    Cuesta una lectura de table_versions; devuelve True si hubo que invalidar.
+    """
+    estado = _estado
+    if estado is None:
+        return False
+    if db.table_versions().get('products') != estado['version']:
+        invalidate()
+        return True
+    return False
+
+
+def all_products() -> List[db.Product]:
+    """Todos los productos, en el orden en que los devuelve la BD."""
+    return list(_catalogo()['productos'])
+
+
+def get_by_id(product_id) -> Optional[db.Product]:
+    return _catalogo()['por_id'].get(str(product_id))
+
+
+def get_by_name(nombre: str) -> Optional[db.Product]:
+    """Busca por nombre exacto y, si no aparece, sin distinguir mayúsculas."""
+    estado = _catalogo()
+    producto = estado['por_nombre'].get(nombre)
+    if producto is None and nombre is not None:
+        producto = estado['por_nombre_casefold'].get(nombre.casefold())
+    return producto
+
+
+def search(texto: str, ids: Optional[Iterable[str]] = None) -> List[db.Product]:
+    """Productos que coinciden con `texto`, los más relevantes primero.
+
+    Usa el índice FTS5 de la BD (prefijos, sin acentos, ranking bm25) y, si el SQLite no
+    tiene FTS5, una búsqueda en memoria sin acentos: cada palabra debe aparecer en el
+    nombre, la descripción o la categoría, y primero van las coincidencias en el nombre.
+    `ids` restringe la búsqueda a esos productos (p. ej. el resultado de una búsqueda previa).
+    """
+    estado = _catalogo()
+    por_id = estado['por_id']
+    if ids is not None:
+        ids = [str(i) for i in ids]
+    permitidos = None if ids is None else set(ids)
+    encontrados = db.search_products(texto)
+    if encontrados is not None:
+        return [por_id[str(i)] for i in encontrados
+                if str(i) in por_id and (permitidos is None or str(i) in permitidos)]
+
+    palabras = re.findall(r'\w+', _normalizar(texto))
+    if not palabras:
+        return []
+    en_nombre = []
+    en_resto = []
+    textos = estado['texto_busqueda']
+    for pid in (textos if ids is None else [i for i in ids if i in textos]):
+        nombre, resto = textos[pid]
+        if all(p in nombre for p in palabras):
+            en_nombre.append(por_id[pid])
+        elif all(p in nombre or p in resto for p in palabras):
+            en_resto.append(por_id[pid])
+    return en_nombre + en_resto
+
+
+def by_category(categoria: str) -> List[db.Product]:
+    return list(_catalogo()['por_categoria'].get(categoria, ()))
+
+
+def categories() -> List[str]:
+    """Categorías que tienen al menos un producto."""
+    return list(_catalogo()['por_categoria'])
+
+
+db.on_products_changed(invalidate)
@@ -1,20 +1,311 @@
 import sqlite3
 import json
 import os
-from typing import List, Dict, Any, Optional
+import re
+import sys
+import socket
+import threading
+import atexit
+import hmac
+import secrets
+import time
+from collections.abc import Mapping, MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterator, Set
 import hashlib
+from urllib.request import pathname2url
 
 # Ruta por defecto de la base de datos
 DB_FILE = os.path.join(os.path.dirname(__file__), 'mizu_sushi.db')
 
+# PRAGMAs que se aplican una sola vez al abrir cada conexión
+_PRAGMAS_CONEXION = (
+    'PRAGMA foreign_keys = ON',
+)
+
+# Perfiles de PRAGMA por tipo de carga de trabajo. Se pueden modificar o ampliar
+# con register_pragma_profile(). set_pragma_profile() cambia el perfil por defecto de
+# todas las conexiones; pragma_profile() lo cambia solo para la conexión del hilo actual.
+#   - pos: caja y pedidos; escrituras cortas y durables sin bloquear a los lectores
+#   - reporting: lecturas largas de reportes; más caché y temporales en memoria
+#   - bulk-import: restauraciones e importaciones masivas; prioriza velocidad
+PRAGMA_PROFILES: Dict[str, Dict[str, Any]] = {
+    'pos': {
+        'synchronous': 'NORMAL',
+        'cache_size': -8000,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+    },
+    'reporting': {
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 15000,
+    },
+    'bulk-import': {
+        'synchronous': 'OFF',
+        'cache_size': -128000,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 30000,
+    },
+}
+
+DEFAULT_PRAGMA_PROFILE = 'pos'
+
+
+class ConnectionManager:
+    """Mantiene una conexión SQLite abierta por hilo y entrega cursores transaccionales.
+
+    Cada hilo (la interfaz Tk o un hilo de trabajo en segundo plano) recibe su propia
+    conexión, que se abre la primera vez que se necesita y se reutiliza en las llamadas
+    siguientes. Los PRAGMA de conexión se aplican una única vez al abrirla.
+
+    El perfil de PRAGMA es el de `profile` salvo que el hilo tenga uno propio
+    (push_profile/pop_profile), que no afecta a las conexiones de los demás hilos.
+    """
+
+    def __init__(self, path: Optional[str] = None, profile: str = DEFAULT_PRAGMA_PROFILE):
+        self.path = path or DB_FILE
+        self.profile = profile
+        self._profile_version = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Conexiones abiertas, las que están dentro de un bloque cursor() y las que
+        # close_all() marcó para cerrar cuando su hilo termine la transacción en curso
+        self._conexiones: Set[sqlite3.Connection] = set()
+        self._ocupadas: Set[sqlite3.Connection] = set()
+        self._cerrar_al_terminar: Set[sqlite3.Connection] = set()
+
+    def set_profile(self, name: str):
+        """Cambia el perfil por defecto; cada hilo lo aplica a su conexión en el próximo uso."""
+        if name not in PRAGMA_PROFILES:
+            raise ValueError(f"Perfil de PRAGMA desconocido: {name}")
+        with self._lock:
+            self.profile = name
+            self._profile_version += 1
+
+    def active_profile(self) -> str:
+        """Perfil que corresponde a la conexión del hilo actual."""
+        pila = getattr(self._local, 'profiles', None)
+        return pila[-1] if pila else self.profile
+
+    def push_profile(self, name: str):
+        """Activa un perfil solo para el hilo actual (se anida con pop_profile)."""
+        if name not in PRAGMA_PROFILES:
+            raise ValueError(f"Perfil de PRAGMA desconocido: {name}")
+        if getattr(self._local, 'profiles', None) is None:
+            self._local.profiles = []
+        self._local.profiles.append(name)
+        self._reaplicar_perfil()
+
+    def pop_profile(self):
+        """Quita el último perfil activado con push_profile en el hilo actual."""
+        pila = getattr(self._local, 'profiles', None)
+        if pila:
+            pila.pop()
+        self._reaplicar_perfil()
+
+    def _reaplicar_perfil(self):
+        # Fuera de una transacción se aplica ya; dentro, al terminar el bloque más externo
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.depth == 0 and self._vigente(conn):
+            self._aplicar_perfil(conn)
+
+    def _aplicar_perfil(self, conn: sqlite3.Connection):
+        perfil = self.active_profile()
+        for pragma, valor in PRAGMA_PROFILES[perfil].items():
+            conn.execute(f'PRAGMA {pragma} = {valor}')
+        self._local.perfil_aplicado = (perfil, self._profile_version)
+
+    def open_reader(self) -> sqlite3.Connection:
+        """Abre una conexión aparte, de solo lectura, con el perfil del hilo actual.
+
+        No pasa por el registro de conexiones ni por cursor(): quien la abre la cierra.
+        Sirve para lecturas largas que no deben mezclarse con las transacciones del hilo.
+        """
+        uri = 'file:' + pathname2url(os.path.abspath(self.path)) + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        for pragma, valor in PRAGMA_PROFILES[self.active_profile()].items():
+            if pragma != 'synchronous':
+                conn.execute(f'PRAGMA {pragma} = {valor}')
+        return conn
+
+    def configure(self, path: Optional[str] = None):
+        """Cambia la ruta de la base de datos; cierra las conexiones abiertas a la ruta anterior."""
+        path = path or DB_FILE
+        if os.path.abspath(path) != os.path.abspath(self.path):
+            self.close_all()
+            self.path = path
+
+    def _abrir(self) -> sqlite3.Connection:
+        # check_same_thread=False solo para poder cerrarla desde close_all();
+        # cada conexión se usa exclusivamente desde el hilo que la creó.
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        for pragma in _PRAGMAS_CONEXION:
+            conn.execute(pragma)
+        with self._lock:
+            self._conexiones.add(conn)
+        return conn
+
+    def _vigente(self, conn: sqlite3.Connection) -> bool:
+        with self._lock:
+            return conn in self._conexiones
+
+    def connection(self) -> sqlite3.Connection:
+        """Devuelve la conexión del hilo actual, abriéndola si aún no existe."""
+        conn = getattr(self._local, 'conn', None)
+        # Dentro de una transacción se sigue con la misma conexión aunque close_all() o un
+        # cambio de ruta la hayan retirado; se reemplaza al volver a profundidad 0
+        if conn is None or (self._local.depth == 0 and
+                            (self._local.path != self.path or not self._vigente(conn))):
+            conn = self._abrir()
+            self._local.conn = conn
+            self._local.path = self.path
+            self._local.depth = 0
+            self._aplicar_perfil(conn)
+        elif (self._local.depth == 0 and
+              self._local.perfil_aplicado != (self.active_profile(), self._profile_version)):
+            self._aplicar_perfil(conn)
+        return conn
+
+    @contextmanager
+    def cursor(self):
+        """Entrega un cursor; confirma al salir del bloque más externo o revierte si hay error."""
+        conn = self.connection()
+        if self._local.depth == 0:
+            with self._lock:
+                self._ocupadas.add(conn)
+        self._local.depth += 1
+        c = conn.cursor()
+        try:
+            yield c
+        except Exception:
+            self._local.depth -= 1
+            if self._local.depth == 0 and conn.in_transaction:
+                conn.rollback()
+            raise
+        else:
+            self._local.depth -= 1
+            if self._local.depth == 0 and conn.in_transaction:
+                conn.commit()
+        finally:
+            c.close()
+            if self._local.depth == 0:
+                self._liberar(conn)
+                self._ejecutar_pendientes()
+
+    def _liberar(self, conn: sqlite3.Connection):
+        # Fin del bloque más externo: cerrar la conexión si close_all() lo dejó pendiente
+        with self._lock:
+            self._ocupadas.discard(conn)
+            cerrar = conn in self._cerrar_al_terminar
+            self._cerrar_al_terminar.discard(conn)
+        if cerrar:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def call_after_transaction(self, callback: Callable[[], None]):
+        """Llama a `callback` al terminar la transacción más externa del hilo, o ya si no hay una.
+
+        Se llama tanto si la transacción se confirma como si se revierte; cada función se
+        registra una sola vez por transacción.
+        """
+        if getattr(self._local, 'depth', 0) == 0:
+            callback()
+            return
+        pendientes = getattr(self._local, 'pendientes', None)
+        if pendientes is None:
+            pendientes = self._local.pendientes = []
+        if callback not in pendientes:
+            pendientes.append(callback)
+
+    def _ejecutar_pendientes(self):
+        pendientes = getattr(self._local, 'pendientes', None)
+        if not pendientes:
+            return
+        self._local.pendientes = []
+        for callback in pendientes:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error en una llamada posterior a la transacción: {e}")
+
+    def close_all(self):
+        """Cierra todas las conexiones abiertas por cualquier hilo.
+
+        No toca el estado de cada hilo: la conexión de un hilo que está dentro de una
+        transacción se cierra cuando esta termina (con su commit o rollback), y cada hilo
+        abre una conexión nueva en su próximo uso.
+        """
+        with self._lock:
+            conexiones, self._conexiones = self._conexiones, set()
+            libres = [conn for conn in conexiones if conn not in self._ocupadas]
+            self._cerrar_al_terminar.update(conexiones - set(libres))
+        for conn in libres:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+# Gestor de conexiones compartido por todas las funciones del módulo
+_manager = ConnectionManager()
+atexit.register(_manager.close_all)
+
+
+def close_connections():
+    """Cierra todas las conexiones abiertas (se llama automáticamente al salir)."""
+    _manager.close_all()
+
+
+def set_pragma_profile(name: str):
+    """Activa para todas las conexiones uno de los perfiles de PRAGMA_PROFILES ('pos', 'reporting', 'bulk-import')."""
+    _manager.set_profile(name)
+
+
+def register_pragma_profile(name: str, **pragmas):
+    """Crea o reemplaza un perfil de PRAGMA (synchronous, cache_size, temp_store, busy_timeout)."""
+    PRAGMA_PROFILES[name] = dict(pragmas)
+    if _manager.profile == name:
+        _manager.set_profile(name)
+
+
+def get_pragma_profile() -> Dict[str, Any]:
+    """Devuelve el perfil activo en este hilo y los valores efectivos de sus PRAGMA en su conexión."""
+    with _cursor() as c:
+        nombre = _manager.active_profile()
+        efectivos = {}
+        for pragma in list(PRAGMA_PROFILES[nombre]) + ['journal_mode']:
+            c.execute(f'PRAGMA {pragma}')
+            row = c.fetchone()
+            efectivos[pragma] = row[0] if row else None
+    return {'nombre': nombre, 'configurado': dict(PRAGMA_PROFILES[nombre]), 'efectivo': efectivos}
+
+
+@contextmanager
+def pragma_profile(name: str):
+    """Activa temporalmente un perfil de PRAGMA dentro de un bloque `with`.
+
+    Solo afecta a la conexión del hilo que entra al bloque; los demás hilos siguen con
+    su perfil. Los bloques se pueden anidar.
+    """
+    _manager.push_profile(name)
+    try:
+        yield
+    finally:
+        _manager.pop_profile()
 
-def init_db(path: Optional[str] = None):
-    """Inicializa la base de datos SQLite y crea las tablas necesarias."""
-    if path is None:
-        path = os.path.join(os.path.dirname(__file__), 'mizu_sushi.db')
-    conn = sqlite3.connect(path)
-    c = conn.cursor()
 
+# Migraciones de esquema: cada paso recibe el cursor de la transacción de migración y se
+# ejecuta una sola vez; la versión aplicada queda registrada en la tabla schema_version.
+# Los pasos usan IF NOT EXISTS / comprobaciones de columnas para poder adoptar bases
+# creadas antes de que existiera schema_version. Para cambiar el esquema se agrega un
+# paso nuevo al final de MIGRATIONS; nunca se modifica uno ya publicado.
+
+def _m1_tablas_base(c):
     # Productos / menú
     c.execute('''
     CREATE TABLE IF NOT EXISTS products (
@@ -85,114 +376,638 @@ def init_db(path: Optional[str] = None):
     )
     ''')
 
-    conn.commit()
-    conn.close()
-    
-    # Inicializar usuarios por defecto después de crear las tablas
+
+def _columnas(c, tabla: str) -> List[str]:
+    c.execute(f'PRAGMA table_info({tabla})')
+    return [r[1] for r in c.fetchall()]
+
+
+def _m2_columna_estado(c):
+    # Bases antiguas: orders sin la columna 'estado'
+    if 'estado' not in _columnas(c, 'orders'):
+        c.execute("ALTER TABLE orders ADD COLUMN estado TEXT DEFAULT 'En preparación'")
+
+
+def _m3_columna_categoria(c):
+    # Bases antiguas: products sin la columna 'categoria'
+    if 'categoria' not in _columnas(c, 'products'):
+        c.execute("ALTER TABLE products ADD COLUMN categoria TEXT DEFAULT 'general'")
+
+
+def _m4_categorias(c):
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS categories (
+        name TEXT PRIMARY KEY
+    )
+    ''')
+    # Semillas por defecto
+    defaults = [('Rolls',), ('Especiales',), ('Vegetarianos',), ('Postres',), ('Bebidas',)]
+    c.executemany('INSERT OR IGNORE INTO categories (name) VALUES (?)', defaults)
+
+
+def _m5_usuarios_por_defecto(c):
     init_default_users()
-    
-    # Asegurar migración: si la tabla orders ya existía sin la columna 'estado', agregarla
+
+
+def _m6_order_items(c):
+    # Líneas de pedido normalizadas (una fila por producto de cada pedido)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id TEXT NOT NULL REFERENCES orders (id) ON DELETE CASCADE,
+        product_id TEXT,
+        name TEXT,
+        quantity INTEGER,
+        unit_price REAL,
+        subtotal REAL
+    )
+    ''')
+    # Pasar las líneas del JSON 'productos' de pedidos antiguos a order_items
+    _migrar_order_items()
+
+
+def _m7_secuencias(c):
+    # Secuencias para asignar números de forma atómica (p. ej. IDs de pedido)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS sequences (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    # Alinear la secuencia de pedidos con los IDs VTA### que ya existan
+    _sincronizar_secuencia_pedidos(c)
+
+
+def _crear_indices(c, *nombres: str):
+    for nombre in nombres:
+        c.execute(EXPECTED_INDEXES[nombre])
+
+
+def _m8_indices(c):
+    # Reemplazado por idx_orders_fecha_id (sirve también para la paginación por clave)
+    c.execute('DROP INDEX IF EXISTS idx_orders_fecha')
+    _crear_indices(c, 'idx_orders_estado_fecha', 'idx_orders_fecha_id', 'idx_orders_cajero_fecha',
+                   'idx_orders_metodo_pago_fecha', 'idx_products_name_nocase', 'idx_order_items_order',
+                   'idx_order_items_product', 'idx_order_items_name')
+
+
+def _m9_carrito_por_sesion(c):
+    # Carrito por terminal: columna session y una fila por (session, producto) para el upsert.
+    # SQLite no agrega restricciones UNIQUE con ALTER TABLE, así que se reconstruye la tabla;
+    # el carrito que hubiera queda asignado a la terminal que migra.
+    c.execute('''
+    CREATE TABLE cart_nuevo (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session TEXT NOT NULL,
+        product_id TEXT,
+        product_name TEXT,
+        quantity INTEGER,
+        price REAL,
+        UNIQUE (session, product_id)
+    )
+    ''')
+    c.execute('''INSERT INTO cart_nuevo (session, product_id, product_name, quantity, price)
+                 SELECT ?, product_id, MAX(product_name), SUM(quantity), MAX(price)
+                 FROM cart GROUP BY product_id ORDER BY MIN(id)''', (_cart_session,))
+    c.execute('DROP TABLE cart')
+    c.execute('ALTER TABLE cart_nuevo RENAME TO cart')
+
+
+# Tablas con seguimiento de cambios y su clave primaria
+TRACKED_TABLES: Dict[str, str] = {
+    'products': 'id',
+    'offers': 'id',
+    'orders': 'id',
+    'cart': 'id',
+    'users': 'id',
+}
+
+
+def _m10_seguimiento_cambios(c):
+    # Un contador de versión por tabla y, por cada fila tocada, la versión de su último cambio.
+    # Los triggers mantienen ambos, así que cualquier escritura (de esta u otra terminal) cuenta.
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS table_versions (
+        tabla TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS row_changes (
+        tabla TEXT NOT NULL,
+        pk TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (tabla, pk)
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_row_changes_version ON row_changes (tabla, version)')
+    for tabla in TRACKED_TABLES:
+        c.execute('INSERT OR IGNORE INTO table_versions (tabla, version) VALUES (?, 0)', (tabla,))
+    _crear_triggers_seguimiento(c)
+
+
+def _crear_triggers_seguimiento(c):
+    # Sin INSERT OR REPLACE: dentro de un trigger SQLite usa la política de conflicto de la
+    # sentencia externa, y un upsert (ON CONFLICT DO UPDATE) la convertiría en ABORT.
+    for tabla, pk in TRACKED_TABLES.items():
+        for evento, fila in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            version = f"(SELECT version FROM table_versions WHERE tabla = '{tabla}')"
+            c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{tabla}_{evento.lower()}_version AFTER {evento} ON {tabla}
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE tabla = '{tabla}';
+                UPDATE row_changes SET version = {version} WHERE tabla = '{tabla}' AND pk = {fila}.{pk};
+                INSERT INTO row_changes (tabla, pk, version)
+                    SELECT '{tabla}', {fila}.{pk}, {version}
+                    WHERE NOT EXISTS (SELECT 1 FROM row_changes WHERE tabla = '{tabla}' AND pk = {fila}.{pk});
+            END
+            ''')
+
+
+def _m11_horario_ofertas(c):
+    # Ventanas horarias diarias (happy hour, 'HH:MM') y el último estado que aplicó el
+    # programador de ofertas (NULL = nunca), para que solo actúe en los cruces de límite
+    # y no pise una activación/desactivación manual.
+    columnas = _columnas(c, 'offers')
+    for columna in ('hora_inicio TEXT', 'hora_fin TEXT', 'programada INTEGER'):
+        if columna.split()[0] not in columnas:
+            c.execute(f'ALTER TABLE offers ADD COLUMN {columna}')
+
+
+# Búsqueda de texto completo de productos (FTS5). Índice de contenido externo sobre
+# products.rid, sin acentos (remove_diacritics) y con índices de prefijo para la
+# búsqueda mientras se escribe. rid es un INTEGER PRIMARY KEY explícito: el rowid implícito
+# de una tabla con clave TEXT puede renumerarse con VACUUM y desincronizar el índice.
+# Si el SQLite no trae FTS5 no se crea y search_products devuelve None para que el
+# llamador use la búsqueda en memoria.
+_FTS_PRODUCTOS = '''CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    name, description, categoria,
+    content='products', content_rowid='rid',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+)'''
+
+_TRIGGERS_FTS_PRODUCTOS = (
+    '''CREATE TRIGGER IF NOT EXISTS trg_products_fts_insert AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts (rowid, name, description, categoria)
+            VALUES (NEW.rid, NEW.name, NEW.description, NEW.categoria);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_products_fts_delete AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name, description, categoria)
+            VALUES ('delete', OLD.rid, OLD.name, OLD.description, OLD.categoria);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_products_fts_update AFTER UPDATE OF name, description, categoria ON products BEGIN
+        INSERT INTO products_fts (products_fts, rowid, name, description, categoria)
+            VALUES ('delete', OLD.rid, OLD.name, OLD.description, OLD.categoria);
+        INSERT INTO products_fts (rowid, name, description, categoria)
+            VALUES (NEW.rid, NEW.name, NEW.description, NEW.categoria);
+    END''',
+)
+
+
+def _products_con_clave_entera(c):
+    # SQLite no agrega un INTEGER PRIMARY KEY con ALTER TABLE: se reconstruye la tabla
+    # (id pasa a UNIQUE, que sigue sirviendo para el upsert) y se recrean su índice y
+    # sus triggers de seguimiento, que se borran con la tabla.
+    if 'rid' in _columnas(c, 'products'):
+        return
+    c.execute('''
+    CREATE TABLE products_nuevo (
+        rid INTEGER PRIMARY KEY,
+        id TEXT UNIQUE,
+        name TEXT,
+        description TEXT,
+        price REAL,
+        stock INTEGER DEFAULT 50,
+        categoria TEXT DEFAULT 'general',
+        activo INTEGER DEFAULT 1
+    )
+    ''')
+    c.execute('''INSERT INTO products_nuevo (id, name, description, price, stock, categoria, activo)
+                 SELECT id, name, description, price, stock, categoria, activo FROM products ORDER BY rowid''')
+    c.execute('DROP TABLE products')
+    c.execute('ALTER TABLE products_nuevo RENAME TO products')
+    _crear_indices(c, 'idx_products_name_nocase')
+    _crear_triggers_seguimiento(c)
+
+
+def _m12_busqueda_productos(c):
+    _products_con_clave_entera(c)
     try:
-        conn = sqlite3.connect(path)
-        c = conn.cursor()
-        c.execute("PRAGMA table_info(orders)")
-        cols = [r[1] for r in c.fetchall()]
-        if 'estado' not in cols:
-            c.execute("ALTER TABLE orders ADD COLUMN estado TEXT DEFAULT 'En preparación'")
-            conn.commit()
-        conn.close()
-    except Exception:
-        # No bloquear la inicialización si la migración falla
-        pass
+        c.execute(_FTS_PRODUCTOS)
+    except sqlite3.OperationalError as e:
+        print(f"Aviso: SQLite sin FTS5 ({e}); la búsqueda de productos será en memoria")
+        return
+    for trigger in _TRIGGERS_FTS_PRODUCTOS:
+        c.execute(trigger)
+    c.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+
+# Pasos de migración en orden: (versión, descripción, función)
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, 'tablas base', _m1_tablas_base),
+    (2, 'columna orders.estado', _m2_columna_estado),
+    (3, 'columna products.categoria', _m3_columna_categoria),
+    (4, 'tabla de categorías', _m4_categorias),
+    (5, 'usuarios por defecto', _m5_usuarios_por_defecto),
+    (6, 'líneas de pedido normalizadas', _m6_order_items),
+    (7, 'secuencias de IDs', _m7_secuencias),
+    (8, 'índices secundarios', _m8_indices),
+    (9, 'carrito por terminal', _m9_carrito_por_sesion),
+    (10, 'seguimiento de cambios por tabla', _m10_seguimiento_cambios),
+    (11, 'horarios de ofertas', _m11_horario_ofertas),
+    (12, 'búsqueda de productos FTS5', _m12_busqueda_productos),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _leer_version(c) -> int:
+    try:
+        c.execute('SELECT MAX(version) FROM schema_version')
+    except sqlite3.OperationalError:
+        # Base nueva o anterior al sistema de migraciones
+        return 0
+    return c.fetchone()[0] or 0
+
+
+def schema_version() -> int:
+    """Devuelve la versión de esquema aplicada a la base de datos (0 si nunca se migró)."""
+    with _cursor() as c:
+        return _leer_version(c)
+
+
+def migrate() -> List[int]:
+    """Aplica las migraciones pendientes en una sola transacción; devuelve las versiones aplicadas.
 
-    # Asegurar migración: si la tabla products existe sin la columna 'categoria', agregarla
+    Si algún paso falla se revierte todo el lote y se propaga la excepción, de modo que la
+    base queda en la última versión completa.
+    """
+    with _cursor() as c:
+        if _leer_version(c) >= SCHEMA_VERSION:
+            return []
+
+    # Modo WAL: los lectores (reportes) no bloquean las escrituras de caja y viceversa.
+    # El modo queda guardado en el archivo y no puede cambiarse dentro de una transacción.
     try:
-        conn = sqlite3.connect(path)
-        c = conn.cursor()
-        c.execute("PRAGMA table_info(products)")
-        cols = [r[1] for r in c.fetchall()]
-        if 'categoria' not in cols:
-            # Agregar columna categoria con valor por defecto 'general'
-            c.execute("ALTER TABLE products ADD COLUMN categoria TEXT DEFAULT 'general'")
-            conn.commit()
-        conn.close()
-    except Exception:
-        # No bloquear la inicialización si la migración falla
+        _manager.connection().execute('PRAGMA journal_mode = WAL')
+    except sqlite3.DatabaseError:
         pass
 
-    # Asegurar existencia de tabla de categorías y sembrar valores por defecto
-    try:
-        conn = sqlite3.connect(path)
-        c = conn.cursor()
+    aplicadas = []
+    with _cursor() as c:
+        # BEGIN explícito: sqlite3 confirma el DDL suelto, y así todo el lote es atómico.
+        # IMMEDIATE toma el bloqueo de escritura antes de releer la versión, por si otra
+        # terminal está migrando la misma base al mismo tiempo.
+        c.execute('BEGIN IMMEDIATE')
         c.execute('''
-        CREATE TABLE IF NOT EXISTS categories (
-            name TEXT PRIMARY KEY
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            descripcion TEXT,
+            aplicada_en TEXT DEFAULT CURRENT_TIMESTAMP
         )
         ''')
-        # Semillas por defecto
-        defaults = [('Rolls',), ('Especiales',), ('Vegetarianos',), ('Postres',), ('Bebidas',)]
-        c.executemany('INSERT OR IGNORE INTO categories (name) VALUES (?)', defaults)
-        conn.commit()
-        conn.close()
-    except Exception:
-        pass
+        actual = _leer_version(c)
+        for version, descripcion, paso in MIGRATIONS:
+            if version <= actual:
+                continue
+            paso(c)
+            c.execute('INSERT INTO schema_version (version, descripcion) VALUES (?, ?)', (version, descripcion))
+            aplicadas.append(version)
+    return aplicadas
+
+
+def init_db(path: Optional[str] = None):
+    """Inicializa la base de datos SQLite aplicando las migraciones pendientes.
+
+    Con el esquema al día solo se lee la versión; los índices se comprueban tras migrar.
+    """
+    if path is not None:
+        _manager.configure(path)
+        _notificar_cambio_productos()
+
+    if migrate():
+        verificar_indices()
+
+
+# Índices esperados por las consultas de la aplicación:
+#   - pedidos activos filtran por estado y se muestran por fecha (cubre id y total)
+#   - los filtros de reportes usan fecha, cajero y metodo_pago
+#   - get_product_by_name busca sin distinguir mayúsculas
+EXPECTED_INDEXES: Dict[str, str] = {
+    'idx_orders_estado_fecha':
+        'CREATE INDEX IF NOT EXISTS idx_orders_estado_fecha ON orders (estado, fecha, id, total_final)',
+    'idx_orders_fecha_id':
+        'CREATE INDEX IF NOT EXISTS idx_orders_fecha_id ON orders (fecha, id)',
+    'idx_orders_cajero_fecha':
+        'CREATE INDEX IF NOT EXISTS idx_orders_cajero_fecha ON orders (cajero, fecha)',
+    'idx_orders_metodo_pago_fecha':
+        'CREATE INDEX IF NOT EXISTS idx_orders_metodo_pago_fecha ON orders (metodo_pago, fecha)',
+    'idx_products_name_nocase':
+        'CREATE INDEX IF NOT EXISTS idx_products_name_nocase ON products (name COLLATE NOCASE)',
+    'idx_order_items_order':
+        'CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)',
+    'idx_order_items_product':
+        'CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items (product_id, quantity, subtotal)',
+    'idx_order_items_name':
+        'CREATE INDEX IF NOT EXISTS idx_order_items_name ON order_items (name, order_id)',
+}
+
+
+def verificar_indices() -> List[str]:
+    """Comprueba que existan los índices esperados; avisa y devuelve los que falten."""
+    with _cursor() as c:
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        existentes = {r[0] for r in c.fetchall()}
+    faltantes = [nombre for nombre in EXPECTED_INDEXES if nombre not in existentes]
+    if faltantes:
+        print(f"Advertencia: faltan índices en la base de datos: {', '.join(faltantes)}")
+    return faltantes
+
+
+def table_versions() -> Dict[str, int]:
+    """Versión actual de cada tabla con seguimiento; cambia con cada fila insertada, modificada o borrada."""
+    with _cursor() as c:
+        c.execute('SELECT tabla, version FROM table_versions')
+        return dict(c.fetchall())
+
+
+def changed_since(table: str, version: int) -> List[str]:
+    """Claves primarias (como texto) de las filas de `table` cambiadas después de `version`.
+
+    Incluye las filas borradas: si la clave ya no existe en la tabla, la fila se eliminó.
+    """
+    if table not in TRACKED_TABLES:
+        raise ValueError(f"Tabla sin seguimiento de cambios: {table}")
+    with _cursor() as c:
+        c.execute('SELECT pk FROM row_changes WHERE tabla = ? AND version > ? ORDER BY version',
+                  (table, int(version)))
+        return [r[0] for r in c.fetchall()]
 
 
 def _get_conn(path: Optional[str] = None):
-    if path is None:
-        path = os.path.join(os.path.dirname(__file__), 'mizu_sushi.db')
-    return sqlite3.connect(path)
-
-
-def load_products() -> List[Dict[str, Any]]:
-    conn = _get_conn()
-    c = conn.cursor()
-    c.execute('SELECT id, name, description, price, stock, categoria, activo FROM products')
-    rows = c.fetchall()
-    conn.close()
-    productos = []
-    for r in rows:
-        productos.append({
-            'id': r[0], 
-            'nombre': r[1], 
-            'descripcion': r[2], 
-            'precio': r[3],
-            'stock': r[4] if r[4] is not None else 50,
-            'categoria': r[5] if r[5] is not None else 'general',
-            'activo': bool(r[6]) if r[6] is not None else True
-        })
-    return productos
+    """Devuelve la conexión persistente del hilo actual (ver ConnectionManager)."""
+    if path is not None:
+        _manager.configure(path)
+    return _manager.connection()
+
+
+def _cursor():
+    """Atajo para obtener un cursor transaccional del gestor de conexiones."""
+    return _manager.cursor()
+
+
+def cursor():
+    """Cursor transaccional del gestor de conexiones, para consultas de otros módulos (p. ej. reportes)."""
+    return _manager.cursor()
+
+
+# Marca de campo ausente: el registro se comporta como un dict al que le falta esa clave
+_AUSENTE = object()
+
+
+class Record(MutableMapping):
+    """Registro compacto con __slots__ y acceso estilo diccionario.
+
+    Las funciones de carga devuelven estos registros en lugar de un dict por fila: los
+    campos viven en slots (sin un dict de claves repetidas por registro) y la interfaz
+    sigue usando r['clave'], r.get(), 'clave' in r, dict(r), etc. Las claves que no son
+    campos del registro se guardan aparte en _extra, que solo se crea si hace falta.
+    """
+
+    __slots__ = ('_extra',)
+    _campos: Tuple[str, ...] = ()
+    # Campos de texto repetidos entre registros (nombres, cajeros...) que se internan
+    _internados: Tuple[str, ...] = ()
+
+    def __init__(self, *valores, **campos):
+        self._extra = None
+        for nombre, valor in zip(self._campos, valores):
+            object.__setattr__(self, nombre, valor)
+        for nombre in self._campos[len(valores):]:
+            object.__setattr__(self, nombre, campos.pop(nombre, _AUSENTE))
+        for nombre in self._internados:
+            valor = getattr(self, nombre)
+            if type(valor) is str:
+                object.__setattr__(self, nombre, sys.intern(valor))
+        if campos:
+            self._extra = campos
+
+    @classmethod
+    def from_mapping(cls, datos: Mapping[str, Any]):
+        """Crea el registro a partir de un dict (p. ej. una línea del JSON de productos)."""
+        return cls(**datos)
+
+    def __getitem__(self, clave):
+        if clave in self._campos:
+            valor = getattr(self, clave)
+            if valor is not _AUSENTE:
+                return valor
+        elif self._extra is not None and clave in self._extra:
+            return self._extra[clave]
+        raise KeyError(clave)
+
+    def __setitem__(self, clave, valor):
+        if clave in self._campos:
+            object.__setattr__(self, clave, valor)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[clave] = valor
+
+    def __delitem__(self, clave):
+        if clave in self._campos:
+            if getattr(self, clave) is _AUSENTE:
+                raise KeyError(clave)
+            object.__setattr__(self, clave, _AUSENTE)
+        elif self._extra is not None and clave in self._extra:
+            del self._extra[clave]
+        else:
+            raise KeyError(clave)
+
+    def __iter__(self):
+        for nombre in self._campos:
+            if getattr(self, nombre) is not _AUSENTE:
+                yield nombre
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+
+    def copy(self):
+        return type(self).from_mapping(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Copia como dict simple (los valores anidados no se convierten)."""
+        return dict(self)
+
+
+def json_default(obj):
+    """Para json.dump(..., default=db.json_default): serializa los registros como dicts."""
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class Product(Record):
+    __slots__ = _campos = ('id', 'nombre', 'descripcion', 'precio', 'stock', 'categoria', 'activo')
+    _internados = ('nombre', 'categoria')
+
+
+class OrderLine(Record):
+    __slots__ = _campos = ('id', 'nombre', 'cantidad', 'precio', 'subtotal')
+    _internados = ('nombre',)
+
+
+# Marca de 'productos' aún sin decodificar (el JSON crudo queda en Order._productos_json)
+_SIN_DECODIFICAR = object()
+
+
+class Order(Record):
+    """Pedido; las líneas ('productos') se decodifican del JSON la primera vez que se leen.
+
+    Las pantallas que solo muestran id, fecha, total o estado nunca pagan el json.loads.
+    """
+
+    _campos = ('id', 'fecha', 'productos', 'oferta_aplicada', 'descuento_aplicado',
+               'total_sin_descuento', 'total_final', 'metodo_pago', 'cajero', 'estado')
+    __slots__ = _campos + ('_productos_json',)
+    _internados = ('oferta_aplicada', 'metodo_pago', 'cajero', 'estado')
+
+    def __init__(self, *valores, **campos):
+        self._productos_json = None
+        super().__init__(*valores, **campos)
+
+    def __getitem__(self, clave):
+        if clave == 'productos' and self.productos is _SIN_DECODIFICAR:
+            try:
+                productos = _order_lines(json.loads(self._productos_json))
+            except Exception:
+                productos = []
+            self.productos = productos
+            self._productos_json = None
+        return Record.__getitem__(self, clave)
+
+    def __setitem__(self, clave, valor):
+        if clave == 'productos':
+            self._productos_json = None
+        Record.__setitem__(self, clave, valor)
+
+    def productos_json(self) -> Optional[str]:
+        """JSON crudo de las líneas si todavía no se decodificaron; None en otro caso."""
+        return self._productos_json if self.productos is _SIN_DECODIFICAR else None
+
+
+def _product_from_row(r, stock_por_defecto: int = 50) -> Product:
+    return Product(
+        r[0],
+        r[1],
+        r[2],
+        r[3],
+        r[4] if r[4] is not None else stock_por_defecto,
+        r[5] if r[5] is not None else 'general',
+        bool(r[6]) if r[6] is not None else True
+    )
+
+
+# Funciones que se llaman cada vez que este proceso modifica productos (p. ej. para
+# invalidar el caché de catalogo). Dentro de una transacción se llaman al terminarla, para
+# que nadie recargue datos aún sin confirmar. Los cambios de otras terminales se detectan
+# con table_versions().
+_product_listeners: List[Callable[[], None]] = []
+
+
+def on_products_changed(callback: Callable[[], None]):
+    """Registra una función sin argumentos que se llama tras cada cambio de productos."""
+    if callback not in _product_listeners:
+        _product_listeners.append(callback)
+
+
+def _notificar_cambio_productos():
+    _manager.call_after_transaction(_llamar_listeners_productos)
+
+
+def _llamar_listeners_productos():
+    for callback in list(_product_listeners):
+        try:
+            callback()
+        except Exception as e:
+            print(f"Error notificando cambio de productos: {e}")
+
+
+def load_products() -> List[Product]:
+    with _cursor() as c:
+        c.execute('SELECT id, name, description, price, stock, categoria, activo FROM products')
+        rows = c.fetchall()
+    return [_product_from_row(r) for r in rows]
+
+
+# Upsert en lugar de REPLACE: REPLACE borra la fila sin disparar los triggers de borrado
+# (recursive_triggers está apagado) y dejaría entradas huérfanas en products_fts
+_UPSERT_PRODUCT = '''INSERT INTO products (id, name, description, price, stock, categoria, activo) VALUES (?, ?, ?, ?, ?, ?, ?)
+                     ON CONFLICT (id) DO UPDATE SET name = excluded.name, description = excluded.description,
+                         price = excluded.price, stock = excluded.stock, categoria = excluded.categoria,
+                         activo = excluded.activo'''
+
+
+def _product_row(prod: Dict[str, Any]) -> tuple:
+    return (prod.get('id'), 
+            prod.get('nombre'), 
+            prod.get('descripcion', ''), 
+            float(prod.get('precio', 0)),
+            int(prod.get('stock', 50)),
+            prod.get('categoria', 'general'),
+            int(bool(prod.get('activo', True))))
 
 
 def save_product(prod: Dict[str, Any]):
-    conn = _get_conn()
-    c = conn.cursor()
-    c.execute('REPLACE INTO products (id, name, description, price, stock, categoria, activo) VALUES (?, ?, ?, ?, ?, ?, ?)',
-              (prod.get('id'), 
-               prod.get('nombre'), 
-               prod.get('descripcion', ''), 
-               float(prod.get('precio', 0)),
-               int(prod.get('stock', 50)),
-               prod.get('categoria', 'general'),
-               int(bool(prod.get('activo', True)))))
-    conn.commit()
-    conn.close()
+    with _cursor() as c:
+        c.execute(_UPSERT_PRODUCT, _product_row(prod))
+    _notificar_cambio_productos()
 
 
 def delete_product(product_id: str):
-    conn = _get_conn()
-    c = conn.cursor()
-    c.execute('DELETE FROM products WHERE id = ?', (product_id,))
-    conn.commit()
-    conn.close()
+    with _cursor() as c:
+        c.execute('DELETE FROM products WHERE id = ?', (product_id,))
+    _notificar_cambio_productos()
+
+
+def _consulta_fts(texto: str) -> str:
+    # Cada palabra entre comillas (sin sintaxis FTS del usuario) y como prefijo; todas deben aparecer
+    return ' '.join('"%s"*' % palabra.replace('"', '""') for palabra in re.findall(r'\w+', texto))
+
+
+def search_products(texto: str, limit: Optional[int] = None) -> Optional[List[str]]:
+    """IDs de productos que coinciden con `texto`, ordenados por relevancia (bm25).
+
+    Coincide por prefijo de palabra y sin distinguir acentos ni mayúsculas ("salmon" encuentra
+    "Salmón"); el nombre pesa más que la descripción y la categoría. Devuelve None si no hay
+    índice FTS5 (o la consulta falla), para que el llamador busque en memoria.
+    """
+    consulta = _consulta_fts(texto or '')
+    if not consulta:
+        return []
+    sql = '''SELECT p.id FROM products_fts JOIN products p ON p.rid = products_fts.rowid
+             WHERE products_fts MATCH ? ORDER BY bm25(products_fts, 10.0, 2.0, 1.0)'''
+    params: List[Any] = [consulta]
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(int(limit))
+    try:
+        with _cursor() as c:
+            c.execute(sql, params)
+            return [r[0] for r in c.fetchall()]
+    except sqlite3.OperationalError:
+        return None
 
 
 def load_offers() -> List[Dict[str, Any]]:
-    conn = _get_conn()
-    c = conn.cursor()
-    c.execute('SELECT id, name, description, type, products_aplicables, descuento, activa, fecha_inicio, fecha_fin FROM offers')
-    rows = c.fetchall()
-    conn.close()
+    with _cursor() as c:
+        c.execute('SELECT id, name, description, type, products_aplicables, descuento, activa, fecha_inicio, fecha_fin, hora_inicio, hora_fin FROM offers')
+        rows = c.fetchall()
     ofertas = []
     for r in rows:
         try:
@@ -208,119 +1023,93 @@ def load_offers() -> List[Dict[str, Any]]:
             'descuento': r[5],
             'activa': bool(r[6]),
             'fecha_inicio': r[7],
-            'fecha_fin': r[8]
+            'fecha_fin': r[8],
+            'hora_inicio': r[9],
+            'hora_fin': r[10]
         })
     return ofertas
 
 
-def save_offer(oferta: Dict[str, Any]):
-    conn = _get_conn()
-    c = conn.cursor()
+# Upsert en lugar de REPLACE: conserva la columna 'programada' del programador de ofertas
+_UPSERT_OFFER = '''INSERT INTO offers (id, name, description, type, products_aplicables, descuento, activa, fecha_inicio, fecha_fin, hora_inicio, hora_fin)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (id) DO UPDATE SET name = excluded.name, description = excluded.description, type = excluded.type,
+                       products_aplicables = excluded.products_aplicables, descuento = excluded.descuento, activa = excluded.activa,
+                       fecha_inicio = excluded.fecha_inicio, fecha_fin = excluded.fecha_fin,
+                       hora_inicio = excluded.hora_inicio, hora_fin = excluded.hora_fin'''
+
+
+def _offer_row(oferta: Dict[str, Any]) -> tuple:
     productos_json = json.dumps(oferta.get('productos_aplicables', []), ensure_ascii=False)
-    c.execute('REPLACE INTO offers (id, name, description, type, products_aplicables, descuento, activa, fecha_inicio, fecha_fin) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
-              (oferta.get('id'), oferta.get('nombre'), oferta.get('descripcion'), oferta.get('tipo'), productos_json,
-               int(oferta.get('descuento', 0)), int(bool(oferta.get('activa', True))), oferta.get('fecha_inicio'), oferta.get('fecha_fin')))
-    conn.commit()
-    conn.close()
+    return (oferta.get('id'), oferta.get('nombre'), oferta.get('descripcion'), oferta.get('tipo'), productos_json,
+            int(oferta.get('descuento', 0)), int(bool(oferta.get('activa', True))), oferta.get('fecha_inicio'), oferta.get('fecha_fin'),
+            oferta.get('hora_inicio') or None, oferta.get('hora_fin') or None)
+
+
+def save_offer(oferta: Dict[str, Any]):
+    with _cursor() as c:
+        c.execute(_UPSERT_OFFER, _offer_row(oferta))
 
 
 def load_categories() -> List[str]:
     """Devuelve la lista de categorías únicas de productos."""
-    conn = _get_conn()
-    c = conn.cursor()
     try:
-        # Intentar cargar desde la tabla categories si existe
-        try:
-            c.execute('SELECT name FROM categories ORDER BY name COLLATE NOCASE')
+        with _cursor() as c:
+            # Intentar cargar desde la tabla categories si existe
+            try:
+                c.execute('SELECT name FROM categories ORDER BY name COLLATE NOCASE')
+                rows = c.fetchall()
+                if rows:
+                    return [r[0] for r in rows if r and r[0]]
+            except Exception:
+                # Si no existe la tabla categories, fallback a distinct en products
+                pass
+
+            c.execute("SELECT DISTINCT categoria FROM products WHERE categoria IS NOT NULL")
             rows = c.fetchall()
-            if rows:
-                return [r[0] for r in rows if r and r[0]]
-        except Exception:
-            # Si no existe la tabla categories, fallback a distinct en products
-            pass
-
-        c.execute("SELECT DISTINCT categoria FROM products WHERE categoria IS NOT NULL")
-        rows = c.fetchall()
-        return [r[0] for r in rows if r and r[0]]
+            return [r[0] for r in rows if r and r[0]]
     except Exception:
         return []
-    finally:
-        conn.close()
 
 
 def set_product_category(product_id: str, categoria: str):
     """Establece/actualiza la categoría de un producto dado."""
-    conn = _get_conn()
-    c = conn.cursor()
-    try:
+    with _cursor() as c:
         c.execute('UPDATE products SET categoria = ? WHERE id = ?', (categoria, product_id))
-        conn.commit()
-    finally:
-        conn.close()
+    _notificar_cambio_productos()
 
 
 def add_category(name: str):
     """Agrega una categoría a la tabla categories (ignora si ya existe)."""
-    conn = _get_conn()
-    c = conn.cursor()
-    try:
+    with _cursor() as c:
         c.execute('INSERT OR IGNORE INTO categories (name) VALUES (?)', (name,))
-        conn.commit()
-    finally:
-        conn.close()
 
 
-def get_product_by_id(product_id: str) -> Optional[Dict[str, Any]]:
-    conn = _get_conn()
-    c = conn.cursor()
-    try:
+def get_product_by_id(product_id: str) -> Optional[Product]:
+    with _cursor() as c:
         c.execute('SELECT id, name, description, price, stock, categoria, activo FROM products WHERE id = ?', (product_id,))
         r = c.fetchone()
-        if not r:
-            return None
-        return {
-            'id': r[0],
-            'nombre': r[1],
-            'descripcion': r[2],
-            'precio': r[3],
-            'stock': r[4] if r[4] is not None else 0,
-            'categoria': r[5] if r[5] is not None else 'general',
-            'activo': bool(r[6]) if r[6] is not None else True
-        }
-    finally:
-        conn.close()
+    if not r:
+        return None
+    return _product_from_row(r, stock_por_defecto=0)
 
 
-def get_product_by_name(name: str) -> Optional[Dict[str, Any]]:
-    conn = _get_conn()
-    c = conn.cursor()
-    try:
+def get_product_by_name(name: str) -> Optional[Product]:
+    with _cursor() as c:
         c.execute('SELECT id, name, description, price, stock, categoria, activo FROM products WHERE name = ?', (name,))
         r = c.fetchone()
         if not r:
-            # Try case-insensitive match
-            c.execute('SELECT id, name, description, price, stock, categoria, activo FROM products WHERE LOWER(name) = LOWER(?)', (name,))
+            # Try case-insensitive match (usa idx_products_name_nocase)
+            c.execute('SELECT id, name, description, price, stock, categoria, activo FROM products WHERE name = ? COLLATE NOCASE', (name,))
             r = c.fetchone()
-            if not r:
-                return None
-        return {
-            'id': r[0],
-            'nombre': r[1],
-            'descripcion': r[2],
-            'precio': r[3],
-            'stock': r[4] if r[4] is not None else 0,
-            'categoria': r[5] if r[5] is not None else 'general',
-            'activo': bool(r[6]) if r[6] is not None else True
-        }
-    finally:
-        conn.close()
+    if not r:
+        return None
+    return _product_from_row(r, stock_por_defecto=0)
 
 
 def update_product_stock(product_id: str, delta: int) -> int:
     """Ajusta el stock del producto por delta (positivo o negativo). Devuelve el stock resultante."""
-    conn = _get_conn()
-    c = conn.cursor()
-    try:
+    with _cursor() as c:
         c.execute('SELECT stock FROM products WHERE id = ?', (product_id,))
         r = c.fetchone()
         if not r:
@@ -330,200 +1119,745 @@ def update_product_stock(product_id: str, delta: int) -> int:
         if new_stock < 0:
             new_stock = 0
         c.execute('UPDATE products SET stock = ? WHERE id = ?', (new_stock, product_id))
-        conn.commit()
-        return new_stock
-    finally:
-        conn.close()
+    _notificar_cambio_productos()
+    return new_stock
+
+
+# Ajuste de stock en una sola sentencia (sin leer antes): la línea se resuelve por nombre
+# (primero coincidencia exacta, luego sin distinguir mayúsculas) y, si no, por su id.
+_APPLY_STOCK_DELTA = '''UPDATE products SET stock = MAX(0, COALESCE(stock, 0) + ?)
+    WHERE id = COALESCE(
+        (SELECT id FROM products WHERE name = ? COLLATE NOCASE ORDER BY name = ? DESC LIMIT 1),
+        ?)'''
+
+
+def _stock_delta_rows(order: Dict[str, Any], signo: int = -1) -> List[tuple]:
+    filas = []
+    for item in order.get('productos', []) or []:
+        if not isinstance(item, Mapping):
+            continue
+        cantidad = int(item.get('cantidad', 0) or 0)
+        if cantidad == 0:
+            continue
+        nombre = item.get('nombre')
+        filas.append((signo * cantidad, nombre, nombre, item.get('id')))
+    return filas
+
+
+def apply_stock_deltas(order: Dict[str, Any], signo: int = -1) -> int:
+    """Descuenta (signo=-1) o repone (signo=1) el stock de todas las líneas de un pedido
+    en una sola transacción. Devuelve el número de productos actualizados."""
+    return apply_stock_deltas_many([order], signo)
+
+
+def apply_stock_deltas_many(orders: List[Dict[str, Any]], signo: int = -1) -> int:
+    """Como apply_stock_deltas, pero para muchos pedidos con un único executemany."""
+    filas = []
+    for order in orders or []:
+        filas.extend(_stock_delta_rows(order, signo))
+    if not filas:
+        return 0
+    with _cursor() as c:
+        c.executemany(_APPLY_STOCK_DELTA, filas)
+        actualizados = c.rowcount
+    _notificar_cambio_productos()
+    return actualizados
 
 
 def delete_offer(oferta_id: str):
-    conn = _get_conn()
-    c = conn.cursor()
-    c.execute('DELETE FROM offers WHERE id = ?', (oferta_id,))
-    conn.commit()
-    conn.close()
+    with _cursor() as c:
+        c.execute('DELETE FROM offers WHERE id = ?', (oferta_id,))
 
 
 def toggle_offer(oferta_id: str, activo: bool):
-    conn = _get_conn()
-    c = conn.cursor()
-    c.execute('UPDATE offers SET activa = ? WHERE id = ?', (int(bool(activo)), oferta_id))
-    conn.commit()
-    conn.close()
-
-
-def load_orders() -> List[Dict[str, Any]]:
-    conn = _get_conn()
-    c = conn.cursor()
-    c.execute('SELECT id, fecha, productos, oferta_aplicada, descuento_aplicado, total_sin_descuento, total_final, metodo_pago, cajero, estado FROM orders')
-    rows = c.fetchall()
-    conn.close()
-    orders = []
-    for r in rows:
-        try:
-            productos = json.loads(r[2])
-        except Exception:
-            productos = []
-        orders.append({
-            'id': r[0],
-            'fecha': r[1],
-            'productos': productos,
-            'oferta_aplicada': r[3],
-            'descuento_aplicado': r[4],
-            'total_sin_descuento': r[5],
-            'total_final': r[6],
-            'metodo_pago': r[7],
-            'cajero': r[8],
-            'estado': r[9] if len(r) > 9 else 'En preparación'
-        })
-    return orders
+    with _cursor() as c:
+        c.execute('UPDATE offers SET activa = ? WHERE id = ?', (int(bool(activo)), oferta_id))
 
 
-def save_order(order: Dict[str, Any]):
-    conn = _get_conn()
-    c = conn.cursor()
-    productos_json = json.dumps(order.get('productos', []), ensure_ascii=False)
-    c.execute('REPLACE INTO orders (id, fecha, productos, oferta_aplicada, descuento_aplicado, total_sin_descuento, total_final, metodo_pago, cajero, estado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-              (order.get('id'), order.get('fecha'), productos_json, order.get('oferta_aplicada'), float(order.get('descuento_aplicado', 0)),
-               float(order.get('total_sin_descuento', 0)), float(order.get('total_final', 0)), order.get('metodo_pago'), order.get('cajero'), order.get('estado', 'En preparación')))
-    conn.commit()
-    conn.close()
-
-
-def add_cart_item(product_id: str, product_name: str, quantity: int, price: float):
-    conn = _get_conn()
-    c = conn.cursor()
-    # Si el item ya existe, incrementar cantidad
-    c.execute('SELECT id, quantity FROM cart WHERE product_id = ?', (product_id,))
-    row = c.fetchone()
-    if row:
-        new_q = row[1] + quantity
-        c.execute('UPDATE cart SET quantity = ? WHERE id = ?', (new_q, row[0]))
+def load_offer_schedule_states() -> Dict[str, Optional[bool]]:
+    """{id de oferta: último estado aplicado por el programador (None = nunca)}."""
+    with _cursor() as c:
+        c.execute('SELECT id, programada FROM offers')
+        return {r[0]: (None if r[1] is None else bool(r[1])) for r in c.fetchall()}
+
+
+def apply_offer_schedule(estados: Dict[str, bool]) -> int:
+    """Aplica en un solo UPDATE los estados programados {id: activa}; devuelve las filas tocadas.
+
+    Escribe 'activa' y 'programada' a la vez, así el próximo ciclo ve el cruce ya aplicado.
+    """
+    if not estados:
+        return 0
+    ids = list(estados)
+    activar = [i for i in ids if estados[i]]
+    if activar:
+        estado = f"CASE WHEN id IN ({', '.join('?' * len(activar))}) THEN 1 ELSE 0 END"
     else:
-        c.execute('INSERT INTO cart (product_id, product_name, quantity, price) VALUES (?, ?, ?, ?)',
-                  (product_id, product_name, int(quantity), float(price)))
-    conn.commit()
-    conn.close()
-
-
-def get_cart_items() -> List[Dict[str, Any]]:
-    conn = _get_conn()
-    c = conn.cursor()
-    c.execute('SELECT id, product_id, product_name, quantity, price FROM cart')
-    rows = c.fetchall()
-    conn.close()
+        estado = '0'
+    with _cursor() as c:
+        c.execute(f"UPDATE offers SET activa = {estado}, programada = {estado} WHERE id IN ({', '.join('?' * len(ids))})",
+                  activar + activar + ids)
+        return c.rowcount
+
+
+_ORDER_COLUMNS = 'id, fecha, productos, oferta_aplicada, descuento_aplicado, total_sin_descuento, total_final, metodo_pago, cajero, estado'
+
+
+def _order_lines(productos) -> list:
+    return [OrderLine.from_mapping(p) if isinstance(p, dict) else p for p in productos or []]
+
+
+def _order_from_row(r) -> Order:
+    # Las líneas quedan como JSON crudo hasta que alguien lea order['productos']
+    order = Order(r[0], r[1], _SIN_DECODIFICAR, r[3], r[4], r[5], r[6], r[7], r[8],
+                  r[9] if len(r) > 9 else 'En preparación')
+    order._productos_json = r[2]
+    return order
+
+
+def load_orders() -> List[Order]:
+    with _cursor() as c:
+        c.execute(f'SELECT {_ORDER_COLUMNS} FROM orders')
+        rows = c.fetchall()
+    return [_order_from_row(r) for r in rows]
+
+
+def get_order(order_id: str) -> Optional[Order]:
+    """Devuelve un pedido por su ID, o None si no existe."""
+    with _cursor() as c:
+        c.execute(f'SELECT {_ORDER_COLUMNS} FROM orders WHERE id = ?', (order_id,))
+        r = c.fetchone()
+    return _order_from_row(r) if r else None
+
+
+def delete_order(order_id: str) -> bool:
+    """Elimina un pedido y sus líneas (order_items, en cascada). Devuelve False si no existía."""
+    with _cursor() as c:
+        c.execute('DELETE FROM orders WHERE id = ?', (order_id,))
+        return c.rowcount > 0
+
+
+def _order_item_rows(order_id: str, productos: List[Dict[str, Any]]) -> List[tuple]:
+    """Convierte las líneas de un pedido en filas para order_items."""
+    filas = []
+    for item in productos or []:
+        if not isinstance(item, Mapping):
+            continue
+        cantidad = int(item.get('cantidad', 0) or 0)
+        precio = float(item.get('precio', 0) or 0)
+        subtotal = item.get('subtotal')
+        subtotal = float(subtotal) if subtotal is not None else cantidad * precio
+        nombre = item.get('nombre')
+        filas.append((order_id, item.get('id'), nombre, nombre, cantidad, precio, subtotal))
+    return filas
+
+
+# Si la línea no trae id de producto se resuelve por nombre (usa idx_products_name_nocase)
+_INSERT_ORDER_ITEM = '''INSERT INTO order_items (order_id, product_id, name, quantity, unit_price, subtotal)
+    VALUES (?, COALESCE(?, (SELECT id FROM products WHERE name = ? COLLATE NOCASE LIMIT 1)), ?, ?, ?, ?)'''
+
+
+def _migrar_order_items():
+    """Crea las filas de order_items de los pedidos que aún solo tienen el JSON 'productos'."""
+    with _cursor() as c:
+        c.execute('''SELECT id, productos FROM orders o
+                     WHERE NOT EXISTS (SELECT 1 FROM order_items i WHERE i.order_id = o.id)
+                       AND productos IS NOT NULL AND productos NOT IN ('', '[]')''')
+        pendientes = c.fetchall()
+        filas = []
+        for order_id, productos_json in pendientes:
+            try:
+                filas.extend(_order_item_rows(order_id, json.loads(productos_json)))
+            except Exception:
+                continue
+        if filas:
+            c.executemany(_INSERT_ORDER_ITEM, filas)
+
+
+_REPLACE_ORDER = 'REPLACE INTO orders (id, fecha, productos, oferta_aplicada, descuento_aplicado, total_sin_descuento, total_final, metodo_pago, cajero, estado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+_INSERT_ORDER = 'INSERT INTO orders (id, fecha, productos, oferta_aplicada, descuento_aplicado, total_sin_descuento, total_final, metodo_pago, cajero, estado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+
+
+def _order_row(order: Dict[str, Any]) -> tuple:
+    # El JSON se mantiene como copia de compatibilidad para load_orders y los respaldos
+    productos_json = order.productos_json() if isinstance(order, Order) else None
+    if productos_json is None:
+        productos_json = json.dumps(order.get('productos', []), ensure_ascii=False, default=json_default)
+    return (order.get('id'), order.get('fecha'), productos_json, order.get('oferta_aplicada'), float(order.get('descuento_aplicado', 0)),
+            float(order.get('total_sin_descuento', 0)), float(order.get('total_final', 0)), order.get('metodo_pago'), order.get('cajero'), order.get('estado', 'En preparación'))
+
+
+def save_order(order: Dict[str, Any]):
+    with _cursor() as c:
+        c.execute(_REPLACE_ORDER, _order_row(order))
+        c.execute('DELETE FROM order_items WHERE order_id = ?', (order.get('id'),))
+        c.executemany(_INSERT_ORDER_ITEM, _order_item_rows(order.get('id'), order.get('productos', [])))
+
+
+# Prefijo y ancho mínimo de los IDs de pedido (VTA001 ... VTA999, VTA1000, ...)
+ORDER_ID_PREFIX = 'VTA'
+ORDER_ID_MIN_DIGITS = 3
+
+
+def _sincronizar_secuencia_pedidos(c):
+    """Lleva la secuencia 'orders' al mayor número VTA### existente (tras migrar o restaurar)."""
+    c.execute("INSERT OR IGNORE INTO sequences (name, value) VALUES ('orders', 0)")
+    c.execute('''UPDATE sequences SET value = MAX(value, (
+                     SELECT COALESCE(MAX(CAST(substr(id, ?) AS INTEGER)), 0) FROM orders
+                     WHERE id LIKE ? || '%' AND substr(id, ?) NOT GLOB '*[^0-9]*'))
+                 WHERE name = ?''',
+              (len(ORDER_ID_PREFIX) + 1, ORDER_ID_PREFIX, len(ORDER_ID_PREFIX) + 1, 'orders'))
+
+
+def _siguiente_valor(c, nombre: str) -> int:
+    # El UPDATE toma el bloqueo de escritura, así que nadie más puede leer el mismo valor
+    c.execute('UPDATE sequences SET value = value + 1 WHERE name = ?', (nombre,))
+    if c.rowcount == 0:
+        c.execute('INSERT INTO sequences (name, value) VALUES (?, 1)', (nombre,))
+    c.execute('SELECT value FROM sequences WHERE name = ?', (nombre,))
+    return c.fetchone()[0]
+
+
+def create_order(order: Dict[str, Any]) -> str:
+    """Inserta un pedido nuevo asignándole el siguiente ID (VTA###) en la misma transacción.
+
+    El ID se guarda también en order['id'] y se devuelve. A diferencia de save_order, nunca
+    reemplaza un pedido existente: un ID repetido produce sqlite3.IntegrityError.
+    """
+    with _cursor() as c:
+        numero = _siguiente_valor(c, 'orders')
+        order['id'] = f"{ORDER_ID_PREFIX}{numero:0{ORDER_ID_MIN_DIGITS}d}"
+        c.execute(_INSERT_ORDER, _order_row(order))
+        c.executemany(_INSERT_ORDER_ITEM, _order_item_rows(order['id'], order.get('productos', [])))
+    return order['id']
+
+
+# Tamaño de lote por defecto para las escrituras masivas
+BULK_CHUNK_SIZE = 500
+
+
+def transaction():
+    """Agrupa varias llamadas de db.* en una sola transacción (todo o nada).
+
+    Uso: ``with db.transaction(): db.save_products_bulk(...); db.save_orders_bulk(...)``
+    """
+    return _manager.cursor()
+
+
+def _bulk_write(items: List[Dict[str, Any]], escribir_lote, chunk_size: Optional[int], progress) -> int:
+    """Escribe `items` por lotes dentro de una única transacción, informando el avance."""
+    items = list(items or [])
+    total = len(items)
+    chunk_size = max(1, int(chunk_size or BULK_CHUNK_SIZE))
+    with _cursor() as c:
+        for inicio in range(0, total, chunk_size):
+            escribir_lote(c, items[inicio:inicio + chunk_size])
+            if progress is not None:
+                progress(min(inicio + chunk_size, total), total)
+    return total
+
+
+def save_products_bulk(productos: List[Dict[str, Any]], chunk_size: Optional[int] = None, progress=None) -> int:
+    """Guarda muchos productos en una transacción. `progress(hechos, total)` se llama por lote."""
+    def escribir_lote(c, lote):
+        c.executemany(_UPSERT_PRODUCT, [_product_row(p) for p in lote])
+    try:
+        return _bulk_write(productos, escribir_lote, chunk_size, progress)
+    finally:
+        _notificar_cambio_productos()
+
+
+def save_offers_bulk(ofertas: List[Dict[str, Any]], chunk_size: Optional[int] = None, progress=None) -> int:
+    """Guarda muchas ofertas en una transacción. `progress(hechos, total)` se llama por lote."""
+    def escribir_lote(c, lote):
+        c.executemany(_UPSERT_OFFER, [_offer_row(o) for o in lote])
+    return _bulk_write(ofertas, escribir_lote, chunk_size, progress)
+
+
+def save_orders_bulk(orders: List[Dict[str, Any]], chunk_size: Optional[int] = None, progress=None) -> int:
+    """Guarda muchos pedidos (y sus order_items) en una transacción. `progress(hechos, total)` se llama por lote."""
+    def escribir_lote(c, lote):
+        c.executemany(_REPLACE_ORDER, [_order_row(o) for o in lote])
+        c.executemany('DELETE FROM order_items WHERE order_id = ?', [(o.get('id'),) for o in lote])
+        filas = []
+        for o in lote:
+            filas.extend(_order_item_rows(o.get('id'), o.get('productos', [])))
+        c.executemany(_INSERT_ORDER_ITEM, filas)
+        _sincronizar_secuencia_pedidos(c)
+    return _bulk_write(orders, escribir_lote, chunk_size, progress)
+
+
+def _where_orders(fecha_desde=None, fecha_hasta=None, producto: Optional[str] = None,
+                  metodo_pago: Optional[str] = None, cajero: Optional[str] = None,
+                  estado: Optional[str] = None, producto_parcial: bool = False):
+    """Construye el WHERE parametrizado de los filtros de pedidos (None = sin filtrar)."""
+    condiciones: List[str] = []
+    params: List[Any] = []
+    if fecha_desde:
+        # Comparación de texto sobre 'YYYY-MM-DD HH:MM:SS': usa los índices que empiezan por fecha
+        condiciones.append('o.fecha >= ?')
+        params.append(str(fecha_desde)[:10])
+    if fecha_hasta:
+        condiciones.append("o.fecha < date(?, '+1 day')")
+        params.append(str(fecha_hasta)[:10])
+    if producto:
+        if producto_parcial:
+            condiciones.append("EXISTS (SELECT 1 FROM order_items i WHERE i.order_id = o.id AND i.name LIKE ? ESCAPE '\\')")
+            params.append('%' + producto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        else:
+            condiciones.append('EXISTS (SELECT 1 FROM order_items i WHERE i.order_id = o.id AND i.name = ?)')
+            params.append(producto)
+    if metodo_pago:
+        condiciones.append('o.metodo_pago = ?')
+        params.append(metodo_pago)
+    if cajero:
+        condiciones.append('o.cajero = ?')
+        params.append(cajero)
+    if estado:
+        condiciones.append('o.estado = ?')
+        params.append(estado)
+    where = ('WHERE ' + ' AND '.join(condiciones)) if condiciones else ''
+    return where, params
+
+
+# Campos por los que se pueden ordenar los pedidos en query_orders (desempate por id)
+ORDER_SORT_FIELDS = ('fecha', 'id', 'total_final', 'total_sin_descuento', 'descuento_aplicado',
+                     'oferta_aplicada', 'metodo_pago', 'cajero', 'estado')
+
+
+def query_orders(fecha_desde=None, fecha_hasta=None, producto: Optional[str] = None,
+                 metodo_pago: Optional[str] = None, cajero: Optional[str] = None,
+                 estado: Optional[str] = None, limit: Optional[int] = None, offset: int = 0,
+                 producto_parcial: bool = False, order_by: str = 'fecha', direction: str = 'desc') -> List[Order]:
+    """Devuelve los pedidos que cumplen los filtros, más recientes primero.
+
+    Las fechas son 'YYYY-MM-DD' (o date/datetime) e incluyen ambos extremos. `producto`
+    compara el nombre exacto de una línea; con producto_parcial=True busca el texto dentro
+    del nombre sin distinguir mayúsculas. Los filtros con valor None o vacío se ignoran.
+    `order_by` (uno de ORDER_SORT_FIELDS) y `direction` cambian el orden.
+    """
+    if order_by not in ORDER_SORT_FIELDS:
+        raise ValueError(f"order_by debe ser uno de {ORDER_SORT_FIELDS}")
+    if direction not in ('asc', 'desc'):
+        raise ValueError("direction debe ser 'asc' o 'desc'")
+    orden = 'DESC' if direction == 'desc' else 'ASC'
+    where, params = _where_orders(fecha_desde, fecha_hasta, producto, metodo_pago, cajero, estado, producto_parcial)
+    sql = f'SELECT {_ORDER_COLUMNS} FROM orders o {where} ORDER BY o.{order_by} {orden}, o.id {orden}'
+    if limit is not None or offset:
+        sql += ' LIMIT ? OFFSET ?'
+        params.extend([-1 if limit is None else int(limit), int(offset or 0)])
+    with _cursor() as c:
+        c.execute(sql, params)
+        rows = c.fetchall()
+    return [_order_from_row(r) for r in rows]
+
+
+def count_orders(fecha_desde=None, fecha_hasta=None, producto: Optional[str] = None,
+                 metodo_pago: Optional[str] = None, cajero: Optional[str] = None,
+                 estado: Optional[str] = None, producto_parcial: bool = False) -> int:
+    """Cuenta los pedidos que cumplen los mismos filtros que query_orders."""
+    where, params = _where_orders(fecha_desde, fecha_hasta, producto, metodo_pago, cajero, estado, producto_parcial)
+    with _cursor() as c:
+        c.execute(f'SELECT COUNT(*) FROM orders o {where}', params)
+        return c.fetchone()[0]
+
+
+def _despues_de(campo: str, direction: str, after: tuple) -> Tuple[str, List[Any], bool]:
+    """Condición de paginación por clave: filas posteriores a `after` = (valor de campo, id).
+
+    Devuelve (condición, parámetros, faltan_nulos). Respeta el orden de SQLite con NULL
+    (primero en ASC, último en DESC). En DESC con valor la condición es solo el rango
+    (campo, id) < (valor, id), que el índice resuelve con una búsqueda; las filas con el
+    campo en NULL que van detrás se piden aparte (faltan_nulos=True).
+    """
+    valor, order_id = after
+    if campo == 'id':
+        return ('o.id < ?' if direction == 'desc' else 'o.id > ?'), [order_id], False
+    if direction == 'desc':
+        if valor is None:
+            return f'(o.{campo} IS NULL AND o.id < ?)', [order_id], False
+        return f'(o.{campo}, o.id) < (?, ?)', [valor, order_id], True
+    if valor is None:
+        return f'((o.{campo} IS NULL AND o.id > ?) OR o.{campo} IS NOT NULL)', [order_id], False
+    return f'(o.{campo}, o.id) > (?, ?)', [valor, order_id], False
+
+
+def load_orders_page(after: Optional[tuple] = None, limit: int = 100, direction: str = 'desc',
+                     order_by: str = 'fecha', offset: int = 0, **filtros) -> List[Order]:
+    """Devuelve una página de pedidos ordenada por (order_by, id) usando paginación por clave.
+
+    `after` es la clave (valor de order_by, id) del último pedido de la página anterior (None
+    para la primera); `offset` salta además esa cantidad de filas desde ahí. `filtros` son los
+    de query_orders. Con la clave, el costo de cada página no depende de cuántos pedidos haya
+    antes: se continúa sobre el índice de orden (idx_orders_fecha_id para fecha) en lugar de
+    contar y descartar filas con OFFSET.
+    """
+    if order_by not in ORDER_SORT_FIELDS:
+        raise ValueError(f"order_by debe ser uno de {ORDER_SORT_FIELDS}")
+    if direction not in ('asc', 'desc'):
+        raise ValueError("direction debe ser 'asc' o 'desc'")
+    orden = 'DESC' if direction == 'desc' else 'ASC'
+    limit, offset = int(limit), int(offset or 0)
+    base, params_base = _where_orders(**filtros)
+
+    def _donde(condicion: Optional[str], valores: List[Any]) -> Tuple[str, List[Any]]:
+        if not condicion:
+            return base, list(params_base)
+        return (f'{base} AND {condicion}' if base else f'WHERE {condicion}'), params_base + valores
+
+    def _pagina(c, condicion, valores, limite, salto):
+        where, params = _donde(condicion, valores)
+        c.execute(f'SELECT {_ORDER_COLUMNS} FROM orders o {where} '
+                  f'ORDER BY o.{order_by} {orden}, o.id {orden} LIMIT ? OFFSET ?', params + [limite, salto])
+        return c.fetchall()
+
+    condicion, valores, faltan_nulos = (None, [], False) if after is None else _despues_de(order_by, direction, after)
+    with _cursor() as c:
+        rows = _pagina(c, condicion, valores, limit, offset)
+        if faltan_nulos and len(rows) < limit:
+            # Se terminó el rango: siguen las filas con el campo en NULL (van al final en DESC)
+            salto = 0
+            if not rows and offset:
+                where, params = _donde(condicion, valores)
+                c.execute(f'SELECT COUNT(*) FROM orders o {where}', params)
+                salto = max(0, offset - c.fetchone()[0])
+            rows += _pagina(c, f'o.{order_by} IS NULL', [], limit - len(rows), salto)
+    return [_order_from_row(r) for r in rows]
+
+
+# Tamaño de lote por defecto para recorrer pedidos con iter_orders
+ITER_BATCH_SIZE = 500
+
+
+def iter_orders(filters: Optional[Dict[str, Any]] = None, batch_size: int = ITER_BATCH_SIZE,
+                direction: str = 'desc') -> Iterator[Order]:
+    """Recorre los pedidos uno a uno sin cargarlos todos en memoria.
+
+    `filters` acepta las mismas claves que query_orders (fecha_desde, fecha_hasta, producto,
+    metodo_pago, cajero, estado, producto_parcial). Las filas se leen de a `batch_size` con
+    fetchmany y se decodifican solo al entregarlas, así que la memoria no crece con el
+    historial. `direction` es 'desc' (más recientes primero) o 'asc'.
+
+    La lectura usa una conexión propia de solo lectura que se cierra al agotar o descartar
+    el generador: los commit/rollback que el hilo haga mientras recorre no la afectan, y
+    en modo WAL se ve la base tal como estaba al empezar. Sin WAL esa lectura bloquea las
+    escrituras hasta terminar, así que no conviene escribir mientras se recorre.
+    """
+    if direction not in ('asc', 'desc'):
+        raise ValueError("direction debe ser 'asc' o 'desc'")
+    orden = 'DESC' if direction == 'desc' else 'ASC'
+    where, params = _where_orders(**(filters or {}))
+    # Conexión aparte y fuera de _cursor(): el generador puede quedar suspendido entre
+    # lotes y no debe retener la transacción del hilo ni compartir su conexión
+    conn = _manager.open_reader()
+    try:
+        c = conn.execute(f'SELECT {_ORDER_COLUMNS} FROM orders o {where} ORDER BY o.fecha {orden}, o.id {orden}', params)
+        while True:
+            rows = c.fetchmany(max(1, int(batch_size)))
+            if not rows:
+                break
+            for r in rows:
+                yield _order_from_row(r)
+    finally:
+        conn.close()
+
+
+
+# Terminal (caja) dueña del carrito: cada una trabaja sobre sus propias filas de 'cart',
+# así varias cajas pueden armar pedidos a la vez sobre la misma base. Por defecto es el
+# nombre del equipo; con varias instancias en el mismo equipo se fija MIZU_TERMINAL.
+_cart_session = os.environ.get('MIZU_TERMINAL') or socket.gethostname() or 'local'
+
+
+def set_cart_session(session: str):
+    """Cambia la terminal/sesión cuyo carrito usan las funciones de carrito."""
+    global _cart_session
+    if not session:
+        raise ValueError('La sesión del carrito no puede estar vacía')
+    _cart_session = str(session)
+
+
+def get_cart_session() -> str:
+    """Devuelve la terminal/sesión activa del carrito."""
+    return _cart_session
+
+
+def add_cart_item(product_id: str, product_name: str, quantity: int, price: float, session: Optional[str] = None):
+    with _cursor() as c:
+        # Si el item ya existe en el carrito de esta sesión, incrementar cantidad (upsert atómico)
+        c.execute('''INSERT INTO cart (session, product_id, product_name, quantity, price) VALUES (?, ?, ?, ?, ?)
+                     ON CONFLICT (session, product_id) DO UPDATE SET quantity = quantity + ?''',
+                  (session or _cart_session, product_id, product_name, int(quantity), float(price), int(quantity)))
+
+
+def get_cart_items(session: Optional[str] = None) -> List[Dict[str, Any]]:
+    with _cursor() as c:
+        c.execute('SELECT id, product_id, product_name, quantity, price FROM cart WHERE session = ? ORDER BY id',
+                  (session or _cart_session,))
+        rows = c.fetchall()
     return [{'id': r[0], 'product_id': r[1], 'product_name': r[2], 'quantity': r[3], 'price': r[4]} for r in rows]
 
 
-def clear_cart():
-    conn = _get_conn()
-    c = conn.cursor()
-    c.execute('DELETE FROM cart')
-    conn.commit()
-    conn.close()
+def clear_cart(session: Optional[str] = None):
+    with _cursor() as c:
+        c.execute('DELETE FROM cart WHERE session = ?', (session or _cart_session,))
 
 
-def update_cart_item_quantity(item_id: int, new_quantity: int):
+def update_cart_item_quantity(item_id: int, new_quantity: int, session: Optional[str] = None):
     """Actualiza la cantidad de un item específico en el carrito"""
-    conn = _get_conn()
-    c = conn.cursor()
-    c.execute('UPDATE cart SET quantity = ? WHERE id = ?', (int(new_quantity), int(item_id)))
-    conn.commit()
-    conn.close()
+    with _cursor() as c:
+        c.execute('UPDATE cart SET quantity = ? WHERE id = ? AND session = ?',
+                  (int(new_quantity), int(item_id), session or _cart_session))
 
 
-def remove_cart_item(item_id: int):
+def remove_cart_item(item_id: int, session: Optional[str] = None):
     """Elimina un item específico del carrito"""
-    conn = _get_conn()
-    c = conn.cursor()
-    c.execute('DELETE FROM cart WHERE id = ?', (int(item_id),))
-    conn.commit()
-    conn.close()
+    with _cursor() as c:
+        c.execute('DELETE FROM cart WHERE id = ? AND session = ?', (int(item_id), session or _cart_session))
+
+
+def cart_summary(session: Optional[str] = None) -> Dict[str, Any]:
+    """Resumen del carrito en una sola consulta: unidades ('items'), líneas ('lineas') y 'total'."""
+    with _cursor() as c:
+        c.execute('''SELECT COALESCE(SUM(quantity), 0), COUNT(*), COALESCE(SUM(quantity * price), 0.0)
+                     FROM cart WHERE session = ?''', (session or _cart_session,))
+        items, lineas, total = c.fetchone()
+    return {'items': int(items), 'lineas': lineas, 'total': float(total)}
 
 
 def get_cart_total() -> float:
     """Obtiene el total del carrito"""
-    items = get_cart_items()
-    return sum(item['quantity'] * float(item['price']) for item in items)
+    return cart_summary()['total']
 
 
 def get_cart_item_count() -> int:
     """Obtiene el número total de items en el carrito"""
-    items = get_cart_items()
-    return sum(item['quantity'] for item in items)
+    return cart_summary()['items']
+
+
+# Hash de contraseñas con una KDF lenta (scrypt, o PBKDF2-SHA256 si el Python no trae
+# scrypt). El costo se ajusta con configure_password_hashing() o se calibra con
+# benchmark_kdf(); los hashes guardados con otro costo, o con el SHA-256 sin sal de las
+# versiones anteriores, se regeneran en el siguiente inicio de sesión correcto.
+PASSWORD_KDF: Dict[str, Any] = {
+    'algoritmo': 'scrypt' if hasattr(hashlib, 'scrypt') else 'pbkdf2_sha256',
+    'n': 2 ** 14,            # scrypt: costo de CPU/memoria (potencia de 2)
+    'r': 8,                  # scrypt: tamaño de bloque
+    'p': 1,                  # scrypt: paralelismo
+    'iteraciones': 600000,   # pbkdf2_sha256
+}
+
+_SALT_BYTES = 16
+_KDF_DKLEN = 32
+
+
+def _derivar(password: str, algoritmo: str, params: Dict[str, int], salt: bytes) -> bytes:
+    if algoritmo == 'scrypt':
+        n, r, p = params['n'], params['r'], params['p']
+        # maxmem por encima de los 128*n*r*p bytes que necesita scrypt (el límite por defecto es 32 MB)
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r * p + 2 ** 20, dklen=_KDF_DKLEN)
+    if algoritmo == 'pbkdf2_sha256':
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params['iteraciones'], dklen=_KDF_DKLEN)
+    raise ValueError(f"Algoritmo de contraseña desconocido: {algoritmo}")
+
+
+def _parametros_actuales() -> Dict[str, int]:
+    if PASSWORD_KDF['algoritmo'] == 'scrypt':
+        return {'n': PASSWORD_KDF['n'], 'r': PASSWORD_KDF['r'], 'p': PASSWORD_KDF['p']}
+    return {'iteraciones': PASSWORD_KDF['iteraciones']}
+
+
+def _leer_hash(guardado: str):
+    """Separa un hash guardado en (algoritmo, parámetros, sal, hash); None si es SHA-256 heredado."""
+    partes = (guardado or '').split('$')
+    if partes[0] == 'scrypt' and len(partes) == 6:
+        return 'scrypt', {'n': int(partes[1]), 'r': int(partes[2]), 'p': int(partes[3])}, bytes.fromhex(partes[4]), bytes.fromhex(partes[5])
+    if partes[0] == 'pbkdf2_sha256' and len(partes) == 4:
+        return 'pbkdf2_sha256', {'iteraciones': int(partes[1])}, bytes.fromhex(partes[2]), bytes.fromhex(partes[3])
+    return None
+
+
+def hash_password(password: str) -> str:
+    """Devuelve el hash con sal de la contraseña usando la KDF y el costo configurados."""
+    algoritmo = PASSWORD_KDF['algoritmo']
+    params = _parametros_actuales()
+    salt = secrets.token_bytes(_SALT_BYTES)
+    derivado = _derivar(password, algoritmo, params, salt)
+    return '$'.join([algoritmo] + [str(v) for v in params.values()] + [salt.hex(), derivado.hex()])
+
+
+def verify_password(password: str, guardado: str) -> bool:
+    """Comprueba la contraseña contra un hash guardado (KDF o SHA-256 heredado)."""
+    try:
+        leido = _leer_hash(guardado)
+        if leido is None:
+            legado = hashlib.sha256(password.encode()).hexdigest()
+            return hmac.compare_digest(legado, guardado or '')
+        algoritmo, params, salt, esperado = leido
+        return hmac.compare_digest(_derivar(password, algoritmo, params, salt), esperado)
+    except (ValueError, TypeError):
+        return False
+
+
+def password_needs_rehash(guardado: str) -> bool:
+    """True si el hash es SHA-256 heredado o usa un algoritmo/costo distinto del configurado."""
+    try:
+        leido = _leer_hash(guardado)
+    except ValueError:
+        return True
+    return leido is None or leido[0] != PASSWORD_KDF['algoritmo'] or leido[1] != _parametros_actuales()
+
+
+def configure_password_hashing(algoritmo: Optional[str] = None, **params):
+    """Cambia el algoritmo ('scrypt' o 'pbkdf2_sha256') y/o el costo (n, r, p, iteraciones)."""
+    if algoritmo is not None:
+        if algoritmo not in ('scrypt', 'pbkdf2_sha256'):
+            raise ValueError(f"Algoritmo de contraseña desconocido: {algoritmo}")
+        if algoritmo == 'scrypt' and not hasattr(hashlib, 'scrypt'):
+            raise ValueError('Este Python no incluye hashlib.scrypt')
+        PASSWORD_KDF['algoritmo'] = algoritmo
+    for clave, valor in params.items():
+        if clave not in ('n', 'r', 'p', 'iteraciones'):
+            raise ValueError(f"Parámetro de KDF desconocido: {clave}")
+        PASSWORD_KDF[clave] = int(valor)
+
+
+def benchmark_kdf(presupuesto_ms: float = 250, algoritmo: Optional[str] = None, aplicar: bool = False) -> Dict[str, Any]:
+    """Mide la KDF en este equipo y devuelve el mayor costo que cabe en `presupuesto_ms`.
+
+    Para scrypt se duplica n desde 2**12; para PBKDF2 se extrapolan las iteraciones a partir
+    de una medición corta. Con aplicar=True el resultado queda como configuración activa.
+    """
+    algoritmo = algoritmo or PASSWORD_KDF['algoritmo']
+    salt = secrets.token_bytes(_SALT_BYTES)
+    if algoritmo == 'scrypt':
+        r, p = PASSWORD_KDF['r'], PASSWORD_KDF['p']
+        elegido = {'n': 2 ** 12, 'r': r, 'p': p}
+        ms_elegido = None
+        n = 2 ** 12
+        while n <= 2 ** 20:
+            inicio = time.perf_counter()
+            _derivar('benchmark', 'scrypt', {'n': n, 'r': r, 'p': p}, salt)
+            ms = (time.perf_counter() - inicio) * 1000
+            if ms > presupuesto_ms and ms_elegido is not None:
+                break
+            elegido, ms_elegido = {'n': n, 'r': r, 'p': p}, ms
+            if ms > presupuesto_ms:
+                break
+            n *= 2
+    elif algoritmo == 'pbkdf2_sha256':
+        muestra = 20000
+        inicio = time.perf_counter()
+        _derivar('benchmark', 'pbkdf2_sha256', {'iteraciones': muestra}, salt)
+        ms_muestra = max((time.perf_counter() - inicio) * 1000, 1e-3)
+        iteraciones = max(100000, int(muestra * presupuesto_ms / ms_muestra) // 1000 * 1000)
+        elegido = {'iteraciones': iteraciones}
+        ms_elegido = ms_muestra * iteraciones / muestra
+    else:
+        raise ValueError(f"Algoritmo de contraseña desconocido: {algoritmo}")
+    if aplicar:
+        configure_password_hashing(algoritmo, **elegido)
+    return {'algoritmo': algoritmo, **elegido, 'ms': round(ms_elegido, 1)}
+
+
+# Un solo hilo de trabajo para calcular contraseñas (KDF) fuera del hilo de Tk
+_auth_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _en_hilo_auth(funcion: Callable, *args, **kwargs) -> Future:
+    global _auth_executor
+    if _auth_executor is None:
+        _auth_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='auth')
+    return _auth_executor.submit(funcion, *args, **kwargs)
+
+
+def authenticate_user_async(username: str, password: str) -> Future:
+    """Ejecuta authenticate_user en un hilo de trabajo y devuelve un Future con el resultado.
+
+    La interfaz debe consultar future.done() (p. ej. con after()) en lugar de bloquearse
+    en future.result(), para que la ventana siga respondiendo mientras corre la KDF.
+    """
+    return _en_hilo_auth(authenticate_user, username, password)
+
+
+def create_user_async(username: str, password: str, full_name: str, role: str = 'cliente',
+                      email: Optional[str] = None) -> Future:
+    """Como create_user, pero en el hilo de trabajo (Future con True/False)."""
+    return _en_hilo_auth(create_user, username, password, full_name, role, email)
+
+
+def change_user_password_async(user_id: int, new_password: str) -> Future:
+    """Como change_user_password, pero en el hilo de trabajo (Future con True/False)."""
+    return _en_hilo_auth(change_user_password, user_id, new_password)
 
 
 # Funciones para manejo de usuarios
 def create_user(username: str, password: str, full_name: str, role: str = 'cliente', email: Optional[str] = None) -> bool:
-    """Crea un nuevo usuario en la base de datos"""
-    import hashlib
+    """Crea un nuevo usuario en la base de datos (desde la interfaz usar create_user_async)"""
     import datetime
     
-    conn = _get_conn()
-    c = conn.cursor()
+    # Hash de la contraseña (fuera de la transacción: la KDF tarda a propósito)
+    password_hash = hash_password(password)
     try:
-        # Hash de la contraseña
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-        
-        # Insertar usuario
-        c.execute('''INSERT INTO users (username, password, full_name, role, email, created_at, active) 
-                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                  (username, password_hash, full_name, role, email, 
-                   datetime.datetime.now().isoformat(), 1))
-        conn.commit()
+        with _cursor() as c:
+            # Insertar usuario
+            c.execute('''INSERT INTO users (username, password, full_name, role, email, created_at, active) 
+                         VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                      (username, password_hash, full_name, role, email, 
+                       datetime.datetime.now().isoformat(), 1))
         return True
     except sqlite3.IntegrityError:
         return False  # Usuario ya existe
-    finally:
-        conn.close()
 
 
 def authenticate_user(username: str, password: str) -> Optional[Dict[str, Any]]:
-    """Autentica un usuario y devuelve sus datos si es válido"""
-    import hashlib
+    """Autentica un usuario y devuelve sus datos si es válido.
+
+    La KDF es lenta a propósito: desde la interfaz usar authenticate_user_async. Si el hash
+    guardado es SHA-256 heredado o usa otro costo, se regenera con la configuración actual.
+    """
     import datetime
     
-    conn = _get_conn()
-    c = conn.cursor()
+    with _cursor() as c:
+        c.execute('''SELECT id, username, full_name, role, email, created_at, last_login, password
+                     FROM users WHERE username = ? AND active = 1''', (username,))
+        row = c.fetchone()
     
-    # Hash de la contraseña
-    password_hash = hashlib.sha256(password.encode()).hexdigest()
+    if not row:
+        # Gastar el mismo tiempo que con un usuario real para no revelar cuáles existen
+        hash_password(password)
+        return None
+    if not verify_password(password, row[7]):
+        return None
     
-    c.execute('''SELECT id, username, full_name, role, email, created_at, last_login 
-                 FROM users WHERE username = ? AND password = ? AND active = 1''',
-              (username, password_hash))
-    row = c.fetchone()
-    
-    if row:
-        # Actualizar último login
-        c.execute('UPDATE users SET last_login = ? WHERE id = ?',
-                  (datetime.datetime.now().isoformat(), row[0]))
-        conn.commit()
+    nuevo_hash = hash_password(password) if password_needs_rehash(row[7]) else None
+    with _cursor() as c:
+        # Actualizar último login (y el hash, si hubo que regenerarlo)
+        if nuevo_hash:
+            c.execute('UPDATE users SET password = ?, last_login = ? WHERE id = ?',
+                      (nuevo_hash, datetime.datetime.now().isoformat(), row[0]))
+        else:
+            c.execute('UPDATE users SET last_login = ? WHERE id = ?',
+                      (datetime.datetime.now().isoformat(), row[0]))
         
-        user_data = {
-            'id': row[0],
-            'username': row[1],
-            'full_name': row[2],
-            'role': row[3],
-            'email': row[4],
-            'created_at': row[5],
-            'last_login': row[6]
-        }
-        conn.close()
-        return user_data
-    
-    conn.close()
-    return None
+    return {
+        'id': row[0],
+        'username': row[1],
+        'full_name': row[2],
+        'role': row[3],
+        'email': row[4],
+        'created_at': row[5],
+        'last_login': row[6]
+    }
 
 
 def load_users() -> List[Dict[str, Any]]:
     """Carga todos los usuarios de la base de datos"""
-    conn = _get_conn()
-    c = conn.cursor()
-    c.execute('''SELECT id, username, full_name, role, email, created_at, last_login, active 
-                 FROM users ORDER BY created_at DESC''')
-    rows = c.fetchall()
-    conn.close()
+    with _cursor() as c:
+        c.execute('''SELECT id, username, full_name, role, email, created_at, last_login, active 
+                     FROM users ORDER BY created_at DESC''')
+        rows = c.fetchall()
     
     users = []
     for row in rows:
@@ -542,9 +1876,6 @@ def load_users() -> List[Dict[str, Any]]:
 
 def update_user(user_id: int, full_name: Optional[str] = None, role: Optional[str] = None, email: Optional[str] = None, active: Optional[bool] = None):
     """Actualiza información de un usuario"""
-    conn = _get_conn()
-    c = conn.cursor()
-    
     updates = []
     params = []
     
@@ -567,35 +1898,24 @@ def update_user(user_id: int, full_name: Optional[str] = None, role: Optional[st
     if updates:
         query = f"UPDATE users SET {', '.join(updates)} WHERE id = ?"
         params.append(user_id)
-        c.execute(query, params)
-        conn.commit()
-    
-    conn.close()
+        with _cursor() as c:
+            c.execute(query, params)
 
 
 def delete_user(user_id: int):
     """Elimina un usuario de la base de datos"""
-    conn = _get_conn()
-    c = conn.cursor()
-    c.execute('DELETE FROM users WHERE id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+    with _cursor() as c:
+        c.execute('DELETE FROM users WHERE id = ?', (user_id,))
 
 
 def change_user_password(user_id: int, new_password: str) -> bool:
-    """Cambia la contraseña de un usuario"""
-    import hashlib
-    
+    """Cambia la contraseña de un usuario (desde la interfaz usar change_user_password_async)"""
     try:
-        conn = _get_conn()
-        c = conn.cursor()
-        
         # Hash de la nueva contraseña
-        password_hash = hashlib.sha256(new_password.encode()).hexdigest()
+        password_hash = hash_password(new_password)
         
-        c.execute('UPDATE users SET password = ? WHERE id = ?', (password_hash, user_id))
-        conn.commit()
-        conn.close()
+        with _cursor() as c:
+            c.execute('UPDATE users SET password = ? WHERE id = ?', (password_hash, user_id))
         return True
     except Exception:
         return False
@@ -603,12 +1923,10 @@ def change_user_password(user_id: int, new_password: str) -> bool:
 
 def init_default_users():
     """Inicializar usuarios por defecto si no existen"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Verificar si ya hay usuarios
-    c.execute("SELECT COUNT(*) FROM users")
-    count = c.fetchone()[0]
+    with _cursor() as c:
+        # Verificar si ya hay usuarios
+        c.execute("SELECT COUNT(*) FROM users")
+        count = c.fetchone()[0]
     
     if count == 0:
         # Crear usuarios por defecto
@@ -622,8 +1940,6 @@ def init_default_users():
             create_user(username, password, full_name, role, email)
         
         print("Usuarios por defecto creados exitosamente")
-    
-    conn.close()
 
 # Función de inicialización principal actualizada
     """Inicializa usuarios por defecto si no existen"""
@@ -0,0 +1,287 @@
+import bisect
+import datetime
+import threading
+from collections.abc import Mapping
+from typing import List, Dict, Any, Optional, Tuple, FrozenSet
+
+import db
+import catalogo
+
+# Índice de elegibilidad producto → ofertas. En lugar de comparar cada producto con cada
+# oferta activa (con búsquedas lineales en productos_aplicables), el índice se arma una
+# vez por cada contenido de ofertas y versión del catálogo, y luego cada producto cuesta
+# una búsqueda en un dict. Las ofertas de cada producto quedan en orden de prioridad:
+# el mismo orden de la lista de ofertas, así que la primera es la que se aplica.
+
+_lock = threading.Lock()
+_cache: Dict[str, Any] = {'clave': None, 'indice': None}
+_cache_agenda: Dict[str, Any] = {'clave': None, 'agenda': None}
+
+
+def _aplica_a_todos(oferta: Dict[str, Any]) -> bool:
+    aplicables = oferta.get('productos_aplicables') or []
+    return not aplicables or 'todos' in aplicables
+
+
+def offer_applies(producto: Dict[str, Any], oferta: Dict[str, Any]) -> bool:
+    """Regla de elegibilidad: 'todos' (o lista vacía), nombre, ID o categoría del producto."""
+    if _aplica_a_todos(oferta):
+        return True
+    aplicables = oferta.get('productos_aplicables') or []
+    return (producto.get('nombre') in aplicables or producto.get('id') in aplicables
+            or producto.get('categoria') in aplicables)
+
+
+def build_eligibility_index(ofertas: List[Dict[str, Any]], productos: List[Dict[str, Any]]) -> Dict[str, Tuple[Dict[str, Any], ...]]:
+    """Arma {id de producto: ofertas activas aplicables, en orden de prioridad}."""
+    globales: List[Tuple[int, Dict[str, Any]]] = []
+    por_valor: Dict[Any, List[Tuple[int, Dict[str, Any]]]] = {}
+    for prioridad, oferta in enumerate(ofertas or []):
+        if not oferta.get('activa', False):
+            continue
+        if _aplica_a_todos(oferta):
+            globales.append((prioridad, oferta))
+            continue
+        for valor in set(oferta.get('productos_aplicables') or []):
+            por_valor.setdefault(valor, []).append((prioridad, oferta))
+
+    indice: Dict[str, Tuple[Dict[str, Any], ...]] = {}
+    for producto in productos or []:
+        candidatas = dict(globales)
+        for valor in (producto.get('id'), producto.get('nombre'), producto.get('categoria')):
+            candidatas.update(por_valor.get(valor, ()))
+        indice[str(producto.get('id'))] = tuple(candidatas[p] for p in sorted(candidatas))
+    return indice
+
+
+def _congelar(valor):
+    # Copia comparable y hashable de un valor de oferta (listas, dicts anidados)
+    if isinstance(valor, (list, tuple, set, frozenset)):
+        return tuple(_congelar(v) for v in valor)
+    if isinstance(valor, Mapping):
+        return tuple((str(k), _congelar(v)) for k, v in sorted(valor.items(), key=lambda kv: str(kv[0])))
+    try:
+        hash(valor)
+    except TypeError:
+        return repr(valor)
+    return valor
+
+
+def _huella(ofertas: List[Dict[str, Any]]) -> Tuple:
+    """Resumen del contenido completo de las ofertas (la lista en memoria puede cambiar sin pasar por la BD).
+
+    Incluye todos los campos y no solo los de elegibilidad: el índice guarda las ofertas
+    mismas, así que un cambio de descuento, tipo o nombre también debe reconstruirlo.
+    """
+    return tuple(_congelar(o) for o in ofertas or [])
+
+
+def eligibility_index(ofertas: List[Dict[str, Any]]) -> Dict[str, Tuple[Dict[str, Any], ...]]:
+    """Índice de elegibilidad para la lista de ofertas de la aplicación y el catálogo actual.
+
+    Se reconstruye (y cambia de identidad) cuando cambia cualquier campo de las ofertas o la
+    versión de la tabla products; comprobarlo cuesta O(ofertas) y no O(productos × ofertas).
+    Pensado para pedirse una vez por renderizado y luego consultar indice.get(id_producto, ()).
+    """
+    try:
+        version_productos = db.table_versions().get('products')
+    except Exception:
+        version_productos = None
+    clave = (version_productos, _huella(ofertas))
+    with _lock:
+        if _cache['clave'] != clave or _cache['indice'] is None:
+            _cache['indice'] = build_eligibility_index(ofertas, catalogo.all_products())
+            _cache['clave'] = clave
+        return _cache['indice']
+
+
+def offers_for_product(producto: Dict[str, Any], ofertas: List[Dict[str, Any]],
+                       indice: Optional[Dict[str, Tuple[Dict[str, Any], ...]]] = None) -> Tuple[Dict[str, Any], ...]:
+    """Ofertas activas aplicables a un producto, en orden de prioridad."""
+    if indice is None:
+        indice = eligibility_index(ofertas)
+    encontradas = indice.get(str(producto.get('id')))
+    if encontradas is None:
+        # Producto fuera del catálogo (p. ej. recién creado en memoria): evaluar directamente
+        encontradas = tuple(o for o in ofertas or [] if o.get('activa', False) and offer_applies(producto, o))
+    return encontradas
+
+
+def best_offer(producto: Dict[str, Any], ofertas: List[Dict[str, Any]],
+               indice: Optional[Dict[str, Tuple[Dict[str, Any], ...]]] = None) -> Optional[Dict[str, Any]]:
+    """La oferta que se aplica al producto (la primera por prioridad), o None."""
+    encontradas = offers_for_product(producto, ofertas, indice)
+    return encontradas[0] if encontradas else None
+
+
+# Programador de ofertas por ventana de tiempo. Cada oferta tiene una ventana de fechas
+# [fecha_inicio, fecha_fin] (fecha_fin incluida; sin valor = sin límite) y, opcionalmente,
+# una ventana horaria diaria [hora_inicio, hora_fin) tipo happy hour (puede cruzar la
+# medianoche). Cada eje se indexa como segmentos elementales: los límites ordenados y, por
+# segmento, el conjunto de ofertas dentro de su ventana. "Ofertas vigentes en t" son dos
+# bisect y una intersección, y el próximo límite sirve para programar el siguiente ciclo.
+
+_FORMATOS_FECHA = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+_MINUTOS_DIA = 24 * 60
+
+
+def _fecha(valor, fin: bool = False) -> Optional[datetime.datetime]:
+    """Convierte fecha_inicio/fecha_fin a datetime; una fecha sin hora como fin cubre el día entero."""
+    if not valor:
+        return None
+    texto = str(valor).strip()
+    for formato in _FORMATOS_FECHA:
+        try:
+            momento = datetime.datetime.strptime(texto, formato)
+        except ValueError:
+            continue
+        if fin and formato == '%Y-%m-%d':
+            momento += datetime.timedelta(days=1)
+        return momento
+    return None
+
+
+def _minutos(valor) -> Optional[int]:
+    """'HH:MM' → minutos desde la medianoche (None si no hay hora o no es válida)."""
+    if not valor:
+        return None
+    try:
+        hora = datetime.datetime.strptime(str(valor).strip(), '%H:%M')
+    except ValueError:
+        return None
+    return hora.hour * 60 + hora.minute
+
+
+def _segmentos(intervalos: List[Tuple[Any, Any, str]]) -> Tuple[list, List[FrozenSet[str]]]:
+    """Índice de intervalos semiabiertos [inicio, fin) (None = sin límite) por barrido.
+
+    Devuelve (límites ordenados, conjuntos) donde conjuntos[k] son las ofertas vigentes en el
+    segmento que empieza en límites[k - 1]; se consulta con bisect_right(límites, t).
+    """
+    validos = [(i, f, o) for i, f, o in intervalos if i is None or f is None or i < f]
+    limites = sorted({p for i, f, _ in validos for p in (i, f) if p is not None})
+    entradas: Dict[Any, List[str]] = {}
+    salidas: Dict[Any, List[str]] = {}
+    actuales: Dict[str, int] = {}
+    for inicio, fin, oferta in validos:
+        if inicio is None:
+            actuales[oferta] = actuales.get(oferta, 0) + 1
+        else:
+            entradas.setdefault(inicio, []).append(oferta)
+        if fin is not None:
+            salidas.setdefault(fin, []).append(oferta)
+    conjuntos = [frozenset(actuales)]
+    for limite in limites:
+        for oferta in salidas.get(limite, ()):
+            actuales[oferta] -= 1
+            if not actuales[oferta]:
+                del actuales[oferta]
+        for oferta in entradas.get(limite, ()):
+            actuales[oferta] = actuales.get(oferta, 0) + 1
+        conjuntos.append(frozenset(actuales))
+    return limites, conjuntos
+
+
+def _ventana(oferta: Dict[str, Any]) -> Tuple:
+    return (oferta.get('fecha_inicio'), oferta.get('fecha_fin'), oferta.get('hora_inicio'), oferta.get('hora_fin'))
+
+
+def build_schedule(ofertas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Arma los índices de ventanas de fechas y horarias de las ofertas (activas o no)."""
+    por_fecha = []
+    por_hora = []
+    programadas = set()
+    for oferta in ofertas or []:
+        oferta_id = oferta.get('id')
+        fecha_inicio, fecha_fin, hora_inicio, hora_fin = _ventana(oferta)
+        inicio, fin = _fecha(fecha_inicio), _fecha(fecha_fin, fin=True)
+        desde, hasta = _minutos(hora_inicio), _minutos(hora_fin)
+        if desde is None or hasta is None or desde == hasta:
+            desde = hasta = None
+        por_fecha.append((inicio, fin, oferta_id))
+        if desde is None:
+            por_hora.append((None, None, oferta_id))
+        elif desde < hasta:
+            por_hora.append((desde, hasta, oferta_id))
+        else:
+            # Cruza la medianoche: [desde, fin del día) y [inicio del día, hasta)
+            por_hora.append((desde, None, oferta_id))
+            por_hora.append((None, hasta, oferta_id))
+        if inicio is not None or fin is not None or desde is not None:
+            programadas.add(oferta_id)
+    return {
+        'fechas': _segmentos(por_fecha),
+        'horas': _segmentos(por_hora),
+        'programadas': frozenset(programadas),
+    }
+
+
+def schedule(ofertas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """build_schedule con caché: se reconstruye solo si cambian los IDs o las ventanas."""
+    clave = tuple((o.get('id'),) + _ventana(o) for o in ofertas or [])
+    with _lock:
+        if _cache_agenda['clave'] != clave or _cache_agenda['agenda'] is None:
+            _cache_agenda['agenda'] = build_schedule(ofertas)
+            _cache_agenda['clave'] = clave
+        return _cache_agenda['agenda']
+
+
+def active_at(agenda: Dict[str, Any], momento: Optional[datetime.datetime] = None) -> FrozenSet[str]:
+    """IDs de las ofertas cuya ventana (fechas y horario) contiene `momento`, sin mirar 'activa'."""
+    momento = momento or datetime.datetime.now()
+    limites, conjuntos = agenda['fechas']
+    por_fecha = conjuntos[bisect.bisect_right(limites, momento)]
+    limites, conjuntos = agenda['horas']
+    por_hora = conjuntos[bisect.bisect_right(limites, momento.hour * 60 + momento.minute)]
+    return por_fecha & por_hora
+
+
+def next_boundary(agenda: Dict[str, Any], momento: Optional[datetime.datetime] = None) -> Optional[datetime.datetime]:
+    """Próximo instante posterior a `momento` en que puede cambiar el conjunto de ofertas vigentes."""
+    momento = momento or datetime.datetime.now()
+    candidatos = []
+    limites = agenda['fechas'][0]
+    k = bisect.bisect_right(limites, momento)
+    if k < len(limites):
+        candidatos.append(limites[k])
+    limites = agenda['horas'][0]
+    if limites:
+        minuto = momento.hour * 60 + momento.minute
+        k = bisect.bisect_right(limites, minuto)
+        dia = momento.replace(hour=0, minute=0, second=0, microsecond=0)
+        if k < len(limites):
+            candidatos.append(dia + datetime.timedelta(minutes=limites[k]))
+        else:
+            candidatos.append(dia + datetime.timedelta(days=1, minutes=limites[0]))
+    return min(candidatos) if candidatos else None
+
+
+def offers_in_force(ofertas: List[Dict[str, Any]], momento: Optional[datetime.datetime] = None) -> List[Dict[str, Any]]:
+    """Ofertas activas y dentro de su ventana en `momento` (ahora por defecto), en su orden original."""
+    vigentes = active_at(schedule(ofertas), momento)
+    return [o for o in ofertas or [] if o.get('activa', False) and o.get('id') in vigentes]
+
+
+def run_scheduler(momento: Optional[datetime.datetime] = None) -> Dict[str, bool]:
+    """Activa/expira en la BD las ofertas que cruzaron un límite de su ventana; devuelve {id: activa}.
+
+    Solo actúa cuando el estado programado cambia respecto del último aplicado ('programada'),
+    así que una oferta desactivada a mano dentro de su ventana sigue desactivada hasta el
+    próximo cruce. Una oferta nunca programada solo se expira (no se reactiva).
+    Todos los cambios van en un único UPDATE.
+    """
+    ofertas = db.load_offers()
+    agenda = schedule(ofertas)
+    vigentes = active_at(agenda, momento)
+    aplicados = db.load_offer_schedule_states()
+    cambios: Dict[str, bool] = {}
+    for oferta_id in agenda['programadas']:
+        deseado = oferta_id in vigentes
+        anterior = aplicados.get(oferta_id)
+        if anterior is None and deseado:
+            continue
+        if anterior != deseado:
+            cambios[oferta_id] = deseado
+    if cambios:
+        db.apply_offer_schedule(cambios)
+    return cambios
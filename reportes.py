@@ -0,0 +1,103 @@
+from typing import List, Dict, Any, Optional, Tuple
+
+import db
+
+# Rango de fechas de un reporte: (desde, hasta) como 'YYYY-MM-DD' o date, ambos incluidos.
+# Cualquiera de los dos extremos puede ser None; rango=None abarca todo el historial.
+Rango = Optional[Tuple[Any, Any]]
+
+
+def _where_rango(rango: Rango, alias: str = 'o') -> Tuple[str, List[Any]]:
+    """Condición WHERE (usa los índices que empiezan por fecha) para un rango de fechas."""
+    if not rango:
+        return '', []
+    desde, hasta = rango
+    condiciones = []
+    params: List[Any] = []
+    if desde:
+        condiciones.append(f'{alias}.fecha >= ?')
+        params.append(str(desde)[:10])
+    if hasta:
+        condiciones.append(f"{alias}.fecha < date(?, '+1 day')")
+        params.append(str(hasta)[:10])
+    return ('WHERE ' + ' AND '.join(condiciones)) if condiciones else '', params
+
+
+def sales_summary(rango: Rango = None) -> Dict[str, Any]:
+    """Totales generales de ventas: cantidad, ingresos, descuentos y estados."""
+    where, params = _where_rango(rango)
+    with db.cursor() as c:
+        c.execute(f'''SELECT COUNT(*),
+                            COALESCE(SUM(o.total_final), 0),
+                            COALESCE(SUM(o.descuento_aplicado), 0),
+                            COALESCE(SUM(o.total_sin_descuento), 0),
+                            COALESCE(SUM(o.estado = 'Completado'), 0),
+                            COALESCE(SUM(o.estado = 'Cancelado'), 0),
+                            COALESCE(SUM(o.oferta_aplicada IS NOT NULL AND o.oferta_aplicada != ''), 0)
+                     FROM orders o {where}''', params)
+        r = c.fetchone()
+    return {
+        'total_ventas': r[0],
+        'ingresos_totales': r[1],
+        'descuentos_totales': r[2],
+        'ingresos_sin_descuentos': r[3],
+        'ventas_completadas': r[4],
+        'ventas_canceladas': r[5],
+        'ventas_con_oferta': r[6],
+    }
+
+
+def sales_by_day(rango: Rango = None) -> List[Dict[str, Any]]:
+    """Ventas e ingresos por día ('YYYY-MM-DD'), del más reciente al más antiguo."""
+    where, params = _where_rango(rango)
+    with db.cursor() as c:
+        c.execute(f'''SELECT substr(o.fecha, 1, 10) AS dia, COUNT(*), COALESCE(SUM(o.total_final), 0)
+                     FROM orders o {where}
+                     GROUP BY dia ORDER BY dia DESC''', params)
+        rows = c.fetchall()
+    return [{'dia': r[0], 'ventas': r[1], 'ingresos': r[2]} for r in rows if r[0]]
+
+
+def sales_by_product(rango: Rango = None) -> List[Dict[str, Any]]:
+    """Cantidad vendida, ingresos y número de ventas por producto, ordenado por ingresos."""
+    where, params = _where_rango(rango)
+    join = 'JOIN orders o ON o.id = i.order_id' if where else ''
+    with db.cursor() as c:
+        c.execute(f'''SELECT i.name, SUM(i.quantity), SUM(i.subtotal), COUNT(*)
+                     FROM order_items i {join} {where}
+                     GROUP BY i.name ORDER BY SUM(i.subtotal) DESC''', params)
+        rows = c.fetchall()
+    return [{'nombre': r[0], 'cantidad_vendida': r[1] or 0, 'ingresos': r[2] or 0.0, 'ventas': r[3]} for r in rows]
+
+
+def offer_usage(rango: Rango = None) -> List[Dict[str, Any]]:
+    """Usos y descuento total por oferta aplicada, con el nombre actual de la oferta."""
+    where, params = _where_rango(rango)
+    where = (where + ' AND ' if where else 'WHERE ') + "o.oferta_aplicada IS NOT NULL AND o.oferta_aplicada != ''"
+    with db.cursor() as c:
+        c.execute(f'''SELECT o.oferta_aplicada, f.name, COUNT(*), COALESCE(SUM(o.descuento_aplicado), 0)
+                     FROM orders o LEFT JOIN offers f ON f.id = o.oferta_aplicada
+                     {where}
+                     GROUP BY o.oferta_aplicada ORDER BY COUNT(*) DESC''', params)
+        rows = c.fetchall()
+    return [{'oferta': r[0], 'nombre': r[1], 'usos': r[2], 'descuento_total': r[3]} for r in rows]
+
+
+def _conteo_por_columna(columna: str, rango: Rango) -> List[Dict[str, Any]]:
+    where, params = _where_rango(rango)
+    with db.cursor() as c:
+        c.execute(f'''SELECT COALESCE(o.{columna}, 'No especificado'), COUNT(*)
+                     FROM orders o {where}
+                     GROUP BY 1 ORDER BY COUNT(*) DESC''', params)
+        rows = c.fetchall()
+    return [{'valor': r[0], 'ventas': r[1]} for r in rows]
+
+
+def sales_by_payment_method(rango: Rango = None) -> List[Dict[str, Any]]:
+    """Número de ventas por método de pago, de mayor a menor."""
+    return _conteo_por_columna('metodo_pago', rango)
+
+
+def sales_by_cashier(rango: Rango = None) -> List[Dict[str, Any]]:
+    """Número de ventas por cajero, de mayor a menor."""
+    return _conteo_por_columna('cajero', rango)
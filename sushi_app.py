@@ -6,6 +6,10 @@ import datetime
 import json
 import os
 import db
+import reportes
+import catalogo
+import promociones
+import tabla_virtual
 try:
     from PIL import Image, ImageTk
     PIL_DISPONIBLE = True
@@ -83,6 +87,22 @@ TEMAS = {
 # Variables globales del tema actual
 TEMA_ACTUAL = "Claro"
 
+# Tablas de la BD de las que depende cada ventana con sincronización automática
+TABLAS_POR_VENTANA = {
+    'productos': ('products',),
+    'carrito': ('cart',),
+    'usuarios': ('users',),
+    'ofertas': ('offers',),
+    'pedidos': ('orders',),
+    'reportes': ('orders', 'products', 'offers'),
+}
+
+# Estados de los pedidos que siguen abiertos (pantalla de pedidos activos)
+ESTADOS_PEDIDO_ACTIVO = ('En preparación', 'Pendiente')
+
+# Espera (ms) desde la última tecla antes de filtrar el menú mientras se escribe
+RETARDO_FILTROS_MENU_MS = 250
+
 # Clase principal de la aplicación
 class SushiApp(tk.Tk):
     def __init__(self):
@@ -140,15 +160,8 @@ class SushiApp(tk.Tk):
         self.ventana_actual = None
         self.sincronizacion_activa = False
 
-        # Cargar ventas (historial) desde la base de datos
-        try:
-            ventas_db = db.load_orders()
-            if ventas_db:
-                self.ventas = ventas_db
-            else:
-                self.ventas = []
-        except Exception:
-            self.ventas = []
+        # Las ventas no se cargan en memoria: reportes e historial las consultan en la BD
+        self.ventas_filtradas = []
         
         self.cargar_imagen_fondo()
         self.configurar_estilos()
@@ -176,6 +189,9 @@ class SushiApp(tk.Tk):
         # Inicializar sistema de sincronización automática
         self.iniciar_sincronizacion_automatica()
         
+        # Activar/expirar ofertas según sus ventanas de fecha y horario
+        self.programar_ofertas()
+        
         self.mostrar_login()
     
     def cambiar_rol_directo(self, rol):
@@ -770,10 +786,46 @@ class SushiApp(tk.Tk):
                                  relief="solid", bd=2, bg="#FFFFFF", fg=self.color_texto)
         entry_password.pack(pady=(0, 20))
 
+        def iniciar_sesion():
+            usuario = entry_usuario.get().strip()
+            password = entry_password.get()
+            # Sin credenciales se mantiene el acceso con el rol seleccionado
+            if not usuario and not password:
+                self.mostrar_menu_principal()
+                return
+            
+            # La verificación (KDF lenta a propósito) corre en un hilo de trabajo;
+            # aquí solo se consulta el resultado para no congelar la ventana
+            boton_login.config(state="disabled", text="⏳ Verificando...")
+            futuro = db.authenticate_user_async(usuario, password)
+            
+            def revisar_resultado():
+                if not futuro.done():
+                    self.after(50, revisar_resultado)
+                    return
+                if not boton_login.winfo_exists():
+                    return
+                boton_login.config(state="normal", text="🔓 Iniciar Sesión")
+                try:
+                    usuario_bd = futuro.result()
+                except Exception as e:
+                    messagebox.showerror("Error", f"No se pudo verificar el usuario: {str(e)}")
+                    return
+                if not usuario_bd:
+                    messagebox.showerror("Acceso denegado", "Usuario o contraseña incorrectos")
+                    entry_password.delete(0, tk.END)
+                    return
+                self.rol_usuario.set(usuario_bd['role'])
+                self.mostrar_menu_principal()
+            
+            self.after(50, revisar_resultado)
+
         # Botones con mejor estilo y semi-transparencia
-        tk.Button(login_frame, text="🔓 Iniciar Sesión", command=self.mostrar_menu_principal,
+        boton_login = tk.Button(login_frame, text="🔓 Iniciar Sesión", command=iniciar_sesion,
                  bg=self.color_boton_fondo, fg=self.color_boton_texto, font=("Helvetica", 12, "bold"),
-                 relief="raised", bd=2, padx=20, pady=8, activebackground="#555555").pack(pady=5)
+                 relief="raised", bd=2, padx=20, pady=8, activebackground="#555555")
+        boton_login.pack(pady=5)
+        entry_password.bind("<Return>", lambda e: iniciar_sesion())
         tk.Button(login_frame, text="❌ Salir", command=self.quit,
                  bg="#D32F2F", fg="white", font=("Helvetica", 12, "bold"),
                  relief="raised", bd=2, padx=20, pady=8, activebackground="#B71C1C").pack(pady=5)
@@ -947,9 +999,13 @@ Ctrl+R: Selector de Roles"""
         tk.Button(adv_filters_frame, text="Aplicar filtros", command=self.aplicar_filtros_menu_sushi, bg="#2196F3", fg="white").pack(side="left", padx=(10, 5))
         tk.Button(adv_filters_frame, text="Limpiar filtros", command=lambda: (self.menu_search_var.set(''), self.menu_price_min.set(''), self.menu_price_max.set(''), self._menu_filters.pop('categoria', None), self.aplicar_filtros_menu_sushi()), bg="#9E9E9E", fg="white").pack(side="left")
 
-        # Mostrar productos desde la base de datos
+        # Filtrar mientras se escribe (con debounce)
+        for variable in (self.menu_search_var, self.menu_price_min, self.menu_price_max):
+            variable.trace_add('write', self._programar_filtros_menu)
+
+        # Mostrar productos desde el catálogo
         try:
-            productos = db.load_products()
+            productos = catalogo.all_products()
             # Si la BD está vacía, crear productos de muestra
             if not productos:
                 productos_muestra = [
@@ -975,6 +1031,11 @@ Ctrl+R: Selector de Roles"""
         self._menu_productos_cache = productos
         # Inicializar filtros activos
         self._menu_filters = {}
+        # Filas del Treeview (se crean en el primer filtrado) y último filtro aplicado
+        self._menu_filas = {}
+        self._menu_filas_datos = None
+        self._menu_ultimo_filtro = None
+        self._menu_visibles = []
 
         # Crear tabla de productos mejorada
         tabla_frame = tk.Frame(menu_container, bg=self.color_fondo_ventana)
@@ -1075,9 +1136,8 @@ Ctrl+R: Selector de Roles"""
         
         # Mostrar información del carrito actual
         try:
-            items_carrito = db.get_cart_item_count()
-            total_carrito = db.get_cart_total()
-            carrito_info = f"🛒 Carrito: {items_carrito} items - Total: ${total_carrito:.2f}"
+            resumen_carrito = db.cart_summary()
+            carrito_info = f"🛒 Carrito: {resumen_carrito['items']} items - Total: ${resumen_carrito['total']:.2f}"
         except Exception:
             carrito_info = "🛒 Carrito: 0 items"
         
@@ -1096,7 +1156,7 @@ Ctrl+R: Selector de Roles"""
             if ofertas_bd:
                 self.ofertas = ofertas_bd
             
-            ofertas_activas = [o for o in self.ofertas if o.get('activa', False)]
+            ofertas_activas = promociones.offers_in_force(self.ofertas)
             
             if ofertas_activas:
                 # Frame para ofertas con animación visual
@@ -1140,70 +1200,34 @@ Ctrl+R: Selector de Roles"""
             # Si algo falla, recargar la vista completa
             self.mostrar_menu_sushi()
 
-    def aplicar_filtros_menu_sushi(self):
-        """Aplica filtros (búsqueda, categoría, rango de precio) sobre la cache de productos y actualiza self.menu_tree"""
-        # Limpiar tabla
-        try:
-            for iid in list(self.menu_tree.get_children()):
-                self.menu_tree.delete(iid)
-        except Exception:
-            pass
-
-        productos = getattr(self, '_menu_productos_cache', []) or []
-        filtros = getattr(self, '_menu_filters', {}) or {}
-
-        # Lectura de filtros de UI
-        texto_buscar = (getattr(self, 'menu_search_var', tk.StringVar()).get() or '').strip().lower()
-        precio_min = (getattr(self, 'menu_price_min', tk.StringVar()).get() or '').strip()
-        precio_max = (getattr(self, 'menu_price_max', tk.StringVar()).get() or '').strip()
-
-        try:
-            precio_min_val = float(precio_min) if precio_min else None
-        except Exception:
-            precio_min_val = None
-
-        try:
-            precio_max_val = float(precio_max) if precio_max else None
-        except Exception:
-            precio_max_val = None
+    def _programar_filtros_menu(self, *args):
+        """Reaplica los filtros del menú cuando el usuario deja de escribir"""
+        if getattr(self, '_menu_filtros_after_id', None):
+            self.after_cancel(self._menu_filtros_after_id)
+        self._menu_filtros_after_id = self.after(RETARDO_FILTROS_MENU_MS, self.aplicar_filtros_menu_sushi)
 
-        ofertas_activas = [o for o in self.ofertas if o.get('activa', False)]
+    def _cargar_filas_menu(self, productos, ofertas_vigentes, indice_ofertas):
+        """Crea una fila por producto activo (con su precio de oferta) y la recuerda por iid"""
+        for iid in set(self.menu_tree.get_children()) | set(self._menu_filas):
+            if self.menu_tree.exists(iid):
+                self.menu_tree.delete(iid)
+        self._menu_filas = {}
 
         for prod in productos:
             try:
                 if not prod.get('activo', True):
                     continue
 
-                # Filtrar por categoría si aplica
-                categoria_filtro = filtros.get('categoria')
-                if categoria_filtro and categoria_filtro != 'Todos':
-                    if str(prod.get('categoria', '')).lower() != categoria_filtro.lower():
-                        continue
-
                 nombre = str(prod.get('nombre', ''))
                 descripcion = str(prod.get('descripcion', '') or '')
-
-                # Filtrar por búsqueda
-                if texto_buscar:
-                    if (texto_buscar not in nombre.lower()) and (texto_buscar not in descripcion.lower()):
-                        continue
-
                 precio_original = float(prod.get('precio', 0) or 0)
                 precio_mostrar = precio_original
 
                 # Aplicar ofertas (si aplica) para mostrar precio
-                for oferta in ofertas_activas:
-                    if self._producto_aplica_oferta(prod, oferta):
-                        if oferta.get('tipo') == 'descuento':
-                            descuento = oferta.get('descuento', 0)
-                            precio_mostrar = precio_original * (1 - descuento/100)
-                        break
-
-                # Filtrar por rango de precio
-                if precio_min_val is not None and precio_mostrar < precio_min_val:
-                    continue
-                if precio_max_val is not None and precio_mostrar > precio_max_val:
-                    continue
+                oferta = promociones.best_offer(prod, ofertas_vigentes, indice_ofertas)
+                if oferta and oferta.get('tipo') == 'descuento':
+                    descuento = oferta.get('descuento', 0)
+                    precio_mostrar = precio_original * (1 - descuento/100)
 
                 # Estado de stock
                 stock = prod.get('stock', 0)
@@ -1222,10 +1246,94 @@ Ctrl+R: Selector de Roles"""
                     stock,
                     prod.get('categoria', 'General')
                 ))
+                self._menu_filas[iid] = (prod, precio_mostrar)
             except Exception:
                 # Omitir producto si alguno falla para mantener la UI responsiva
                 continue
 
+    def aplicar_filtros_menu_sushi(self):
+        """Aplica filtros (búsqueda, categoría, rango de precio) sobre la cache de productos y actualiza self.menu_tree
+
+        Las filas se crean una vez por catálogo/ofertas; filtrar solo las desengancha (detach) y
+        las vuelve a enganchar (move). Si la búsqueda solo se alargó, se parte del resultado anterior.
+        """
+        self._menu_filtros_after_id = None
+        if not getattr(self, 'menu_tree', None) or not self.menu_tree.winfo_exists():
+            return
+
+        productos = getattr(self, '_menu_productos_cache', []) or []
+        filtros = getattr(self, '_menu_filters', {}) or {}
+
+        # Lectura de filtros de UI
+        texto_buscar = (getattr(self, 'menu_search_var', tk.StringVar()).get() or '').strip().lower()
+        precio_min = (getattr(self, 'menu_price_min', tk.StringVar()).get() or '').strip()
+        precio_max = (getattr(self, 'menu_price_max', tk.StringVar()).get() or '').strip()
+
+        try:
+            precio_min_val = float(precio_min) if precio_min else None
+        except Exception:
+            precio_min_val = None
+
+        try:
+            precio_max_val = float(precio_max) if precio_max else None
+        except Exception:
+            precio_max_val = None
+
+        # Ofertas activas y dentro de su ventana de fechas/horario
+        ofertas_vigentes = promociones.offers_in_force(self.ofertas)
+        # Índice producto → ofertas (se reconstruye solo si cambian las ofertas o el catálogo)
+        indice_ofertas = promociones.eligibility_index(ofertas_vigentes)
+
+        # Recrear las filas solo si cambiaron los productos o las ofertas
+        datos = getattr(self, '_menu_filas_datos', None)
+        if not datos or datos[0] is not productos or datos[1] is not indice_ofertas:
+            self._cargar_filas_menu(productos, ofertas_vigentes, indice_ofertas)
+            self._menu_filas_datos = (productos, indice_ofertas)
+            self._menu_ultimo_filtro = None
+
+        categoria_filtro = filtros.get('categoria')
+        if categoria_filtro == 'Todos':
+            categoria_filtro = None
+        filtro = (texto_buscar, categoria_filtro, precio_min_val, precio_max_val)
+
+        # Si solo se alargó el texto (mismos filtros), el resultado es un subconjunto del anterior
+        anterior = getattr(self, '_menu_ultimo_filtro', None)
+        estrechar = bool(anterior) and anterior[1:] == filtro[1:] and texto_buscar.startswith(anterior[0])
+        candidatos = self._menu_visibles if estrechar else list(self._menu_filas)
+
+        # Búsqueda de texto con el índice FTS5 (o en memoria), en orden de relevancia
+        if texto_buscar and not (estrechar and texto_buscar == anterior[0]):
+            ranking = {str(p['id']): i for i, p in enumerate(catalogo.search(texto_buscar, candidatos))}
+            candidatos = sorted((iid for iid in candidatos if iid in ranking), key=ranking.get)
+
+        visibles = []
+        for iid in candidatos:
+            prod, precio_mostrar = self._menu_filas[iid]
+            # Filtrar por categoría si aplica
+            if categoria_filtro and str(prod.get('categoria', '')).lower() != categoria_filtro.lower():
+                continue
+            # Filtrar por rango de precio
+            if precio_min_val is not None and precio_mostrar < precio_min_val:
+                continue
+            if precio_max_val is not None and precio_mostrar > precio_max_val:
+                continue
+            visibles.append(iid)
+
+        # Desenganchar las filas que sobran y reordenar/reenganchar las visibles
+        try:
+            visibles_set = set(visibles)
+            ocultar = [iid for iid in self.menu_tree.get_children() if iid not in visibles_set]
+            if ocultar:
+                self.menu_tree.detach(*ocultar)
+            if list(self.menu_tree.get_children()) != visibles:
+                for posicion, iid in enumerate(visibles):
+                    self.menu_tree.move(iid, "", posicion)
+        except Exception:
+            pass
+
+        self._menu_ultimo_filtro = filtro
+        self._menu_visibles = visibles
+
     def agregar_seleccion_al_carrito_mejorado(self):
         """Versión mejorada para agregar productos al carrito con validaciones"""
         sel = self.menu_tree.selection()
@@ -1238,9 +1346,8 @@ Ctrl+R: Selector de Roles"""
             valores = self.menu_tree.item(iid)['values']
             producto_id = valores[0]
             
-            # Buscar producto en BD para obtener datos actualizados
-            productos = db.load_products()
-            producto = next((p for p in productos if str(p.get('id')) == str(producto_id)), None)
+            # Buscar producto en el catálogo (se invalida con cada cambio de productos)
+            producto = catalogo.get_by_id(producto_id)
             
             if not producto:
                 messagebox.showerror("Error", "No se encontró el producto en la base de datos")
@@ -1265,14 +1372,11 @@ Ctrl+R: Selector de Roles"""
             precio_final = float(producto.get('precio', 0))
             oferta_aplicada = None
             
-            ofertas_activas = [o for o in self.ofertas if o.get('activa', False)]
-            for oferta in ofertas_activas:
-                if self._producto_aplica_oferta(producto, oferta):
-                    if oferta['tipo'] == 'descuento':
-                        descuento = oferta['descuento']
-                        precio_final = precio_final * (1 - descuento/100)
-                        oferta_aplicada = oferta['nombre']
-                    break
+            oferta = promociones.best_offer(producto, promociones.offers_in_force(self.ofertas))
+            if oferta and oferta['tipo'] == 'descuento':
+                descuento = oferta['descuento']
+                precio_final = precio_final * (1 - descuento/100)
+                oferta_aplicada = oferta['nombre']
             
             # Agregar al carrito
             nombre_producto = producto.get('nombre') or 'Producto sin nombre'
@@ -1295,21 +1399,7 @@ Ctrl+R: Selector de Roles"""
 
     def _producto_aplica_oferta(self, producto, oferta):
         """Verifica si un producto es elegible para una oferta"""
-        productos_aplicables = oferta.get('productos_aplicables', [])
-        
-        # Si la oferta aplica a "todos" los productos
-        if 'todos' in productos_aplicables or not productos_aplicables:
-            return True
-        
-        # Si el producto específico está en la lista
-        if producto.get('nombre') in productos_aplicables or producto.get('id') in productos_aplicables:
-            return True
-        
-        # Si la categoría del producto está en la lista
-        if producto.get('categoria') in productos_aplicables:
-            return True
-        
-        return False
+        return promociones.offer_applies(producto, oferta)
 
     def mostrar_carrito(self):
         frame = self.limpiar_ventana()
@@ -1430,7 +1520,6 @@ Ctrl+R: Selector de Roles"""
                     messagebox.showwarning("Carrito vacío", "No hay productos en el carrito")
                     return
 
-                orden_id = f"VTA{len(self.ventas)+1:03d}"
                 fecha = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 productos = []
                 total_sin = 0.0
@@ -1445,7 +1534,6 @@ Ctrl+R: Selector de Roles"""
                 total_final = total_sin - descuento_aplicado
 
                 orden = {
-                    'id': orden_id,
                     'fecha': fecha,
                     'productos': productos,
                     'oferta_aplicada': oferta_aplicada,
@@ -1457,18 +1545,10 @@ Ctrl+R: Selector de Roles"""
                     'estado': 'En preparación'
                 }
 
-                # Guardar orden en memoria y en BD
-                self.ventas.append(orden)
-                try:
-                    db.save_order(orden)
-                except Exception:
-                    pass
-
-                # Limpiar carrito
-                try:
+                # Guardar la orden con un ID asignado por la BD y vaciar el carrito en la misma transacción
+                with db.transaction():
+                    orden_id = db.create_order(orden)
                     db.clear_cart()
-                except Exception:
-                    pass
 
                 # Refrescar vista del carrito
                 try:
@@ -1498,14 +1578,6 @@ Ctrl+R: Selector de Roles"""
     def cargar_datos_carrito(self):
         """Carga los datos del carrito desde la base de datos"""
         # Hacer la carga más tolerante a datos incompletos/erróneos para evitar errores intermitentes
-        # Limpiar tabla actual
-        try:
-            for item_id in list(self.carrito_tree.get_children()):
-                self.carrito_tree.delete(item_id)
-        except Exception:
-            # Si la tabla aún no existe por alguna razón, ignorar
-            pass
-
         # Intentar leer items del carrito con reintentos suaves en caso de fallos transitorios
         try:
             items = db.get_cart_items() or []
@@ -1539,40 +1611,42 @@ Ctrl+R: Selector de Roles"""
                 self._cart_load_attempts = 0
                 return
 
-        total_items = 0
-        total_precio = 0.0
         errores_items = []
+        filas = []
 
-        for item in items:
+        for indice, item in enumerate(items):
             try:
                 # Valores seguros
                 cantidad = int(item.get('quantity', 0))
                 precio = float(item.get('price', 0.0))
                 subtotal = cantidad * precio
 
-                total_items += cantidad
-                total_precio += subtotal
-
-                # Insertar en tabla (usar valores formateados)
-                try:
-                    iid = str(item.get('id') or item.get('product_id') or total_items)
-                    self.carrito_tree.insert("", "end", iid=iid, values=(
-                        item.get('product_id', ''),
-                        item.get('product_name', ''),
-                        f"${precio:.2f}",
-                        cantidad,
-                        f"${subtotal:.2f}"
-                    ))
-                except Exception:
-                    # Si falla la inserción visual, continuar con los demás
-                    pass
+                # Fila de la tabla (usar valores formateados)
+                iid = str(item.get('id') or item.get('product_id') or indice)
+                filas.append((iid, (
+                    item.get('product_id', ''),
+                    item.get('product_name', ''),
+                    f"${precio:.2f}",
+                    cantidad,
+                    f"${subtotal:.2f}"
+                )))
             except Exception as e:
                 # Registrar el error del item y continuar
                 errores_items.append(str(e))
                 continue
 
-        # Actualizar labels informativos
+        # Actualizar solo las filas que cambiaron (conserva selección y scroll)
         try:
+            tabla_virtual.sync_rows(self.carrito_tree, filas)
+        except Exception:
+            # Si la tabla aún no existe por alguna razón, ignorar
+            pass
+
+        # Actualizar labels informativos (totales calculados en SQL)
+        try:
+            resumen = db.cart_summary()
+            total_items = resumen['items']
+            total_precio = resumen['total']
             if total_items == 0:
                 self.carrito_info_label.config(text="🛒 Carrito vacío")
                 self.total_label.config(text="Total: $0.00")
@@ -1699,7 +1773,6 @@ Ctrl+R: Selector de Roles"""
                     messagebox.showwarning("Carrito vacío", "No hay productos en el carrito")
                     return
 
-                orden_id = f"VTA{len(self.ventas)+1:03d}"
                 fecha = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 productos = []
                 total_sin = 0.0
@@ -1714,7 +1787,6 @@ Ctrl+R: Selector de Roles"""
                 total_final = total_sin - descuento_aplicado
 
                 orden = {
-                    'id': orden_id,
                     'fecha': fecha,
                     'productos': productos,
                     'oferta_aplicada': oferta_aplicada,
@@ -1726,18 +1798,10 @@ Ctrl+R: Selector de Roles"""
                     'estado': 'En preparación'
                 }
 
-                # Guardar orden en memoria y en BD
-                self.ventas.append(orden)
-                try:
-                    db.save_order(orden)
-                except Exception:
-                    pass
-
-                # Limpiar carrito
-                try:
+                # Guardar la orden con un ID asignado por la BD y vaciar el carrito en la misma transacción
+                with db.transaction():
+                    orden_id = db.create_order(orden)
                     db.clear_cart()
-                except Exception:
-                    pass
 
                 messagebox.showinfo("Pedido Confirmado", f"Pedido {orden_id} confirmado. Total: ${total_final:.2f}")
                 self.mostrar_menu_principal()
@@ -1773,7 +1837,7 @@ Ctrl+R: Selector de Roles"""
         canvas.configure(yscrollcommand=scrollbar.set)
         
         # Mostrar ofertas activas
-        ofertas_activas = [oferta for oferta in self.ofertas if oferta.get('activa', False)]
+        ofertas_activas = promociones.offers_in_force(self.ofertas)
         
         for i, oferta in enumerate(ofertas_activas):
             self._crear_tarjeta_oferta(scrollable_frame, oferta, i)
@@ -1832,7 +1896,7 @@ Ctrl+R: Selector de Roles"""
                     fg="white" if color_tarjeta in ["#4CAF50", "#2196F3", "#FF5722"] else "black").pack(side="left")
         
         # Fecha de validez
-        tk.Label(detalles_frame, text=f"⏰ Válida hasta: {oferta['fecha_fin']}", 
+        tk.Label(detalles_frame, text=f"⏰ Válida hasta: {oferta.get('fecha_fin') or 'sin fecha de fin'}", 
                 font=("Helvetica", 10), bg=color_tarjeta,
                 fg="white" if color_tarjeta in ["#4CAF50", "#2196F3", "#FF5722"] else "black").pack(side="right")
 
@@ -1844,36 +1908,24 @@ Ctrl+R: Selector de Roles"""
         tabla_frame = tk.Frame(frame, bg=self.color_fondo_ventana)
         tabla_frame.pack(expand=True, fill='both', padx=20, pady=(5, 10))
 
-        cols = ("ID Pedido", "Fecha", "Productos", "Total", "Estado")
-        historial_tree = ttk.Treeview(tabla_frame, columns=cols, show='headings', height=12)
-        for c in cols:
-            historial_tree.heading(c, text=c)
-            historial_tree.column(c, anchor='center')
-
-        scrollbar = ttk.Scrollbar(tabla_frame, orient='vertical', command=historial_tree.yview)
-        historial_tree.configure(yscrollcommand=scrollbar.set)
-        historial_tree.pack(side='left', fill='both', expand=True)
-        scrollbar.pack(side='right', fill='y')
-
-        # Cargar pedidos desde la base de datos
-        try:
-            pedidos = db.load_orders()
-        except Exception:
-            pedidos = []
-
-        # Rellenar tabla
-        for venta in sorted(pedidos, key=lambda x: x.get('fecha', ''), reverse=True):
-            try:
-                fecha = venta.get('fecha', '')
-                productos = venta.get('productos', [])
-                productos_texto = ", ".join([f"{p.get('nombre', p.get('id',''))} x{p.get('cantidad',0)}" for p in productos])
-                if len(productos_texto) > 60:
-                    productos_texto = productos_texto[:57] + '...'
-                total = f"${float(venta.get('total_final', 0)):.2f}"
-                estado = venta.get('estado', 'En preparación')
-                historial_tree.insert('', 'end', iid=venta.get('id'), values=(venta.get('id'), fecha, productos_texto, total, estado))
-            except Exception:
-                continue
+        def _valores_pedido(venta):
+            fecha = venta.get('fecha', '')
+            productos = venta.get('productos', [])
+            productos_texto = ", ".join([f"{p.get('nombre', p.get('id',''))} x{p.get('cantidad',0)}" for p in productos])
+            if len(productos_texto) > 60:
+                productos_texto = productos_texto[:57] + '...'
+            total = f"${float(venta.get('total_final', 0)):.2f}"
+            estado = venta.get('estado', 'En preparación')
+            return (venta.get('id'), fecha, productos_texto, total, estado)
+
+        # Tabla virtual sobre los pedidos de la BD: solo las filas visibles están en el Treeview
+        cols = [("ID Pedido", 100, 'center'), ("Fecha", 150, 'center'), ("Productos", 300, 'center'),
+                ("Total", 100, 'center'), ("Estado", 120, 'center')]
+        fuente = tabla_virtual.OrdersSource(sort_columns={"ID Pedido": 'id', "Fecha": 'fecha',
+                                                          "Total": 'total_final', "Estado": 'estado'})
+        historial = tabla_virtual.VirtualTable(tabla_frame, cols, fuente, _valores_pedido,
+                                               bg=self.color_fondo_ventana, height=12)
+        historial.pack(expand=True, fill='both')
 
         # Acciones
         acciones_frame = tk.Frame(frame, bg=self.color_fondo_ventana)
@@ -1883,33 +1935,18 @@ Ctrl+R: Selector de Roles"""
 
         def _refresh():
             try:
-                for iid in historial_tree.get_children():
-                    historial_tree.delete(iid)
-                pedidos = db.load_orders()
-                for venta in sorted(pedidos, key=lambda x: x.get('fecha', ''), reverse=True):
-                    try:
-                        fecha = venta.get('fecha', '')
-                        productos = venta.get('productos', [])
-                        productos_texto = ", ".join([f"{p.get('nombre', p.get('id',''))} x{p.get('cantidad',0)}" for p in productos])
-                        if len(productos_texto) > 60:
-                            productos_texto = productos_texto[:57] + '...'
-                        total = f"${float(venta.get('total_final', 0)):.2f}"
-                        estado = venta.get('estado', 'En preparación')
-                        historial_tree.insert('', 'end', iid=venta.get('id'), values=(venta.get('id'), fecha, productos_texto, total, estado))
-                    except Exception:
-                        continue
+                historial.refresh()
             except Exception:
                 pass
 
         def _ver_detalle():
-            sel = historial_tree.selection()
+            sel = historial.selection()
             if not sel:
                 messagebox.showwarning('Seleccionar', 'Selecciona una venta para ver detalles')
                 return
             vid = sel[0]
             try:
-                pedidos = db.load_orders()
-                venta = next((v for v in pedidos if v.get('id') == vid), None)
+                venta = db.get_order(vid)
                 if not venta:
                     messagebox.showerror('Error', 'Venta no encontrada en la base de datos')
                     return
@@ -1986,16 +2023,6 @@ Ctrl+R: Selector de Roles"""
             pedidos_tree.heading(c, text=c)
             pedidos_tree.column(c, anchor='center')
 
-        # Cargar pedidos activos desde BD
-        try:
-            pedidos = db.load_orders()
-            activos = [p for p in pedidos if p.get('estado', 'En preparación') in ('En preparación', 'Pendiente')]
-        except Exception:
-            activos = []
-
-        for p in activos:
-            pedidos_tree.insert('', 'end', iid=p.get('id'), values=(p.get('id'), p.get('cajero', ''), f"${float(p.get('total_final', 0)):.2f}", p.get('estado', 'En preparación')))
-
         pedidos_tree.pack(side='left', fill='both', expand=True)
         scrollbar = ttk.Scrollbar(tabla_frame, orient='vertical', command=pedidos_tree.yview)
         pedidos_tree.configure(yscrollcommand=scrollbar.set)
@@ -2008,16 +2035,23 @@ Ctrl+R: Selector de Roles"""
         tamaños = self.calcular_tamaños_responsivos()
 
         def _refresh_pedidos():
+            # Cargar pedidos activos desde BD y actualizar solo las filas que cambiaron
             try:
-                for iid in pedidos_tree.get_children():
-                    pedidos_tree.delete(iid)
-                pedidos = db.load_orders()
-                activos = [p for p in pedidos if p.get('estado', 'En preparación') in ('En preparación', 'Pendiente')]
-                for p in activos:
-                    pedidos_tree.insert('', 'end', iid=p.get('id'), values=(p.get('id'), p.get('cajero', ''), f"${float(p.get('total_final', 0)):.2f}", p.get('estado', 'En preparación')))
+                if not pedidos_tree.winfo_exists():
+                    return
+                activos = self._pedidos_activos()
+                tabla_virtual.sync_rows(pedidos_tree, [
+                    (p.get('id'), (p.get('id'), p.get('cajero', ''), f"${float(p.get('total_final', 0)):.2f}", p.get('estado', 'En preparación')))
+                    for p in activos
+                ])
             except Exception:
                 pass
 
+        _refresh_pedidos()
+        # Sincronización automática: se vuelve a consultar solo si cambió la tabla orders
+        self._refrescar_pedidos_activos = _refresh_pedidos
+        self.marcar_ventana_actual('pedidos')
+
         def _cancelar_pedido():
             sel = pedidos_tree.selection()
             if not sel:
@@ -2028,8 +2062,7 @@ Ctrl+R: Selector de Roles"""
                 return
             try:
                 # Actualizar estado en BD
-                pedidos = db.load_orders()
-                orden = next((o for o in pedidos if o.get('id') == pid), None)
+                orden = db.get_order(pid)
                 if not orden:
                     messagebox.showerror('Error', 'Pedido no encontrado')
                     return
@@ -2049,30 +2082,16 @@ Ctrl+R: Selector de Roles"""
             if not messagebox.askyesno('Confirmar', f'¿Marcar el pedido {pid} como Completado? Esto restará el stock de los productos.'):
                 return
             try:
-                pedidos = db.load_orders()
-                orden = next((o for o in pedidos if o.get('id') == pid), None)
+                orden = db.get_order(pid)
                 if not orden:
                     messagebox.showerror('Error', 'Pedido no encontrado')
                     return
 
-                # Restar stock por cada producto en la orden
-                for item in orden.get('productos', []):
-                    # Intentar mapear por nombre o id
-                    prod_name = item.get('nombre')
-                    cantidad = int(item.get('cantidad', 0) or 0)
-                    try:
-                        prod = db.get_product_by_name(prod_name)
-                        if not prod:
-                            # No encontrado por nombre, intentar por id si está presente
-                            prod = db.get_product_by_id(item.get('id')) if item.get('id') else None
-                        if prod:
-                            db.update_product_stock(prod.get('id'), -cantidad)
-                    except Exception:
-                        # Si falla actualizar un producto, continuar con los demás
-                        continue
-
+                # Restar stock de todas las líneas y marcar el pedido en una sola transacción
                 orden['estado'] = 'Completado'
-                db.save_order(orden)
+                with db.transaction():
+                    db.apply_stock_deltas(orden)
+                    db.save_order(orden)
                 messagebox.showinfo('Pedido completado', f'Pedido {pid} marcado como Completado y stock actualizado')
                 _refresh_pedidos()
             except Exception as e:
@@ -2085,6 +2104,14 @@ Ctrl+R: Selector de Roles"""
         # Navegación
         ttk.Button(frame, text='⬅️ Regresar', command=self.mostrar_menu_principal, width=tamaños['boton_width']).pack(pady=10)
 
+    def _pedidos_activos(self):
+        """Pedidos en preparación o pendientes, más recientes primero (filtrados en SQL por estado)"""
+        pedidos = []
+        for estado in ESTADOS_PEDIDO_ACTIVO:
+            pedidos.extend(db.query_orders(estado=estado))
+        pedidos.sort(key=lambda p: (p.get('fecha') or '', p.get('id') or ''), reverse=True)
+        return pedidos
+
     def mostrar_cobrar(self):
         frame = self.limpiar_ventana()
         ttk.Label(frame, text="Cobrar / Facturar 💳", style="Titulo.TLabel").pack(pady=(0, 20))
@@ -2096,12 +2123,9 @@ Ctrl+R: Selector de Roles"""
         # Selección de pedido reciente
         tk.Label(main, text="Seleccionar pedido reciente:", bg=self.color_fondo_ventana, font=("Helvetica", 11, "bold")).pack(anchor='w')
         try:
-            pedidos = db.load_orders()
-            # Ordenar por fecha descendente si la fecha está presente
-            try:
-                pedidos_sorted = sorted(pedidos, key=lambda x: x.get('fecha') or '', reverse=True)
-            except Exception:
-                pedidos_sorted = pedidos
+            # Todos los pedidos, como antes: también los completados o pagados se pueden
+            # cobrar, reimprimir o exportar. El orden por fecha lo resuelve SQL
+            pedidos_sorted = db.query_orders()
         except Exception:
             pedidos_sorted = []
 
@@ -2219,17 +2243,20 @@ Ctrl+R: Selector de Roles"""
             if not messagebox.askyesno('Confirmar pago', f'¿Confirmar pago del pedido {sel}?'):
                 return
             try:
-                pedidos_all = db.load_orders()
-                orden = next((o for o in pedidos_all if o.get('id') == sel), None)
+                orden = db.get_order(sel)
                 if not orden:
                     messagebox.showerror('Error', 'Pedido no encontrado')
                     return
                 orden['estado'] = 'Pagado'
                 db.save_order(orden)
                 messagebox.showinfo('Pago confirmado', f'Pago del pedido {sel} confirmado')
-                # Refrescar combo y detalles
+                # Refrescar solo el pedido cobrado y los detalles
                 try:
-                    pedidos[:] = db.load_orders()
+                    actualizado = db.get_order(sel)
+                    for i, p in enumerate(pedidos_sorted):
+                        if p.get('id') == sel:
+                            pedidos_sorted[i] = actualizado or orden
+                            break
                 except Exception:
                     pass
                 mostrar_detalles_seleccion()
@@ -2288,9 +2315,6 @@ Ctrl+R: Selector de Roles"""
         tabla_frame = tk.Frame(frame, bg=self.color_fondo_ventana)
         tabla_frame.pack(expand=True, fill="both", padx=15, pady=(0, 10))
 
-        columns = ("ID", "Nombre", "Descripción", "Precio", "Stock")
-        self.product_tree = ttk.Treeview(tabla_frame, columns=columns, show="headings", height=10)
-        
         # Configurar columnas con mejor ancho
         columnas_config = [
             ("ID", 80, "center"),
@@ -2300,16 +2324,10 @@ Ctrl+R: Selector de Roles"""
             ("Stock", 80, "center")
         ]
         
-        for col, ancho, anchor in columnas_config:
-            self.product_tree.heading(col, text=col)
-            # Convertir string a constante tkinter
-            anchor_tk = "w" if anchor == "w" else "center" if anchor == "center" else "e"
-            self.product_tree.column(col, width=ancho, anchor=anchor_tk)
-
-        scrollbar = ttk.Scrollbar(tabla_frame, orient="vertical", command=self.product_tree.yview)
-        self.product_tree.configure(yscrollcommand=scrollbar.set)
-        self.product_tree.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
+        # Tabla virtual: solo las filas visibles están en el Treeview
+        self.product_table = tabla_virtual.VirtualTable(tabla_frame, columnas_config, tabla_virtual.ListSource([]),
+                                                        self._valores_fila_producto, bg=self.color_fondo_ventana, height=10)
+        self.product_table.pack(expand=True, fill="both")
 
         # Cargar productos inicialmente
         self.cargar_productos_en_tabla()
@@ -2361,15 +2379,18 @@ Ctrl+R: Selector de Roles"""
                  relief="raised", bd=2, padx=tamaños['boton_gestion_padx'], 
                  pady=tamaños['boton_gestion_pady']).pack(pady=15)
     
+    def _valores_fila_producto(self, p):
+        """Valores de una fila de la tabla de gestión de productos"""
+        precio = float(p.get('precio', 0))
+        # Agregar campo de stock (por defecto 50)
+        stock = p.get('stock', 50)
+        return (p.get('id'), p.get('nombre'), p.get('descripcion', ''), f"${precio:.2f}", stock)
+
     def cargar_productos_en_tabla(self):
         """Carga productos desde la BD y actualiza la tabla"""
         try:
-            # Limpiar tabla actual
-            for item in self.product_tree.get_children():
-                self.product_tree.delete(item)
-            
-            # Cargar productos desde BD
-            productos = db.load_products()
+            # Cargar productos desde el catálogo
+            productos = catalogo.all_products()
             
             # Si no hay productos en BD, crear algunos de muestra
             if not productos:
@@ -2389,14 +2410,13 @@ Ctrl+R: Selector de Roles"""
                 
                 productos = productos_muestra
             
-            # Rellenar tabla
-            for p in productos:
-                precio = float(p.get('precio', 0))
-                # Agregar campo de stock (por defecto 50)
-                stock = p.get('stock', 50)
-                self.product_tree.insert("", "end", iid=str(p.get('id')), 
-                                       values=(p.get('id'), p.get('nombre'), 
-                                              p.get('descripcion', ''), f"${precio:.2f}", stock))
+            # Rellenar tabla (ordenable por columna), conservando posición, selección y orden
+            self.product_table.set_source(tabla_virtual.ListSource(productos, key=lambda p: p.get('id'), sort_keys={
+                "ID": lambda p: str(p.get('id')),
+                "Nombre": lambda p: str(p.get('nombre') or '').casefold(),
+                "Precio": lambda p: float(p.get('precio', 0) or 0),
+                "Stock": lambda p: int(p.get('stock', 50) or 0),
+            }), keep_state=True)
             
             # Actualizar contador
             self.productos_count_label.config(text=f"📦 Total productos: {len(productos)}")
@@ -2413,7 +2433,7 @@ Ctrl+R: Selector de Roles"""
     def mostrar_estadisticas_productos(self):
         """Muestra estadísticas básicas de productos"""
         try:
-            productos = db.load_products()
+            productos = catalogo.all_products()
             if not productos:
                 messagebox.showinfo("Sin datos", "No hay productos en la base de datos")
                 return
@@ -2457,39 +2477,39 @@ Ctrl+R: Selector de Roles"""
             
             if filename:
                 with open(filename, 'w', encoding='utf-8') as f:
-                    json.dump(productos, f, indent=2, ensure_ascii=False)
+                    json.dump(productos, f, indent=2, ensure_ascii=False, default=db.json_default)
                 messagebox.showinfo("Éxito", f"Productos exportados a:\n{filename}")
         
         except Exception as e:
             messagebox.showerror("Error", f"Error al exportar productos: {str(e)}")
 
     def editar_producto_seleccionado(self):
-        sel = self.product_tree.selection()
+        sel = self.product_table.selection()
         if not sel:
             messagebox.showwarning("Seleccionar", "Selecciona un producto para editar")
             return
         
         pid = sel[0]
-        # Obtener valores de la tabla
-        valores = self.product_tree.item(pid)['values']
-        if not valores:
+        # Obtener el producto del catálogo (la fila puede no estar en pantalla)
+        if catalogo.get_by_id(pid) is None:
             messagebox.showerror("Error", "No se pudieron obtener los datos del producto")
             return
         
         # Abrir formulario en modo editar con el ID del producto
-        self.mostrar_formulario_producto("editar", producto_id=valores[0])
+        self.mostrar_formulario_producto("editar", producto_id=pid)
 
     def eliminar_producto_seleccionado(self):
-        sel = self.product_tree.selection()
+        sel = self.product_table.selection()
         if not sel:
             messagebox.showwarning("Seleccionar", "Selecciona un producto para eliminar")
             return
         
         pid = sel[0]
-        valores = self.product_tree.item(pid)['values']
-        if not valores:
+        producto = catalogo.get_by_id(pid)
+        if producto is None:
             messagebox.showerror("Error", "No se pudieron obtener los datos del producto")
             return
+        valores = self._valores_fila_producto(producto)
             
         nombre = valores[1]
         
@@ -2506,12 +2526,8 @@ Ctrl+R: Selector de Roles"""
                 # Eliminar de la base de datos
                 db.delete_product(pid)
                 
-                # Eliminar de la tabla visual
-                self.product_tree.delete(pid)
-                
-                # Actualizar contador
-                productos_restantes = len(self.product_tree.get_children())
-                self.productos_count_label.config(text=f"📦 Total productos: {productos_restantes}")
+                # Recargar la tabla visual y el contador
+                self.cargar_productos_en_tabla()
                 
                 messagebox.showinfo("Éxito", f"Producto '{nombre}' eliminado correctamente")
                 
@@ -2563,7 +2579,7 @@ Ctrl+R: Selector de Roles"""
                 oferta['tipo'].replace('_', ' ').title(), 
                 descuento,
                 estado,
-                oferta['fecha_fin']
+                oferta.get('fecha_fin') or '—'
             ))
         
         # Scrollbar para la tabla
@@ -2657,11 +2673,25 @@ Ctrl+R: Selector de Roles"""
                 font=("Helvetica", 11), relief="solid", bd=2).pack(anchor="w", pady=(0, 10))
         
         # Fecha de fin
-        tk.Label(form_inner, text="Fecha de Fin (YYYY-MM-DD):", font=("Helvetica", 12, "bold"), 
+        tk.Label(form_inner, text="Fecha de Fin (YYYY-MM-DD, opcional):", font=("Helvetica", 12, "bold"), 
                 bg=self.color_fondo_ventana, fg=self.color_texto).pack(anchor="w", pady=(10, 2))
         vars_form['fecha_fin'] = tk.StringVar()
         tk.Entry(form_inner, textvariable=vars_form['fecha_fin'], width=30, 
-                font=("Helvetica", 11), relief="solid", bd=2).pack(anchor="w", pady=(0, 20))
+                font=("Helvetica", 11), relief="solid", bd=2).pack(anchor="w", pady=(0, 10))
+        
+        # Horario diario opcional (happy hour)
+        tk.Label(form_inner, text="Horario diario (HH:MM - HH:MM, opcional):", font=("Helvetica", 12, "bold"), 
+                bg=self.color_fondo_ventana, fg=self.color_texto).pack(anchor="w", pady=(10, 2))
+        horario_frame = tk.Frame(form_inner, bg=self.color_fondo_ventana)
+        horario_frame.pack(anchor="w", pady=(0, 20))
+        vars_form['hora_inicio'] = tk.StringVar()
+        vars_form['hora_fin'] = tk.StringVar()
+        tk.Entry(horario_frame, textvariable=vars_form['hora_inicio'], width=8, 
+                font=("Helvetica", 11), relief="solid", bd=2).pack(side="left")
+        tk.Label(horario_frame, text=" a ", font=("Helvetica", 11), 
+                bg=self.color_fondo_ventana, fg=self.color_texto).pack(side="left")
+        tk.Entry(horario_frame, textvariable=vars_form['hora_fin'], width=8, 
+                font=("Helvetica", 11), relief="solid", bd=2).pack(side="left")
         
         # Si es edición, cargar datos
         if modo == "editar" and oferta_id:
@@ -2671,7 +2701,9 @@ Ctrl+R: Selector de Roles"""
                 vars_form['descripcion'].set(oferta['descripcion'])
                 vars_form['tipo'].set(oferta['tipo'])
                 vars_form['descuento'].set(str(oferta['descuento']))
-                vars_form['fecha_fin'].set(oferta['fecha_fin'])
+                vars_form['fecha_fin'].set(oferta.get('fecha_fin') or '')
+                vars_form['hora_inicio'].set(oferta.get('hora_inicio') or '')
+                vars_form['hora_fin'].set(oferta.get('hora_fin') or '')
         
         # Botones del formulario
         btn_frame = tk.Frame(form_inner, bg=self.color_fondo_ventana)
@@ -2680,14 +2712,38 @@ Ctrl+R: Selector de Roles"""
         def guardar_oferta():
             try:
                 # Validar campos
-                if not all([vars_form['nombre'].get(), vars_form['descripcion'].get(), vars_form['fecha_fin'].get()]):
-                    messagebox.showerror("Error", "Todos los campos son obligatorios")
+                if not all([vars_form['nombre'].get(), vars_form['descripcion'].get()]):
+                    messagebox.showerror("Error", "El nombre y la descripción son obligatorios")
                     return
                 
                 if vars_form['tipo'].get() != "2x1" and not vars_form['descuento'].get().isdigit():
                     messagebox.showerror("Error", "El descuento debe ser un número")
                     return
                 
+                # Sin fecha de fin la oferta no vence (solo se limita por su horario, si tiene)
+                fecha_fin = vars_form['fecha_fin'].get().strip()
+                try:
+                    if fecha_fin:
+                        datetime.datetime.strptime(fecha_fin, "%Y-%m-%d")
+                except ValueError:
+                    messagebox.showerror("Error", "La fecha de fin debe tener el formato YYYY-MM-DD")
+                    return
+                
+                hora_inicio = vars_form['hora_inicio'].get().strip()
+                hora_fin = vars_form['hora_fin'].get().strip()
+                if bool(hora_inicio) != bool(hora_fin):
+                    messagebox.showerror("Error", "Indica la hora de inicio y la de fin, o deja ambas vacías")
+                    return
+                try:
+                    for hora in (hora_inicio, hora_fin):
+                        if hora:
+                            datetime.datetime.strptime(hora, "%H:%M")
+                except ValueError:
+                    messagebox.showerror("Error", "Las horas deben tener el formato HH:MM")
+                    return
+                
+                anterior = next((o for o in self.ofertas if o['id'] == oferta_id), None) if modo == "editar" else None
+                
                 # Crear nueva oferta o actualizar existente
                 nueva_oferta = {
                     "id": oferta_id if modo == "editar" else f"OFF{len(self.ofertas)+1:03d}",
@@ -2697,8 +2753,10 @@ Ctrl+R: Selector de Roles"""
                     "productos_aplicables": ["todos"],
                     "descuento": 50 if vars_form['tipo'].get() == "2x1" else int(vars_form['descuento'].get()),
                     "activa": True,
-                    "fecha_inicio": "2025-09-26",
-                    "fecha_fin": vars_form['fecha_fin'].get()
+                    "fecha_inicio": (anterior or {}).get('fecha_inicio') or datetime.date.today().strftime("%Y-%m-%d"),
+                    "fecha_fin": fecha_fin or None,
+                    "hora_inicio": hora_inicio or None,
+                    "hora_fin": hora_fin or None
                 }
                 
                 if modo == "nueva":
@@ -2930,14 +2988,11 @@ Ctrl+R: Selector de Roles"""
     def cargar_usuarios_en_tabla(self):
         """Carga usuarios desde la BD y actualiza la tabla"""
         try:
-            # Limpiar tabla actual
-            for item in self.users_tree.get_children():
-                self.users_tree.delete(item)
-            
             # Cargar usuarios desde BD
             usuarios = db.load_users()
             
             # Rellenar tabla
+            filas = []
             for usuario in usuarios:
                 ultimo_login = usuario.get('last_login', 'Nunca')
                 if ultimo_login and ultimo_login != 'Nunca':
@@ -2948,16 +3003,18 @@ Ctrl+R: Selector de Roles"""
                 
                 estado = "✅ Activo" if usuario.get('active', True) else "❌ Inactivo"
                 
-                self.users_tree.insert("", "end", iid=str(usuario.get('id')), 
-                                      values=(
-                                          usuario.get('id'),
-                                          usuario.get('username'),
-                                          usuario.get('full_name', ''),
-                                          usuario.get('role', 'cliente').capitalize(),
-                                          usuario.get('email', ''),
-                                          ultimo_login,
-                                          estado
-                                      ))
+                filas.append((str(usuario.get('id')), (
+                    usuario.get('id'),
+                    usuario.get('username'),
+                    usuario.get('full_name', ''),
+                    usuario.get('role', 'cliente').capitalize(),
+                    usuario.get('email', ''),
+                    ultimo_login,
+                    estado
+                )))
+            
+            # Actualizar solo las filas que cambiaron (conserva selección y scroll)
+            tabla_virtual.sync_rows(self.users_tree, filas)
             
             # Actualizar contador
             self.usuarios_count_label.config(text=f"👤 Total usuarios: {len(usuarios)}")
@@ -3038,21 +3095,27 @@ Ctrl+R: Selector de Roles"""
                 messagebox.showerror("Error", "La contraseña debe tener al menos 6 caracteres")
                 return
             
-            try:
-                if db.change_user_password(user_id, nueva):
+            def al_terminar(cambiada, error):
+                boton_guardar.config(state="normal", text="💾 Guardar")
+                if error is not None:
+                    messagebox.showerror("Error", f"Error al cambiar contraseña: {str(error)}")
+                elif cambiada:
                     messagebox.showinfo("Éxito", f"Contraseña cambiada exitosamente para {username}")
                     password_window.destroy()
                 else:
                     messagebox.showerror("Error", "No se pudo cambiar la contraseña")
-            except Exception as e:
-                messagebox.showerror("Error", f"Error al cambiar contraseña: {str(e)}")
+            
+            # El hash (KDF lenta a propósito) se calcula en el hilo de trabajo
+            boton_guardar.config(state="disabled", text="⏳ Guardando...")
+            self._esperar_futuro(db.change_user_password_async(user_id, nueva), al_terminar, password_window)
         
         btn_frame = tk.Frame(password_window, bg=self.color_fondo_ventana)
         btn_frame.pack(pady=20)
         
-        tk.Button(btn_frame, text="💾 Guardar", command=guardar_nueva_password,
+        boton_guardar = tk.Button(btn_frame, text="💾 Guardar", command=guardar_nueva_password,
                  bg="#4CAF50", fg="white", font=("Helvetica", 11, "bold"),
-                 relief="raised", bd=2, padx=20, pady=8).pack(side="left", padx=10)
+                 relief="raised", bd=2, padx=20, pady=8)
+        boton_guardar.pack(side="left", padx=10)
         
         tk.Button(btn_frame, text="❌ Cancelar", command=password_window.destroy,
                  bg="#F44336", fg="white", font=("Helvetica", 11, "bold"),
@@ -3251,12 +3314,20 @@ Ctrl+R: Selector de Roles"""
 
             try:
                 if modo == 'nuevo':
-                    # Crear nuevo usuario
-                    if db.create_user(username, var_password.get(), full_name, role, email):
-                        messagebox.showinfo("Éxito", "Usuario creado exitosamente")
-                        self.mostrar_gestion_usuarios()
-                    else:
-                        messagebox.showerror("Error", "El nombre de usuario ya existe")
+                    def al_terminar(creado, error):
+                        boton_guardar.config(state="normal", text="💾 Guardar Usuario")
+                        if error is not None:
+                            messagebox.showerror("Error", f"No se pudo guardar el usuario: {str(error)}")
+                        elif creado:
+                            messagebox.showinfo("Éxito", "Usuario creado exitosamente")
+                            self.mostrar_gestion_usuarios()
+                        else:
+                            messagebox.showerror("Error", "El nombre de usuario ya existe")
+                    
+                    # Crear nuevo usuario; el hash de la contraseña se calcula en el hilo de trabajo
+                    boton_guardar.config(state="disabled", text="⏳ Guardando...")
+                    self._esperar_futuro(db.create_user_async(username, var_password.get(), full_name, role, email),
+                                         al_terminar, boton_guardar)
                 else:
                     # Editar usuario existente
                     if user_id is not None:
@@ -3274,9 +3345,10 @@ Ctrl+R: Selector de Roles"""
         btn_frame.pack(pady=(20, 30))
 
         # Botones con colores mejorados
-        tk.Button(btn_frame, text="💾 Guardar Usuario", command=guardar_usuario,
+        boton_guardar = tk.Button(btn_frame, text="💾 Guardar Usuario", command=guardar_usuario,
                   bg="#4CAF50", fg="white", font=("Helvetica", 12, "bold"),
-                  relief="raised", bd=2, padx=25, pady=10, width=20).pack(side="left", padx=10)
+                  relief="raised", bd=2, padx=25, pady=10, width=20)
+        boton_guardar.pack(side="left", padx=10)
         
         tk.Button(btn_frame, text="❌ Cancelar", command=self.mostrar_gestion_usuarios,
                   bg="#F44336", fg="white", font=("Helvetica", 12, "bold"),
@@ -3377,21 +3449,30 @@ Ctrl+R: Selector de Roles"""
                 messagebox.showerror("Error", "Las contraseñas no coinciden")
                 return
 
-            try:
-                db.change_user_password(user_id, nueva_password)
+            def al_terminar(cambiada, error):
+                boton_cambiar.config(state="normal", text="🔒 Cambiar Contraseña")
+                if error is not None:
+                    messagebox.showerror("Error", f"No se pudo cambiar la contraseña: {str(error)}")
+                    return
+                if not cambiada:
+                    messagebox.showerror("Error", "No se pudo cambiar la contraseña")
+                    return
                 messagebox.showinfo("Éxito", "Contraseña actualizada exitosamente")
                 ventana_password.destroy()
                 self.actualizar_usuarios_desde_bd()  # Refrescar tabla
-            except Exception as e:
-                messagebox.showerror("Error", f"No se pudo cambiar la contraseña: {str(e)}")
+
+            # El hash (KDF lenta a propósito) se calcula en el hilo de trabajo
+            boton_cambiar.config(state="disabled", text="⏳ Guardando...")
+            self._esperar_futuro(db.change_user_password_async(user_id, nueva_password), al_terminar, ventana_password)
 
         # Frame para botones
         btn_frame = tk.Frame(ventana_password, bg=self.color_fondo_ventana)
         btn_frame.pack(pady=20)
 
-        tk.Button(btn_frame, text="🔒 Cambiar Contraseña", command=confirmar_cambio,
+        boton_cambiar = tk.Button(btn_frame, text="🔒 Cambiar Contraseña", command=confirmar_cambio,
                   bg="#4CAF50", fg="white", font=("Helvetica", 11, "bold"),
-                  relief="raised", bd=2, padx=20, pady=8).pack(side="left", padx=10)
+                  relief="raised", bd=2, padx=20, pady=8)
+        boton_cambiar.pack(side="left", padx=10)
         
         tk.Button(btn_frame, text="❌ Cancelar", command=ventana_password.destroy,
                   bg="#F44336", fg="white", font=("Helvetica", 11, "bold"),
@@ -3400,18 +3481,50 @@ Ctrl+R: Selector de Roles"""
         # Focus en el primer campo
         entry_nueva.focus()
 
+    def _esperar_futuro(self, futuro, al_terminar, widget=None):
+        """Consulta con after() un Future de un hilo de trabajo sin bloquear la ventana.
+
+        Al terminar llama a al_terminar(resultado, error), salvo que `widget` ya no exista.
+        """
+        def revisar():
+            if not futuro.done():
+                self.after(50, revisar)
+                return
+            if widget is not None and not widget.winfo_exists():
+                return
+            try:
+                resultado, error = futuro.result(), None
+            except Exception as e:
+                resultado, error = None, e
+            al_terminar(resultado, error)
+        
+        self.after(50, revisar)
+
+    def _tablas_cambiadas(self, nombre_ventana):
+        """Indica si cambió alguna tabla de la ventana desde la última carga, y guarda las versiones."""
+        tablas = TABLAS_POR_VENTANA.get(nombre_ventana, ())
+        versiones = db.table_versions()
+        anteriores = getattr(self, '_versiones_sync', None) or {}
+        self._versiones_sync = versiones
+        return any(versiones.get(t) != anteriores.get(t) for t in tablas)
+
     def sincronizar_datos_automaticamente(self):
         """Sistema de sincronización automática de datos"""
         # Solo sincronizar si hay una ventana activa y BD disponible
         try:
-            # Refrescar datos según la ventana actual
-            if hasattr(self, 'ventana_actual'):
+            # Descartar el catálogo si otra terminal modificó productos
+            catalogo.refresh_if_stale()
+            
+            # Refrescar datos según la ventana actual, solo si sus tablas cambiaron
+            if hasattr(self, 'ventana_actual') and self._tablas_cambiadas(self.ventana_actual):
                 if self.ventana_actual == 'productos':
                     self.actualizar_productos_desde_bd()
                 elif self.ventana_actual == 'carrito':
                     self.actualizar_carrito_desde_bd()
                 elif self.ventana_actual == 'usuarios':
                     self.actualizar_usuarios_desde_bd()
+                elif self.ventana_actual == 'pedidos':
+                    self.actualizar_pedidos_desde_bd()
                 elif self.ventana_actual == 'ofertas':
                     # Para ofertas necesitamos un parent, usamos None para que no falle
                     pass
@@ -3423,6 +3536,25 @@ Ctrl+R: Selector de Roles"""
         # Programar próxima sincronización en 30 segundos
         self.after(30000, self.sincronizar_datos_automaticamente)
 
+    def programar_ofertas(self):
+        """Aplica el programador de ofertas y se vuelve a llamar en el próximo límite de ventana"""
+        try:
+            cambios = promociones.run_scheduler()
+            for oferta in self.ofertas:
+                if oferta.get('id') in cambios:
+                    oferta['activa'] = cambios[oferta['id']]
+            proximo = promociones.next_boundary(promociones.schedule(self.ofertas))
+        except Exception as e:
+            print(f"Error en el programador de ofertas: {e}")
+            proximo = None
+        
+        # Despertar justo en el próximo límite (como máximo cada 30 minutos)
+        espera = 1800000
+        if proximo:
+            segundos = (proximo - datetime.datetime.now()).total_seconds()
+            espera = min(espera, max(1000, int(segundos * 1000) + 500))
+        self.after(espera, self.programar_ofertas)
+
     def iniciar_sincronizacion_automatica(self):
         """Iniciar el sistema de sincronización automática"""
         # Marcar que se debe sincronizar automáticamente
@@ -3437,6 +3569,11 @@ Ctrl+R: Selector de Roles"""
     def marcar_ventana_actual(self, nombre_ventana):
         """Marcar cuál es la ventana actual para sincronización"""
         self.ventana_actual = nombre_ventana
+        # La ventana acaba de cargar sus datos: tomar las versiones de tablas como referencia
+        try:
+            self._versiones_sync = db.table_versions()
+        except Exception:
+            self._versiones_sync = None
 
     def actualizar_productos_desde_bd(self):
         """Actualizar datos de productos desde BD"""
@@ -3448,6 +3585,12 @@ Ctrl+R: Selector de Roles"""
         if hasattr(self, 'carrito_tree'):
             self.cargar_datos_carrito()
 
+    def actualizar_pedidos_desde_bd(self):
+        """Actualizar pedidos activos desde BD"""
+        refrescar = getattr(self, '_refrescar_pedidos_activos', None)
+        if refrescar:
+            refrescar()
+
     def actualizar_reportes_desde_bd(self):
         """Actualizar datos de reportes desde BD"""
         if hasattr(self, 'reportes_tree'):
@@ -3583,8 +3726,7 @@ Ctrl+R: Selector de Roles"""
         # Si es edición, cargar valores
         if modo == 'editar' and producto_id:
             try:
-                productos = db.load_products()
-                prod = next((p for p in productos if str(p.get('id')) == str(producto_id)), None)
+                prod = catalogo.get_by_id(producto_id)
                 if prod:
                     var_id.set(prod.get('id', ''))
                     entry_id.config(state='disabled')  # No permitir cambiar ID en edición
@@ -3621,8 +3763,7 @@ Ctrl+R: Selector de Roles"""
             elif modo == 'nueva':
                 # Verificar que el ID no exista ya
                 try:
-                    productos_existentes = db.load_products()
-                    if any(p.get('id') == pid for p in productos_existentes):
+                    if catalogo.get_by_id(pid) is not None:
                         errores.append(f"• El ID '{pid}' ya existe")
                 except Exception:
                     pass
@@ -3713,8 +3854,7 @@ Ctrl+R: Selector de Roles"""
     def actualizar_datos_reportes_seguro(self):
         """Actualiza los datos de reportes de manera segura"""
         try:
-            # Recargar datos desde la base de datos
-            self.ventas = db.load_orders()
+            # Recargar datos desde la base de datos (las ventas se agregan en SQL en cada pestaña)
             self.productos = db.load_products()
             self.ofertas = db.load_offers()
             
@@ -3755,17 +3895,17 @@ Ctrl+R: Selector de Roles"""
         # INICIALIZACIÓN DE DATOS DESDE BASE DE DATOS
         # ============================================================
         try:
-            # Cargar datos frescos desde la base de datos
-            self.ventas = db.load_orders()
-            self.productos = db.load_products()
-            self.ofertas = db.load_offers()
+            # Cargar datos frescos desde la base de datos (perfil de lectura para reportes).
+            # Las ventas no se cargan: las pestañas usan los agregados SQL de reportes.
+            with db.pragma_profile('reporting'):
+                self.productos = db.load_products()
+                self.ofertas = db.load_offers()
             
-            # Variables de filtros
-            self.ventas_filtradas = self.ventas.copy()
+            # Variables de filtros (vacío = sin filtro, se recorre toda la BD)
+            self.ventas_filtradas = []
             
         except Exception as e:
             messagebox.showerror("Error BD", f"Error al cargar datos: {str(e)}")
-            self.ventas = []
             self.productos = []
             self.ofertas = []
             self.ventas_filtradas = []
@@ -3815,7 +3955,7 @@ Ctrl+R: Selector de Roles"""
         
         # Título de filtros con contador
         filtros_titulo = tk.Label(filters_container,
-                text=f"🔍 Filtros de Búsqueda - Total: {len(self.ventas)} ventas en BD",
+                text=f"🔍 Filtros de Búsqueda - Total: {db.count_orders()} ventas en BD",
                 font=("Arial", 12, "bold"),
                 bg="#F5F5F5", fg="#333")
         filtros_titulo.pack(pady=10)
@@ -3862,7 +4002,7 @@ Ctrl+R: Selector de Roles"""
         
         # Filtro por cajero
         tk.Label(filter_row2, text="Cajero:", bg="#F5F5F5", fg="#333", font=("Arial", 10, "bold")).pack(side="left")
-        cajeros = ["Todos"] + list(set([v['cajero'] for v in self.ventas if v['cajero']]))
+        cajeros = ["Todos"] + [c['valor'] for c in reportes.sales_by_cashier() if c['valor'] and c['valor'] != 'No especificado']
         self.filtro_cajero = ttk.Combobox(filter_row2, values=cajeros, width=15, font=("Arial", 10), state="readonly")
         self.filtro_cajero.pack(side="left", padx=(5, 15))
         self.filtro_cajero.set("Todos")
@@ -3963,16 +4103,19 @@ Ctrl+R: Selector de Roles"""
         main_frame = tk.Frame(parent, bg=self.color_fondo_ventana)
         main_frame.pack(expand=True, fill="both", padx=20, pady=15)
         
-        # Los datos ya están cargados en __init__, usarlos directamente
-        # Calcular métricas completas desde datos reales de BD
-        total_ventas = len(self.ventas) if hasattr(self, 'ventas') and self.ventas else 0
-        ingresos_totales = sum(venta.get('total_final', 0) for venta in self.ventas) if self.ventas else 0
-        descuentos_totales = sum(venta.get('descuento_aplicado', 0) for venta in self.ventas) if self.ventas else 0
+        # Calcular métricas completas con agregados SQL sobre la BD
+        try:
+            resumen = reportes.sales_summary()
+        except Exception:
+            resumen = {}
+        total_ventas = resumen.get('total_ventas', 0)
+        ingresos_totales = resumen.get('ingresos_totales', 0)
+        descuentos_totales = resumen.get('descuentos_totales', 0)
         
         # Métricas adicionales para análisis completo
-        ventas_completadas = len([v for v in self.ventas if v.get('estado') == 'Completado']) if self.ventas else 0
-        ventas_canceladas = len([v for v in self.ventas if v.get('estado') == 'Cancelado']) if self.ventas else 0
-        ingresos_sin_descuentos = sum(venta.get('total_sin_descuento', 0) for venta in self.ventas) if self.ventas else 0
+        ventas_completadas = resumen.get('ventas_completadas', 0)
+        ventas_canceladas = resumen.get('ventas_canceladas', 0)
+        ingresos_sin_descuentos = resumen.get('ingresos_sin_descuentos', 0)
         
         # Frame para métricas principales con LabelFrame
         metricas_frame = tk.LabelFrame(main_frame, text="📊 Métricas Principales (Datos en Tiempo Real)", 
@@ -4022,30 +4165,14 @@ Ctrl+R: Selector de Roles"""
         
         # Análisis detallado basado en datos reales de BD
         if total_ventas > 0:
-            # Análisis de productos más vendidos
-            productos_vendidos = {}
-            metodos_pago = {}
-            cajeros_ventas = {}
-            
-            for venta in self.ventas:
-                try:
-                    # Contar productos vendidos
-                    for producto in venta.get('productos', []):
-                        nombre = producto.get('nombre', 'Producto sin nombre')
-                        cantidad = producto.get('cantidad', 0)
-                        productos_vendidos[nombre] = productos_vendidos.get(nombre, 0) + cantidad
-                    
-                    # Contar métodos de pago
-                    metodo = venta.get('metodo_pago', 'No especificado')
-                    metodos_pago[metodo] = metodos_pago.get(metodo, 0) + 1
-                    
-                    # Contar ventas por cajero
-                    cajero = venta.get('cajero', 'No especificado')
-                    cajeros_ventas[cajero] = cajeros_ventas.get(cajero, 0) + 1
-                    
-                except Exception as e:
-                    print(f"Error procesando venta: {e}")
-                    continue
+            # Productos más vendidos, métodos de pago y cajeros (agregados en SQL)
+            try:
+                productos_vendidos = {p['nombre'] or 'Producto sin nombre': p['cantidad_vendida'] for p in reportes.sales_by_product()}
+                metodos_pago = {m['valor']: m['ventas'] for m in reportes.sales_by_payment_method()}
+                cajeros_ventas = {c['valor']: c['ventas'] for c in reportes.sales_by_cashier()}
+            except Exception as e:
+                print(f"Error al calcular análisis rápido: {e}")
+                productos_vendidos, metodos_pago, cajeros_ventas = {}, {}, {}
             
             # Crear panel de información adicional
             if productos_vendidos or metodos_pago or cajeros_ventas:
@@ -4105,121 +4232,91 @@ Ctrl+R: Selector de Roles"""
         tabla_container = tk.Frame(tabla_frame, bg=self.color_fondo_ventana)
         tabla_container.pack(expand=True, fill="both")
         
-        tree = ttk.Treeview(tabla_container, columns=("ID", "Fecha", "Productos", "Oferta", "Descuento", "Total"), show="headings", height=10)
-        
         # Configurar columnas
         columnas_info = [
-            ("ID", 80),
-            ("Fecha", 130),
-            ("Productos", 200),
-            ("Oferta", 120),
-            ("Descuento", 100),
-            ("Total", 100)
+            ("ID", 80, "center"),
+            ("Fecha", 130, "w"),
+            ("Productos", 200, "w"),
+            ("Oferta", 120, "w"),
+            ("Descuento", 100, "center"),
+            ("Total", 100, "center")
         ]
         
-        for col, ancho in columnas_info:
-            tree.heading(col, text=col)
-            tree.column(col, width=ancho, anchor="center" if col in ["ID", "Descuento", "Total"] else "w")
-        
-        # Llenar tabla con datos de ventas reales (manejo robusto de errores)
-        if self.ventas:
-            ventas_ordenadas = sorted([v for v in self.ventas if v and 'fecha' in v], 
-                                    key=lambda x: x.get('fecha', ''), reverse=True)
-            
-            for i, venta in enumerate(ventas_ordenadas[:100]):  # Últimas 100 ventas
-                try:
-                    # Validar datos esenciales
-                    venta_id = venta.get('id', f'VENTA_{i+1}')
-                    fecha_raw = venta.get('fecha', '')
-                    
-                    # Formatear fecha de manera segura
-                    try:
-                        fecha_dt = datetime.datetime.strptime(fecha_raw, '%Y-%m-%d %H:%M:%S')
-                        fecha_formateada = fecha_dt.strftime('%d/%m/%Y %H:%M')
-                    except:
-                        fecha_formateada = fecha_raw[:16] if len(fecha_raw) > 16 else fecha_raw
-                    
-                    # Procesar productos de manera segura
-                    productos = venta.get('productos', [])
-                    if isinstance(productos, list) and productos:
-                        productos_texto = ", ".join([
-                            f"{p.get('nombre', 'Producto')} x{p.get('cantidad', 0)}" 
-                            for p in productos if isinstance(p, dict)
-                        ])
-                    else:
-                        productos_texto = "Sin productos"
-                    
-                    if len(productos_texto) > 35:
-                        productos_texto = productos_texto[:32] + "..."
-                    
-                    # Formatear campos de manera segura
-                    oferta_texto = venta.get('oferta_aplicada') or "Sin oferta"
-                    descuento_aplicado = float(venta.get('descuento_aplicado', 0))
-                    total_final = float(venta.get('total_final', 0))
-                    
-                    descuento_texto = f"${descuento_aplicado:.2f}"
-                    total_texto = f"${total_final:.2f}"
-                    
-                    # Estado para codificación por colores
-                    estado = venta.get('estado', 'Desconocido')
-                    
-                    # Insertar en tabla con ID único
-                    item_id = tree.insert("", "end", values=(
-                        venta_id, fecha_formateada, productos_texto, 
-                        oferta_texto, descuento_texto, total_texto
-                    ))
-                    
-                    # Colorear según estado (opcional)
-                    if estado == 'Completado':
-                        tree.set(item_id, "ID", f"✅ {venta_id}")
-                    elif estado == 'Cancelado':
-                        tree.set(item_id, "ID", f"❌ {venta_id}")
-                    elif estado == 'En preparación':
-                        tree.set(item_id, "ID", f"⏳ {venta_id}")
-                        
-                except Exception as e:
-                    print(f"Error al procesar venta {venta.get('id', f'venta_{i}')}: {e}")
-                    # Insertar entrada de error para debugging
-                    try:
-                        tree.insert("", "end", values=(
-                            f"ERROR_{i}", "Error de datos", "Datos corruptos", 
-                            "N/A", "$0.00", "$0.00"
-                        ))
-                    except:
-                        pass
-                    continue
-        else:
-            # Mostrar mensaje cuando no hay datos
-            tree.insert("", "end", values=(
-                "SIN_DATOS", "No hay ventas", "Cargar datos desde BD", 
-                "N/A", "$0.00", "$0.00"
-            ))
-        
-        # Configurar scrollbars mejorados
-        scrollbar_v = ttk.Scrollbar(tabla_container, orient="vertical", command=tree.yview)
-        scrollbar_h = ttk.Scrollbar(tabla_container, orient="horizontal", command=tree.xview)
-        tree.configure(yscrollcommand=scrollbar_v.set, xscrollcommand=scrollbar_h.set)
-        
-        # Layout mejorado con grid para mejor control
-        tree.grid(row=0, column=0, sticky="nsew")
-        scrollbar_v.grid(row=0, column=1, sticky="ns")
-        scrollbar_h.grid(row=1, column=0, sticky="ew")
-        
-        tabla_container.grid_rowconfigure(0, weight=1)
-        tabla_container.grid_columnconfigure(0, weight=1)
+        # Tabla virtual sobre las ventas de la BD (solo las filas visibles están en el Treeview)
+        fuente = tabla_virtual.OrdersSource(sort_columns={"ID": 'id', "Fecha": 'fecha', "Oferta": 'oferta_aplicada',
+                                                          "Descuento": 'descuento_aplicado', "Total": 'total_final'})
+        tabla = tabla_virtual.VirtualTable(tabla_container, columnas_info, fuente, self._valores_fila_tabla_ventas,
+                                           fila_vacia=("SIN_DATOS", "No hay ventas", "Cargar datos desde BD",
+                                                       "N/A", "$0.00", "$0.00"),
+                                           horizontal=True, bg=self.color_fondo_ventana, height=10)
+        tabla.pack(expand=True, fill="both")
+        tree = tabla.tree
+        # Tabla virtual de cada Treeview de ventas (por nombre), para recargarla desde la BD
+        if not hasattr(self, '_tablas_ventas'):
+            self._tablas_ventas = {}
+        self._tablas_ventas[str(tree)] = tabla
         
         # Guardar referencia del tree para uso en otras funciones
         self.current_tree_ventas = tree
-        scrollbar_h.pack(side="bottom", fill="x")
     
+    def _valores_fila_tabla_ventas(self, venta):
+        """Valores de una fila de la tabla de ventas del resumen de reportes"""
+        try:
+            # Validar datos esenciales
+            venta_id = venta.get('id', 'VENTA')
+            fecha_raw = venta.get('fecha', '')
+
+            # Formatear fecha de manera segura
+            try:
+                fecha_dt = datetime.datetime.strptime(fecha_raw, '%Y-%m-%d %H:%M:%S')
+                fecha_formateada = fecha_dt.strftime('%d/%m/%Y %H:%M')
+            except:
+                fecha_formateada = fecha_raw[:16] if len(fecha_raw) > 16 else fecha_raw
+
+            # Procesar productos de manera segura
+            productos = venta.get('productos', [])
+            if isinstance(productos, list) and productos:
+                productos_texto = ", ".join([
+                    f"{p.get('nombre', 'Producto')} x{p.get('cantidad', 0)}" 
+                    for p in productos if isinstance(p, (dict, db.Record))
+                ])
+            else:
+                productos_texto = "Sin productos"
+
+            if len(productos_texto) > 35:
+                productos_texto = productos_texto[:32] + "..."
+
+            # Formatear campos de manera segura
+            oferta_texto = venta.get('oferta_aplicada') or "Sin oferta"
+            descuento_aplicado = float(venta.get('descuento_aplicado', 0))
+            total_final = float(venta.get('total_final', 0))
+
+            descuento_texto = f"${descuento_aplicado:.2f}"
+            total_texto = f"${total_final:.2f}"
+
+            # Estado para codificación por colores
+            estado = venta.get('estado', 'Desconocido')
+            id_texto = venta_id
+            if estado == 'Completado':
+                id_texto = f"✅ {venta_id}"
+            elif estado == 'Cancelado':
+                id_texto = f"❌ {venta_id}"
+            elif estado == 'En preparación':
+                id_texto = f"⏳ {venta_id}"
+
+            return (id_texto, fecha_formateada, productos_texto, 
+                    oferta_texto, descuento_texto, total_texto)
+
+        except Exception as e:
+            print(f"Error al procesar venta {venta.get('id', 'venta')}: {e}")
+            # Fila de error para debugging
+            return (venta.get('id', 'ERROR'), "Error de datos", "Datos corruptos", 
+                    "N/A", "$0.00", "$0.00")
+
     def actualizar_datos_reportes(self):
         """Actualiza los datos de reportes desde la base de datos"""
         try:
             # Recargar datos desde BD
-            ventas_bd = db.load_orders()
-            if ventas_bd:
-                self.ventas = ventas_bd
-            
             ofertas_bd = db.load_offers()
             if ofertas_bd:
                 self.ofertas = ofertas_bd
@@ -4250,19 +4347,19 @@ Ctrl+R: Selector de Roles"""
             # Forzar actualización de la ventana
             loading_window.update()
             
-            # Recargar todos los datos desde BD
-            self.ventas = db.load_orders()
+            # Recargar todos los datos desde BD (las ventas solo se cuentan)
+            total_ventas = db.count_orders()
             self.productos = db.load_products()
             self.ofertas = db.load_offers()
             
             # Actualizar filtros también
-            self.ventas_filtradas = self.ventas.copy()
+            self.ventas_filtradas = []
             
             # Cerrar ventana de carga
             loading_window.destroy()
             
             # Mensaje de confirmación
-            messagebox.showinfo("Éxito", f"Datos actualizados correctamente:\n• {len(self.ventas)} ventas\n• {len(self.productos)} productos\n• {len(self.ofertas)} ofertas")
+            messagebox.showinfo("Éxito", f"Datos actualizados correctamente:\n• {total_ventas} ventas\n• {len(self.productos)} productos\n• {len(self.ofertas)} ofertas")
             
             # Refrescar completamente la vista de reportes
             self.mostrar_reportes()
@@ -4296,46 +4393,16 @@ Ctrl+R: Selector de Roles"""
                 messagebox.showerror("Error", "Formato de fecha inválido. Use YYYY-MM-DD")
                 return
             
-            # Aplicar filtros paso a paso
-            ventas_filtradas = []
-            total_ventas_bd = len(self.ventas)
-            
-            for venta in self.ventas:
-                # Validar que la venta tenga los campos necesarios
-                if not all(key in venta for key in ['fecha', 'productos', 'cajero']):
-                    continue
-                
-                try:
-                    fecha_venta = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S')
-                    fecha_venta_solo = fecha_venta.date()
-                    
-                    # Filtro por fecha
-                    if not (fecha_inicio_dt.date() <= fecha_venta_solo <= fecha_fin_dt.date()):
-                        continue
-                    
-                    # Filtro por producto
-                    if producto_filtro != "Todos":
-                        productos_en_venta = [p.get('nombre', '') for p in venta.get('productos', [])]
-                        if producto_filtro not in productos_en_venta:
-                            continue
-                    
-                    # Filtro por método de pago
-                    if pago_filtro != "Todos" and venta.get('metodo_pago', '') != pago_filtro:
-                        continue
-                    
-                    # Filtro por cajero
-                    if cajero_filtro != "Todos" and venta.get('cajero', '') != cajero_filtro:
-                        continue
-                    
-                    # Filtro por estado
-                    if estado_filtro != "Todos" and venta.get('estado', '') != estado_filtro:
-                        continue
-                    
-                    ventas_filtradas.append(venta)
-                    
-                except Exception as e:
-                    print(f"Error procesando venta {venta.get('id', 'ID desconocido')}: {e}")
-                    continue
+            # Aplicar filtros con una consulta parametrizada e indexada en la BD
+            total_ventas_bd = db.count_orders()
+            ventas_filtradas = db.query_orders(
+                fecha_desde=fecha_inicio_dt.date(),
+                fecha_hasta=fecha_fin_dt.date(),
+                producto=producto_filtro if producto_filtro != "Todos" else None,
+                metodo_pago=pago_filtro if pago_filtro != "Todos" else None,
+                cajero=cajero_filtro if cajero_filtro != "Todos" else None,
+                estado=estado_filtro if estado_filtro != "Todos" else None,
+            )
             
             # Actualizar datos filtrados
             self.ventas_filtradas = ventas_filtradas
@@ -4385,7 +4452,7 @@ Ctrl+R: Selector de Roles"""
             self.filtro_estado.set("Todos")
             
             # Resetear datos filtrados
-            self.ventas_filtradas = self.ventas.copy()
+            self.ventas_filtradas = []
             
             messagebox.showinfo("Filtros Limpiados", "Todos los filtros han sido restablecidos a sus valores por defecto")
             
@@ -4400,10 +4467,25 @@ Ctrl+R: Selector de Roles"""
             return
         
         try:
-            # Determinar qué datos exportar
-            datos_a_exportar = self.ventas_filtradas if hasattr(self, 'ventas_filtradas') and self.ventas_filtradas else self.ventas
-            
-            if not datos_a_exportar:
+            # Determinar qué datos exportar: el resultado filtrado o todas las ventas de la BD,
+            # recorridas en streaming para calcular totales y guardar solo las filas de la tabla
+            if hasattr(self, 'ventas_filtradas') and self.ventas_filtradas:
+                datos_a_exportar = iter(self.ventas_filtradas)
+            else:
+                datos_a_exportar = db.iter_orders()
+            
+            total_ventas = 0
+            ingresos_totales = 0
+            descuentos_totales = 0
+            ventas_tabla = []
+            for v in datos_a_exportar:
+                total_ventas += 1
+                ingresos_totales += v.get('total_final', 0)
+                descuentos_totales += v.get('descuento_aplicado', 0)
+                if len(ventas_tabla) < 100:  # Máximo 100 ventas en el PDF
+                    ventas_tabla.append(v)
+            
+            if not total_ventas:
                 messagebox.showwarning("Sin datos", "No hay datos para exportar")
                 return
             
@@ -4430,9 +4512,6 @@ Ctrl+R: Selector de Roles"""
             story.append(Spacer(1, 20))
             
             # Resumen ejecutivo
-            total_ventas = len(datos_a_exportar)
-            ingresos_totales = sum(v.get('total_final', 0) for v in datos_a_exportar)
-            descuentos_totales = sum(v.get('descuento_aplicado', 0) for v in datos_a_exportar)
             promedio_venta = ingresos_totales / total_ventas if total_ventas > 0 else 0
             
             resumen_texto = f"""
@@ -4450,7 +4529,7 @@ Ctrl+R: Selector de Roles"""
             # Tabla de datos
             tabla_datos = [['ID Venta', 'Fecha', 'Total', 'Método Pago', 'Cajero', 'Estado']]
             
-            for venta in datos_a_exportar[:100]:  # Máximo 100 ventas en el PDF
+            for venta in ventas_tabla:
                 fecha_formateada = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S').strftime('%d/%m/%Y')
                 tabla_datos.append([
                     venta.get('id', ''),
@@ -4478,7 +4557,7 @@ Ctrl+R: Selector de Roles"""
             # Generar PDF
             doc.build(story)
             
-            messagebox.showinfo("Éxito", f"Reporte PDF generado exitosamente:\n{filename}\n\nVentas incluidas: {len(datos_a_exportar)}")
+            messagebox.showinfo("Éxito", f"Reporte PDF generado exitosamente:\n{filename}\n\nVentas incluidas: {total_ventas}")
             
         except Exception as e:
             messagebox.showerror("Error", f"Error al generar PDF: {str(e)}")
@@ -4548,68 +4627,47 @@ Ctrl+R: Selector de Roles"""
                                    font=("Arial", 12, "bold"), bg=self.color_fondo_ventana)
         tabla_frame.pack(expand=True, fill="both", padx=20, pady=(0, 15))
         
-        # Crear tabla con scrollbars
-        tabla_container = tk.Frame(tabla_frame, bg=self.color_fondo_ventana)
-        tabla_container.pack(expand=True, fill="both", padx=10, pady=10)
-        
-        # Scrollbars
-        v_scroll = ttk.Scrollbar(tabla_container, orient="vertical")
-        h_scroll = ttk.Scrollbar(tabla_container, orient="horizontal")
-        
-        # Treeview
-        tree = ttk.Treeview(tabla_container, 
-                           columns=("ID", "Fecha", "Productos", "Total", "Pago", "Cajero", "Estado"),
-                           show="headings", 
-                           yscrollcommand=v_scroll.set,
-                           xscrollcommand=h_scroll.set)
-        
-        # Configurar scrollbars
-        v_scroll.config(command=tree.yview)
-        h_scroll.config(command=tree.xview)
-        
-        # Layout de tabla y scrollbars
-        tree.grid(row=0, column=0, sticky="nsew")
-        v_scroll.grid(row=0, column=1, sticky="ns")
-        h_scroll.grid(row=1, column=0, sticky="ew")
-        
-        tabla_container.grid_rowconfigure(0, weight=1)
-        tabla_container.grid_columnconfigure(0, weight=1)
+        def _valores_venta(venta):
+            fecha_formateada = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S').strftime('%d/%m/%Y %H:%M')
+            productos_texto = ", ".join([f"{p.get('nombre', '')} x{p.get('cantidad', 0)}" for p in venta.get('productos', [])])
+            if len(productos_texto) > 35:
+                productos_texto = productos_texto[:32] + "..."
+            return (
+                venta.get('id', ''),
+                fecha_formateada,
+                productos_texto,
+                f"${venta.get('total_final', 0):.2f}",
+                venta.get('metodo_pago', ''),
+                venta.get('cajero', ''),
+                venta.get('estado', '')
+            )
         
         # Configurar columnas
         columnas_info = [
-            ("ID", 80),
-            ("Fecha", 120),
-            ("Productos", 250),
-            ("Total", 100),
-            ("Pago", 100),
-            ("Cajero", 100),
-            ("Estado", 100)
+            ("ID", 80, "center"),
+            ("Fecha", 120, "w"),
+            ("Productos", 250, "w"),
+            ("Total", 100, "center"),
+            ("Pago", 100, "w"),
+            ("Cajero", 100, "w"),
+            ("Estado", 100, "w")
         ]
         
-        for col, ancho in columnas_info:
-            tree.heading(col, text=col)
-            tree.column(col, width=ancho, anchor="center" if col in ["ID", "Total"] else "w")
-        
-        # Llenar tabla con datos filtrados
-        for venta in sorted(ventas_filtradas, key=lambda x: x.get('fecha', ''), reverse=True):
-            try:
-                fecha_formateada = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S').strftime('%d/%m/%Y %H:%M')
-                productos_texto = ", ".join([f"{p.get('nombre', '')} x{p.get('cantidad', 0)}" for p in venta.get('productos', [])])
-                if len(productos_texto) > 35:
-                    productos_texto = productos_texto[:32] + "..."
-                
-                tree.insert("", "end", values=(
-                    venta.get('id', ''),
-                    fecha_formateada,
-                    productos_texto,
-                    f"${venta.get('total_final', 0):.2f}",
-                    venta.get('metodo_pago', ''),
-                    venta.get('cajero', ''),
-                    venta.get('estado', '')
-                ))
-            except Exception as e:
-                print(f"Error al mostrar venta: {e}")
-                continue
+        # Tabla virtual con los datos filtrados (más recientes primero, ordenable por columna)
+        fuente = tabla_virtual.ListSource(
+            sorted(ventas_filtradas, key=lambda x: x.get('fecha', ''), reverse=True),
+            key=lambda v: v.get('id', ''),
+            sort_keys={
+                "ID": lambda v: str(v.get('id', '')),
+                "Fecha": lambda v: v.get('fecha', '') or '',
+                "Total": lambda v: float(v.get('total_final', 0) or 0),
+                "Pago": lambda v: v.get('metodo_pago', '') or '',
+                "Cajero": lambda v: v.get('cajero', '') or '',
+                "Estado": lambda v: v.get('estado', '') or '',
+            })
+        tabla = tabla_virtual.VirtualTable(tabla_frame, columnas_info, fuente, _valores_venta,
+                                           horizontal=True, bg=self.color_fondo_ventana)
+        tabla.pack(expand=True, fill="both", padx=10, pady=10)
         
         # Botones de acción
         botones_frame = tk.Frame(ventana_resultados, bg=self.color_fondo_ventana)
@@ -4703,133 +4761,17 @@ RESULTADOS:
         except Exception as e:
             messagebox.showerror("Error", f"Error al generar resumen: {str(e)}")
 
-    def actualizar_tabla_ventas(self, tree):
-        """Actualiza la tabla de ventas con datos frescos de la BD"""
-        try:
-            # Limpiar tabla
-            for item in tree.get_children():
-                tree.delete(item)
-            
-            # Recargar desde BD
-            ventas_bd = db.load_orders()
-            if ventas_bd:
-                self.ventas = ventas_bd
-            
-            # Llenar tabla con datos actualizados
-            for venta in sorted(self.ventas, key=lambda x: x['fecha'], reverse=True)[:50]:
-                try:
-                    fecha_formateada = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S').strftime('%d/%m/%Y %H:%M')
-                    productos_texto = ", ".join([f"{p['nombre']} x{p['cantidad']}" for p in venta['productos']])
-                    if len(productos_texto) > 30:
-                        productos_texto = productos_texto[:27] + "..."
-                    
-                    oferta_texto = venta['oferta_aplicada'] if venta['oferta_aplicada'] else "Sin oferta"
-                    descuento_texto = f"${venta['descuento_aplicado']:.2f}"
-                    total_texto = f"${venta['total_final']:.2f}"
-                    
-                    tree.insert("", "end", iid=venta['id'], values=(
-                        venta['id'], fecha_formateada, productos_texto, 
-                        oferta_texto, descuento_texto, total_texto
-                    ))
-                except Exception as e:
-                    print(f"Error al procesar venta: {e}")
-                    continue
-            
-            messagebox.showinfo("Actualización", "Tabla de ventas actualizada desde la base de datos")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al actualizar tabla: {str(e)}")
-    
-    def ver_detalle_venta_seleccionada(self, tree):
-        """Muestra el detalle completo de la venta seleccionada"""
-        sel = tree.selection()
-        if not sel:
-            messagebox.showwarning("Seleccionar", "Selecciona una venta para ver detalles")
-            return
-        
-        venta_id = sel[0]
-        venta = next((v for v in self.ventas if v['id'] == venta_id), None)
-        
-        if not venta:
-            messagebox.showerror("Error", "No se encontró la venta seleccionada")
-            return
-        
-        # Crear ventana de detalles
-        detalle_window = tk.Toplevel(self)
-        detalle_window.title(f"Detalle de Venta - {venta_id}")
-        detalle_window.geometry("600x500")
-        detalle_window.configure(bg=self.color_fondo_ventana)
-        
-        # Título
-        tk.Label(detalle_window, text=f"📋 Detalle de Venta: {venta_id}", 
-                font=("Helvetica", 16, "bold"), bg=self.color_fondo_ventana, fg=self.color_titulo).pack(pady=20)
-        
-        # Frame para información general
-        info_frame = tk.LabelFrame(detalle_window, text="Información General", 
-                                  font=("Helvetica", 12, "bold"), bg=self.color_fondo_ventana)
-        info_frame.pack(fill="x", padx=20, pady=(0, 15))
-        
-        # Datos generales
-        tk.Label(info_frame, text=f"Fecha: {venta['fecha']}", 
-                font=("Helvetica", 11), bg=self.color_fondo_ventana).pack(anchor="w", padx=10, pady=2)
-        tk.Label(info_frame, text=f"Cajero: {venta['cajero']}", 
-                font=("Helvetica", 11), bg=self.color_fondo_ventana).pack(anchor="w", padx=10, pady=2)
-        tk.Label(info_frame, text=f"Método de pago: {venta['metodo_pago']}", 
-                font=("Helvetica", 11), bg=self.color_fondo_ventana).pack(anchor="w", padx=10, pady=2)
-        
-        # Frame para productos
-        productos_frame = tk.LabelFrame(detalle_window, text="Productos", 
-                                       font=("Helvetica", 12, "bold"), bg=self.color_fondo_ventana)
-        productos_frame.pack(fill="both", expand=True, padx=20, pady=(0, 15))
-        
-        # Tabla de productos
-        prod_tree = ttk.Treeview(productos_frame, columns=("Producto", "Cantidad", "Precio", "Subtotal"), 
-                                show="headings", height=8)
-        
-        for col in ["Producto", "Cantidad", "Precio", "Subtotal"]:
-            prod_tree.heading(col, text=col)
-            prod_tree.column(col, width=120, anchor="center" if col != "Producto" else "w")
-        
-        for producto in venta['productos']:
-            prod_tree.insert("", "end", values=(
-                producto['nombre'],
-                producto['cantidad'],
-                f"${producto['precio']:.2f}",
-                f"${producto['subtotal']:.2f}"
-            ))
-        
-        prod_tree.pack(fill="both", expand=True, padx=10, pady=10)
-        
-        # Frame para totales
-        totales_frame = tk.LabelFrame(detalle_window, text="Resumen Financiero", 
-                                     font=("Helvetica", 12, "bold"), bg=self.color_fondo_ventana)
-        totales_frame.pack(fill="x", padx=20, pady=(0, 20))
-        
-        tk.Label(totales_frame, text=f"Subtotal: ${venta['total_sin_descuento']:.2f}", 
-                font=("Helvetica", 11), bg=self.color_fondo_ventana).pack(anchor="w", padx=10, pady=2)
-        tk.Label(totales_frame, text=f"Descuento aplicado: ${venta['descuento_aplicado']:.2f}", 
-                font=("Helvetica", 11), bg=self.color_fondo_ventana, fg="#FF9800").pack(anchor="w", padx=10, pady=2)
-        tk.Label(totales_frame, text=f"TOTAL FINAL: ${venta['total_final']:.2f}", 
-                font=("Helvetica", 12, "bold"), bg=self.color_fondo_ventana, fg="#4CAF50").pack(anchor="w", padx=10, pady=5)
-        
-        if venta['oferta_aplicada']:
-            tk.Label(totales_frame, text=f"Oferta aplicada: {venta['oferta_aplicada']}", 
-                    font=("Helvetica", 11, "italic"), bg=self.color_fondo_ventana, fg="#2196F3").pack(anchor="w", padx=10, pady=2)
-        
-        # Botón cerrar
-        tk.Button(detalle_window, text="❌ Cerrar", command=detalle_window.destroy,
-                 bg="#9E9E9E", fg="white", font=("Helvetica", 11, "bold"),
-                 relief="raised", bd=2, padx=20, pady=8).pack(pady=15)
-    
     def eliminar_venta_seleccionada(self, tree):
         """Elimina la venta seleccionada de la base de datos"""
-        sel = tree.selection()
+        # La selección de la tabla virtual se guarda por clave aunque la fila no esté en pantalla
+        tabla = getattr(self, '_tablas_ventas', {}).get(str(tree))
+        sel = tabla.selection() if tabla else tree.selection()
         if not sel:
             messagebox.showwarning("Seleccionar", "Selecciona una venta para eliminar")
             return
         
         venta_id = sel[0]
-        venta = next((v for v in self.ventas if v['id'] == venta_id), None)
+        venta = db.get_order(venta_id)
         
         if not venta:
             messagebox.showerror("Error", "No se encontró la venta seleccionada")
@@ -4845,14 +4787,14 @@ RESULTADOS:
         
         if confirmacion:
             try:
-                # Eliminar de la lista en memoria
-                self.ventas = [v for v in self.ventas if v['id'] != venta_id]
-                
-                # Eliminar de la tabla visual
-                tree.delete(venta_id)
+                if not db.delete_order(venta_id):
+                    messagebox.showerror("Error", "No se encontró la venta seleccionada")
+                    return
                 
-                # Nota: Aquí deberías agregar la función para eliminar de BD si existe
-                # db.delete_order(venta_id)
+                # La tabla se vuelve a leer desde la BD (sin la venta borrada)
+                if tabla:
+                    tabla.selection_set(c for c in tabla.selection() if c != venta_id)
+                    tabla.refresh()
                 
                 messagebox.showinfo("Éxito", f"Venta {venta_id} eliminada correctamente")
                 
@@ -4861,24 +4803,11 @@ RESULTADOS:
     
     def _crear_tab_productos(self, parent):
         """Crea la pestaña de análisis por producto"""
-        # Analizar ventas por producto
-        productos_stats = {}
-        for venta in self.ventas:
-            for producto in venta['productos']:
-                nombre = producto['nombre']
-                if nombre not in productos_stats:
-                    productos_stats[nombre] = {
-                        'cantidad_vendida': 0,
-                        'ingresos': 0,
-                        'ventas': 0
-                    }
-                productos_stats[nombre]['cantidad_vendida'] += producto['cantidad']
-                productos_stats[nombre]['ingresos'] += producto['subtotal']
-                productos_stats[nombre]['ventas'] += 1
-        
-        # Ordenar por ingresos
-        productos_ordenados = sorted(productos_stats.items(), 
-                                   key=lambda x: x[1]['ingresos'], reverse=True)
+        # Analizar ventas por producto (agregado en SQL, ya ordenado por ingresos)
+        try:
+            productos_ordenados = [(stats['nombre'], stats) for stats in reportes.sales_by_product()]
+        except Exception:
+            productos_ordenados = []
         
         # Frame principal
         main_frame = tk.Frame(parent, bg=self.color_fondo_ventana)
@@ -4931,15 +4860,11 @@ RESULTADOS:
         tk.Label(main_frame, text="📅 Análisis Temporal de Ventas", 
                 font=("Helvetica", 16, "bold"), bg=self.color_fondo_ventana, fg=self.color_titulo).pack(pady=(0,15))
         
-        # Análisis por día
-        ventas_por_dia = {}
-        for venta in self.ventas:
-            fecha = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S')
-            dia = fecha.strftime('%Y-%m-%d')
-            if dia not in ventas_por_dia:
-                ventas_por_dia[dia] = {'ventas': 0, 'ingresos': 0}
-            ventas_por_dia[dia]['ventas'] += 1
-            ventas_por_dia[dia]['ingresos'] += venta['total_final']
+        # Análisis por día (GROUP BY en SQL, del más reciente al más antiguo)
+        try:
+            ventas_por_dia = reportes.sales_by_day()
+        except Exception:
+            ventas_por_dia = []
         
         # Tabla temporal
         tree_temporal = ttk.Treeview(main_frame, 
@@ -4951,9 +4876,11 @@ RESULTADOS:
             tree_temporal.column(col, width=120, anchor="center")
         
         # Llenar datos temporales
-        for dia in sorted(ventas_por_dia.keys(), reverse=True):
-            stats = ventas_por_dia[dia]
-            fecha_formateada = datetime.datetime.strptime(dia, '%Y-%m-%d').strftime('%d/%m/%Y')
+        for stats in ventas_por_dia:
+            try:
+                fecha_formateada = datetime.datetime.strptime(stats['dia'], '%Y-%m-%d').strftime('%d/%m/%Y')
+            except ValueError:
+                fecha_formateada = stats['dia']
             promedio = stats['ingresos'] / stats['ventas'] if stats['ventas'] > 0 else 0
             
             tree_temporal.insert("", "end", values=(
@@ -4973,31 +4900,22 @@ RESULTADOS:
         tk.Label(main_frame, text="🎁 Análisis de Ofertas y Descuentos", 
                 font=("Helvetica", 16, "bold"), bg=self.color_fondo_ventana, fg=self.color_titulo).pack(pady=(0,15))
         
-        # Análisis de ofertas
-        ofertas_stats = {}
-        ventas_sin_oferta = 0
-        
-        for venta in self.ventas:
-            if venta['oferta_aplicada']:
-                oferta_id = venta['oferta_aplicada']
-                if oferta_id not in ofertas_stats:
-                    ofertas_stats[oferta_id] = {
-                        'usos': 0,
-                        'descuento_total': 0,
-                        'ahorro_cliente': 0
-                    }
-                ofertas_stats[oferta_id]['usos'] += 1
-                ofertas_stats[oferta_id]['descuento_total'] += venta['descuento_aplicado']
-                ofertas_stats[oferta_id]['ahorro_cliente'] += venta['descuento_aplicado']
-            else:
-                ventas_sin_oferta += 1
+        # Análisis de ofertas (agregados en SQL)
+        try:
+            resumen = reportes.sales_summary()
+            uso_ofertas = reportes.offer_usage()
+        except Exception:
+            resumen = {}
+            uso_ofertas = []
+        total_ventas = resumen.get('total_ventas', 0)
+        ventas_sin_oferta = total_ventas - resumen.get('ventas_con_oferta', 0)
         
         # Frame para estadísticas de ofertas
         stats_frame = tk.Frame(main_frame, bg=self.color_fondo_ventana)
         stats_frame.pack(fill="x", pady=(0,20))
         
-        total_descuentos = sum(venta['descuento_aplicado'] for venta in self.ventas)
-        porcentaje_con_oferta = (len(self.ventas) - ventas_sin_oferta) / len(self.ventas) * 100 if self.ventas else 0
+        total_descuentos = resumen.get('descuentos_totales', 0)
+        porcentaje_con_oferta = (total_ventas - ventas_sin_oferta) / total_ventas * 100 if total_ventas else 0
         
         tk.Label(stats_frame, text=f"💰 Total en descuentos otorgados: ${total_descuentos:.2f}", 
                 font=("Helvetica", 12, "bold"), bg=self.color_fondo_ventana, fg="#E91E63").pack(anchor="w")
@@ -5024,13 +4942,9 @@ RESULTADOS:
             tree_ofertas.column(col, width=ancho, anchor="center" if col != "Nombre" else "w")
         
         # Llenar datos de ofertas
-        for oferta_id, stats in ofertas_stats.items():
-            # Buscar el nombre de la oferta
-            nombre_oferta = "Oferta no encontrada"
-            for oferta in self.ofertas:
-                if oferta['id'] == oferta_id:
-                    nombre_oferta = oferta['nombre']
-                    break
+        for stats in uso_ofertas:
+            oferta_id = stats['oferta']
+            nombre_oferta = stats['nombre'] or "Oferta no encontrada"
             
             promedio_descuento = stats['descuento_total'] / stats['usos'] if stats['usos'] > 0 else 0
             
@@ -5150,27 +5064,13 @@ RESULTADOS:
                 messagebox.showerror("Error", "Formato de fecha inválido. Use YYYY-MM-DD")
                 return
             
-            # Filtrar ventas
-            ventas_filtradas = []
-            for venta in self.ventas:
-                fecha_venta = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S')
-                fecha_venta_solo = fecha_venta.date()
-                
-                # Filtro por fecha
-                if not (fecha_inicio_dt.date() <= fecha_venta_solo <= fecha_fin_dt.date()):
-                    continue
-                
-                # Filtro por producto
-                if producto_filtro != "Todos":
-                    productos_en_venta = [p['nombre'] for p in venta['productos']]
-                    if producto_filtro not in productos_en_venta:
-                        continue
-                
-                # Filtro por método de pago
-                if pago_filtro != "Todos" and venta.get('metodo_pago') != pago_filtro:
-                    continue
-                
-                ventas_filtradas.append(venta)
+            # Filtrar ventas en la BD
+            ventas_filtradas = db.query_orders(
+                fecha_desde=fecha_inicio_dt.date(),
+                fecha_hasta=fecha_fin_dt.date(),
+                producto=producto_filtro if producto_filtro != "Todos" else None,
+                metodo_pago=pago_filtro if pago_filtro != "Todos" else None,
+            )
             
             # Mostrar resultados
             if ventas_filtradas:
@@ -5303,29 +5203,12 @@ RESULTADOS:
     def actualizar_tabla_ventas(self, tree):
         """Actualiza la tabla de ventas con los datos más recientes"""
         try:
-            # Limpiar tabla actual
-            for item in tree.get_children():
-                tree.delete(item)
-            
-            # Recargar datos de ventas
-            for venta in sorted(self.ventas, key=lambda x: x['fecha'], reverse=True):
-                fecha_formateada = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S').strftime('%d/%m/%Y %H:%M')
-                productos_texto = ", ".join([f"{p['nombre']} x{p['cantidad']}" for p in venta['productos']])
-                if len(productos_texto) > 30:
-                    productos_texto = productos_texto[:27] + "..."
-                
-                oferta_texto = venta['oferta_aplicada'] if venta['oferta_aplicada'] else "Sin oferta"
-                descuento_texto = f"${venta['descuento_aplicado']:.2f}"
-                total_texto = f"${venta['total_final']:.2f}"
-                
-                tree.insert("", "end", values=(
-                    venta['id'], fecha_formateada, productos_texto, 
-                    oferta_texto, descuento_texto, total_texto
-                ))
-            
-            # Actualizar mensaje de estado
-            if hasattr(self, 'status_label'):
-                self.status_label.config(text=f"✅ Lista actualizada - {len(self.ventas)} ventas cargadas", fg="#4CAF50")
+            # Tabla virtual: vuelve a consultar la BD conservando posición y selección
+            tabla = getattr(self, '_tablas_ventas', {}).get(str(tree))
+            if tabla:
+                tabla.refresh()
+                if hasattr(self, 'status_label'):
+                    self.status_label.config(text="✅ Lista actualizada desde la base de datos", fg="#4CAF50")
                 
         except Exception as e:
             messagebox.showerror("Error", f"Error al actualizar tabla: {str(e)}")
@@ -5338,15 +5221,9 @@ RESULTADOS:
                 messagebox.showwarning("Selección", "Por favor selecciona una venta de la lista")
                 return
             
-            item = tree.item(seleccion[0])
-            venta_id = item['values'][0]
-            
-            # Buscar la venta por ID
-            venta_detalle = None
-            for venta in self.ventas:
-                if venta['id'] == venta_id:
-                    venta_detalle = venta
-                    break
+            # El iid de la fila es el ID del pedido (la columna ID lleva el ícono de estado)
+            venta_id = seleccion[0]
+            venta_detalle = db.get_order(venta_id)
             
             if not venta_detalle:
                 messagebox.showerror("Error", "No se pudo encontrar la venta seleccionada")
@@ -5463,10 +5340,35 @@ RESULTADOS:
             elementos.append(info_general)
             elementos.append(Spacer(1, 20))
             
-            # Métricas principales
-            total_ventas = len(self.ventas)
-            ingresos_totales = sum(venta['total_final'] for venta in self.ventas)
-            descuentos_totales = sum(venta['descuento_aplicado'] for venta in self.ventas)
+            # Métricas principales y filas del detalle en una sola pasada por la BD (más recientes primero)
+            total_ventas = 0
+            ingresos_totales = 0
+            descuentos_totales = 0
+            ventas_con_oferta = 0
+            datos_tabla = [['ID Venta', 'Fecha/Hora', 'Productos', 'Oferta', 'Descuento', 'Total', 'Método Pago']]
+            
+            for venta in db.iter_orders():
+                total_ventas += 1
+                ingresos_totales += venta['total_final']
+                descuentos_totales += venta['descuento_aplicado']
+                if venta['oferta_aplicada']:
+                    ventas_con_oferta += 1
+                
+                fecha_formateada = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S').strftime('%d/%m %H:%M')
+                productos_texto = ", ".join([f"{p['nombre']} x{p['cantidad']}" for p in venta['productos']])
+                if len(productos_texto) > 40:
+                    productos_texto = productos_texto[:37] + "..."
+                
+                datos_tabla.append([
+                    venta['id'],
+                    fecha_formateada,
+                    productos_texto,
+                    venta['oferta_aplicada'] or "Sin oferta",
+                    f"${venta['descuento_aplicado']:.2f}",
+                    f"${venta['total_final']:.2f}",
+                    venta.get('metodo_pago', 'N/A')
+                ])
+            
             promedio_venta = ingresos_totales / total_ventas if total_ventas > 0 else 0
             
             metricas_texto = f"""
@@ -5475,7 +5377,7 @@ RESULTADOS:
             • Ingresos totales: ${ingresos_totales:,.2f}<br/>
             • Total en descuentos otorgados: ${descuentos_totales:,.2f}<br/>
             • Promedio por venta: ${promedio_venta:,.2f}<br/>
-            • Tasa de conversión con ofertas: {((total_ventas - sum(1 for v in self.ventas if not v['oferta_aplicada'])) / total_ventas * 100) if total_ventas > 0 else 0:.1f}%
+            • Tasa de conversión con ofertas: {(ventas_con_oferta / total_ventas * 100) if total_ventas > 0 else 0:.1f}%
             """
             
             metricas = Paragraph(metricas_texto, estilos['Normal'])
@@ -5486,25 +5388,6 @@ RESULTADOS:
             elementos.append(Paragraph("<b>📋 DETALLE DE VENTAS</b>", estilos['Heading2']))
             elementos.append(Spacer(1, 12))
             
-            # Datos de la tabla
-            datos_tabla = [['ID Venta', 'Fecha/Hora', 'Productos', 'Oferta', 'Descuento', 'Total', 'Método Pago']]
-            
-            for venta in sorted(self.ventas, key=lambda x: x['fecha'], reverse=True):
-                fecha_formateada = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S').strftime('%d/%m %H:%M')
-                productos_texto = ", ".join([f"{p['nombre']} x{p['cantidad']}" for p in venta['productos']])
-                if len(productos_texto) > 40:
-                    productos_texto = productos_texto[:37] + "..."
-                
-                datos_tabla.append([
-                    venta['id'],
-                    fecha_formateada,
-                    productos_texto,
-                    venta['oferta_aplicada'] or "Sin oferta",
-                    f"${venta['descuento_aplicado']:.2f}",
-                    f"${venta['total_final']:.2f}",
-                    venta.get('metodo_pago', 'N/A')
-                ])
-            
             # Crear y estilizar tabla
             tabla = Table(datos_tabla, repeatRows=1)
             tabla.setStyle(TableStyle([
@@ -5524,15 +5407,9 @@ RESULTADOS:
             elementos.append(tabla)
             elementos.append(Spacer(1, 30))
             
-            # Análisis por productos
-            productos_stats = {}
-            for venta in self.ventas:
-                for producto in venta['productos']:
-                    nombre = producto['nombre']
-                    if nombre not in productos_stats:
-                        productos_stats[nombre] = {'cantidad': 0, 'ingresos': 0}
-                    productos_stats[nombre]['cantidad'] += producto['cantidad']
-                    productos_stats[nombre]['ingresos'] += producto['subtotal']
+            # Análisis por productos (agregado en SQL)
+            productos_stats = {p['nombre']: {'cantidad': p['cantidad_vendida'], 'ingresos': p['ingresos']}
+                               for p in reportes.sales_by_product()}
             
             elementos.append(Paragraph("<b>🍣 ANÁLISIS POR PRODUCTO</b>", estilos['Heading2']))
             elementos.append(Spacer(1, 12))
@@ -5682,249 +5559,36 @@ RESULTADOS:
         except Exception as e:
             messagebox.showerror("Error", f"Error al generar PDF filtrado: {str(e)}")
     
-    def backup_datos_reportes(self):
-        """Crea backup de los datos de ventas y configuración"""
-        try:
-            fecha_backup = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-            archivo_backup = filedialog.asksaveasfilename(
-                defaultextension=".json",
-                filetypes=[("JSON files", "*.json")],
-                title="Guardar Backup de Datos",
-                initialfile=f"backup_sushi_datos_{fecha_backup}.json"
-            )
-            
-            if not archivo_backup:
-                return
-            
-            # Datos a respaldar
-            datos_backup = {
-                "fecha_backup": datetime.datetime.now().isoformat(),
-                "version_sistema": "1.0",
-                "ventas": self.ventas,
-                "ofertas": self.ofertas,
-                "configuracion": {
-                    "tema_actual": self.tema_actual.get(),
-                    "rol_usuario": self.rol_usuario.get()
-                }
-            }
-            
-            # Guardar en archivo JSON
-            with open(archivo_backup, 'w', encoding='utf-8') as f:
-                json.dump(datos_backup, f, indent=2, ensure_ascii=False)
-            
-            messagebox.showinfo("Backup Exitoso", 
-                              f"Backup guardado exitosamente:\n{archivo_backup}\n\n"
-                              f"Datos incluidos:\n"
-                              f"• {len(self.ventas)} ventas\n"
-                              f"• {len(self.ofertas)} ofertas\n"
-                              f"• Configuración del sistema")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al crear backup: {str(e)}")
-    
-    def restaurar_datos_reportes(self):
-        """Restaura datos desde un archivo de backup"""
+    def _restaurar_lotes_en_bd(self, productos, ofertas, ventas):
+        """Escribe productos, ofertas y ventas con las APIs masivas en una sola transacción,
+        mostrando una barra de progreso. Si algo falla no queda ningún cambio a medias."""
+        total = len(productos) + len(ofertas) + len(ventas)
+        ventana = tk.Toplevel(self)
+        ventana.title("Restaurando...")
+        ventana.geometry("380x130")
+        ventana.configure(bg=self.color_fondo_ventana)
+        ventana.transient(self)
+        estado_label = tk.Label(ventana, text="Restaurando datos...", font=("Helvetica", 11, "bold"),
+                                bg=self.color_fondo_ventana, fg=self.color_texto)
+        estado_label.pack(pady=(15, 5))
+        progress = ttk.Progressbar(ventana, mode='determinate', maximum=max(total, 1))
+        progress.pack(pady=10, padx=30, fill="x")
+
+        def avance(base, etiqueta):
+            def _callback(hechos, total_lote):
+                progress['value'] = base + hechos
+                estado_label.config(text=f"{etiqueta}: {hechos}/{total_lote}")
+                ventana.update_idletasks()
+            return _callback
+
         try:
-            archivo_backup = filedialog.askopenfilename(
-                filetypes=[("JSON files", "*.json")],
-                title="Seleccionar Archivo de Backup"
-            )
-            
-            if not archivo_backup:
-                return
-            
-            # Confirmar restauración
-            if not messagebox.askyesno("Confirmar Restauración", 
-                                     "¿Está seguro de que desea restaurar los datos?\n"
-                                     "Esto reemplazará todos los datos actuales."):
-                return
-            
-            # Leer archivo de backup
-            with open(archivo_backup, 'r', encoding='utf-8') as f:
-                datos_backup = json.load(f)
-            
-            # Validar estructura del backup
-            if not all(key in datos_backup for key in ['ventas', 'ofertas', 'configuracion']):
-                messagebox.showerror("Error", "El archivo de backup no tiene el formato correcto")
-                return
-            
-            # Restaurar datos
-            self.ventas = datos_backup['ventas']
-            self.ofertas = datos_backup['ofertas']
-            
-            if 'configuracion' in datos_backup:
-                config = datos_backup['configuracion']
-                if 'tema_actual' in config:
-                    self.tema_actual.set(config['tema_actual'])
-                    self.aplicar_tema(config['tema_actual'])
-            
-            messagebox.showinfo("Restauración Exitosa", 
-                              f"Datos restaurados exitosamente:\n"
-                              f"• {len(self.ventas)} ventas\n"
-                              f"• {len(self.ofertas)} ofertas\n"
-                              f"• Configuración del sistema")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Error al restaurar backup: {str(e)}")
-    
-    def generar_analisis_comparativo(self):
-        """Genera análisis comparativo entre períodos"""
-        ventana_comparativo = tk.Toplevel(self)
-        ventana_comparativo.title("Análisis Comparativo")
-        ventana_comparativo.geometry("800x600")
-        ventana_comparativo.configure(bg=self.color_fondo_ventana)
-        
-        # Título
-        titulo_frame = tk.Frame(ventana_comparativo, bg="#9C27B0", relief="raised", bd=2)
-        titulo_frame.pack(fill="x", pady=(0, 20))
-        tk.Label(titulo_frame, text="📊 ANÁLISIS COMPARATIVO DE PERÍODOS", 
-                font=("Impact", 16, "bold"), bg="#9C27B0", fg="white", 
-                pady=10).pack()
-        
-        # Frame para selección de períodos
-        periodos_frame = tk.Frame(ventana_comparativo, bg=self.color_fondo_ventana)
-        periodos_frame.pack(fill="x", padx=20, pady=20)
-        
-        tk.Label(periodos_frame, text="Seleccione los períodos a comparar:", 
-                font=("Helvetica", 12, "bold"), bg=self.color_fondo_ventana, fg=self.color_titulo).pack(anchor="w")
-        
-        # Período 1
-        periodo1_frame = tk.Frame(periodos_frame, bg=self.color_fondo_ventana)
-        periodo1_frame.pack(fill="x", pady=5)
-        tk.Label(periodo1_frame, text="Período 1 - Desde:", bg=self.color_fondo_ventana).pack(side="left")
-        fecha1_inicio = tk.Entry(periodo1_frame, width=12)
-        fecha1_inicio.pack(side="left", padx=5)
-        fecha1_inicio.insert(0, "2025-09-25")
-        tk.Label(periodo1_frame, text="Hasta:", bg=self.color_fondo_ventana).pack(side="left", padx=(20,5))
-        fecha1_fin = tk.Entry(periodo1_frame, width=12)
-        fecha1_fin.pack(side="left", padx=5)
-        fecha1_fin.insert(0, "2025-09-25")
-        
-        # Período 2
-        periodo2_frame = tk.Frame(periodos_frame, bg=self.color_fondo_ventana)
-        periodo2_frame.pack(fill="x", pady=5)
-        tk.Label(periodo2_frame, text="Período 2 - Desde:", bg=self.color_fondo_ventana).pack(side="left")
-        fecha2_inicio = tk.Entry(periodo2_frame, width=12)
-        fecha2_inicio.pack(side="left", padx=5)
-        fecha2_inicio.insert(0, "2025-09-26")
-        tk.Label(periodo2_frame, text="Hasta:", bg=self.color_fondo_ventana).pack(side="left", padx=(20,5))
-        fecha2_fin = tk.Entry(periodo2_frame, width=12)
-        fecha2_fin.pack(side="left", padx=5)
-        fecha2_fin.insert(0, "2025-09-26")
-        
-        def realizar_comparacion():
-            try:
-                # Filtrar ventas por períodos
-                periodo1_ventas = self._filtrar_ventas_por_fecha(fecha1_inicio.get(), fecha1_fin.get())
-                periodo2_ventas = self._filtrar_ventas_por_fecha(fecha2_inicio.get(), fecha2_fin.get())
-                
-                # Mostrar resultados comparativos
-                self._mostrar_resultados_comparativos(ventana_comparativo, periodo1_ventas, periodo2_ventas, 
-                                                    fecha1_inicio.get(), fecha1_fin.get(), 
-                                                    fecha2_inicio.get(), fecha2_fin.get())
-            except Exception as e:
-                messagebox.showerror("Error", f"Error en comparación: {str(e)}")
-        
-        # Botón comparar
-        tamaños = self.calcular_tamaños_responsivos()
-        tk.Button(periodos_frame, text="🔍 Comparar Períodos", command=realizar_comparacion,
-                 bg="#9C27B0", fg="white", font=("Helvetica", tamaños['boton_gestion_font'], "bold"),
-                 relief="raised", bd=2, padx=tamaños['boton_gestion_padx'], 
-                 pady=tamaños['boton_gestion_pady']).pack(pady=20)
-    
-    def _filtrar_ventas_por_fecha(self, fecha_inicio, fecha_fin):
-        """Filtra ventas por rango de fechas"""
-        fecha_inicio_dt = datetime.datetime.strptime(fecha_inicio, "%Y-%m-%d")
-        fecha_fin_dt = datetime.datetime.strptime(fecha_fin, "%Y-%m-%d")
-        
-        ventas_filtradas = []
-        for venta in self.ventas:
-            fecha_venta = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S')
-            if fecha_inicio_dt.date() <= fecha_venta.date() <= fecha_fin_dt.date():
-                ventas_filtradas.append(venta)
-        
-        return ventas_filtradas
-    
-    def _mostrar_resultados_comparativos(self, parent, ventas1, ventas2, fecha1_ini, fecha1_fin, fecha2_ini, fecha2_fin):
-        """Muestra los resultados del análisis comparativo"""
-        # Limpiar contenido anterior
-        for widget in parent.winfo_children():
-            if isinstance(widget, tk.Frame) and widget != parent.winfo_children()[0]:  # Mantener título
-                widget.destroy()
-        
-        # Frame para resultados
-        resultados_frame = tk.Frame(parent, bg=self.color_fondo_ventana)
-        resultados_frame.pack(expand=True, fill="both", padx=20, pady=20)
-        
-        # Calcular métricas de ambos períodos
-        metricas1 = self._calcular_metricas_periodo(ventas1)
-        metricas2 = self._calcular_metricas_periodo(ventas2)
-        
-        # Mostrar comparación
-        tk.Label(resultados_frame, text="📈 RESULTADOS COMPARATIVOS", 
-                font=("Helvetica", 14, "bold"), bg=self.color_fondo_ventana, fg=self.color_titulo).pack(pady=(0,20))
-        
-        # Tabla comparativa
-        tree = ttk.Treeview(resultados_frame, columns=("Métrica", "Período1", "Período2", "Diferencia"), 
-                           show="headings", height=10)
-        
-        for col in ["Métrica", "Período1", "Período2", "Diferencia"]:
-            tree.heading(col, text=col)
-            tree.column(col, width=150, anchor="center")
-        
-        # Datos comparativos
-        comparaciones = [
-            ("Número de Ventas", metricas1['ventas'], metricas2['ventas']),
-            ("Ingresos Totales", f"${metricas1['ingresos']:.2f}", f"${metricas2['ingresos']:.2f}"),
-            ("Promedio por Venta", f"${metricas1['promedio']:.2f}", f"${metricas2['promedio']:.2f}"),
-            ("Total Descuentos", f"${metricas1['descuentos']:.2f}", f"${metricas2['descuentos']:.2f}"),
-            ("Ventas con Oferta", f"{metricas1['con_oferta']}", f"{metricas2['con_oferta']}")
-        ]
-        
-        for metrica, valor1, valor2 in comparaciones:
-            if metrica == "Número de Ventas":
-                diferencia = metricas2['ventas'] - metricas1['ventas']
-                diferencia_texto = f"{diferencia:+d}"
-            elif "Ventas con Oferta" in metrica:
-                diferencia = metricas2['con_oferta'] - metricas1['con_oferta']
-                diferencia_texto = f"{diferencia:+d}"
-            else:
-                # Para valores monetarios - usar mapeo específico
-                if metrica == "Ingresos Totales":
-                    val1 = metricas1['ingresos']
-                    val2 = metricas2['ingresos']
-                elif metrica == "Promedio por Venta":
-                    val1 = metricas1['promedio']
-                    val2 = metricas2['promedio']
-                elif metrica == "Total Descuentos":
-                    val1 = metricas1['descuentos']
-                    val2 = metricas2['descuentos']
-                else:
-                    val1 = val2 = 0  # fallback
-                    
-                diferencia = val2 - val1
-                diferencia_texto = f"${diferencia:+.2f}"
-            
-            tree.insert("", "end", values=(metrica, valor1, valor2, diferencia_texto))
-        
-        tree.pack(expand=True, fill="both")
-    
-    def _calcular_metricas_periodo(self, ventas):
-        """Calcula métricas para un período específico"""
-        total_ventas = len(ventas)
-        ingresos = sum(v['total_final'] for v in ventas)
-        descuentos = sum(v['descuento_aplicado'] for v in ventas)
-        promedio = ingresos / total_ventas if total_ventas > 0 else 0
-        con_oferta = len([v for v in ventas if v['oferta_aplicada']])
-        
-        return {
-            'ventas': total_ventas,
-            'ingresos': ingresos,
-            'descuentos': descuentos,
-            'promedio': promedio,
-            'con_oferta': con_oferta
-        }
-    
+            with db.pragma_profile('bulk-import'), db.transaction():
+                db.save_products_bulk(productos, progress=avance(0, "Productos"))
+                db.save_offers_bulk(ofertas, progress=avance(len(productos), "Ofertas"))
+                db.save_orders_bulk(ventas, progress=avance(len(productos) + len(ofertas), "Ventas"))
+        finally:
+            ventana.destroy()
+
     def mostrar_alertas_inteligentes(self):
         """Muestra alertas basadas en patrones de venta"""
         ventana_alertas = tk.Toplevel(self)
@@ -5964,14 +5628,11 @@ RESULTADOS:
         """Genera alertas automáticas basadas en análisis de datos"""
         alertas = []
         
-        # Analizar productos por ventas
-        productos_stats = {}
-        for venta in self.ventas:
-            for producto in venta['productos']:
-                nombre = producto['nombre']
-                if nombre not in productos_stats:
-                    productos_stats[nombre] = 0
-                productos_stats[nombre] += producto['cantidad']
+        # Analizar productos por ventas (cantidades agregadas en SQL)
+        try:
+            productos_stats = {s['nombre']: s['cantidad_vendida'] for s in reportes.sales_by_product()}
+        except Exception:
+            productos_stats = {}
         
         if productos_stats:
             producto_menos_vendido = min(productos_stats, key=productos_stats.get)
@@ -5995,9 +5656,22 @@ RESULTADOS:
                     'color': '#4CAF50'
                 })
         
+        # Totales de descuentos, ingresos y pagos en efectivo en una sola pasada por la BD
+        descuentos_totales = 0
+        ingresos_totales = 0
+        pagos_efectivo = 0
+        total_ventas = 0
+        try:
+            for v in db.iter_orders():
+                total_ventas += 1
+                descuentos_totales += v['descuento_aplicado']
+                ingresos_totales += v['total_final']
+                if v.get('metodo_pago') == 'efectivo':
+                    pagos_efectivo += 1
+        except Exception:
+            pass
+        
         # Alerta por descuentos altos
-        descuentos_totales = sum(v['descuento_aplicado'] for v in self.ventas)
-        ingresos_totales = sum(v['total_final'] for v in self.ventas)
         if ingresos_totales > 0 and (descuentos_totales / ingresos_totales) > 0.15:
             alertas.append({
                 'icono': '💰',
@@ -6007,17 +5681,32 @@ RESULTADOS:
             })
         
         # Alerta por métodos de pago
-        pagos_efectivo = len([v for v in self.ventas if v.get('metodo_pago') == 'efectivo'])
-        if pagos_efectivo / len(self.ventas) > 0.7:
+        if total_ventas and pagos_efectivo / total_ventas > 0.7:
             alertas.append({
                 'icono': '💳',
                 'titulo': 'Predomina el Pago en Efectivo',
-                'descripcion': f'{(pagos_efectivo/len(self.ventas))*100:.1f}% de los pagos son en efectivo. Considere promover pagos con tarjeta.',
+                'descripcion': f'{(pagos_efectivo/total_ventas)*100:.1f}% de los pagos son en efectivo. Considere promover pagos con tarjeta.',
                 'color': '#2196F3'
             })
         
         return alertas
     
+    def _escribir_backup_json(self, f, backup_data, ventas):
+        """Escribe el respaldo en JSON agregando las ventas de una en una; devuelve cuántas escribió.
+        
+        El archivo resultante tiene la misma estructura que json.dump (con la clave 'ventas'
+        al final), así que restaurar_datos_reportes lo lee sin cambios.
+        """
+        cabecera = json.dumps(backup_data, indent=2, ensure_ascii=False, default=db.json_default)
+        # Quitar el cierre '\n}' para continuar el objeto con la lista de ventas
+        f.write(cabecera[:-2] + ',\n  "ventas": [')
+        total = 0
+        for venta in ventas:
+            f.write((',\n    ' if total else '\n    ') + json.dumps(venta, ensure_ascii=False, default=db.json_default))
+            total += 1
+        f.write('\n  ]\n}\n' if total else ']\n}\n')
+        return total
+    
     # Funciones adicionales para gestión de datos y reportes
     def backup_datos_reportes(self):
         """Crea un respaldo completo de todos los datos"""
@@ -6025,16 +5714,14 @@ RESULTADOS:
             # Obtener datos desde BD
             productos = db.load_products()
             ofertas = db.load_offers()
-            ventas = db.load_orders()
             carrito = db.get_cart_items()
             
-            # Crear estructura de respaldo
+            # Crear estructura de respaldo (las ventas se escriben en streaming al guardar)
             backup_data = {
                 'fecha_backup': datetime.datetime.now().isoformat(),
                 'version': '1.0',
                 'productos': productos,
                 'ofertas': ofertas,
-                'ventas': ventas,
                 'carrito': carrito,
                 'configuracion': {
                     'tema_actual': self.tema_actual.get(),
@@ -6051,7 +5738,7 @@ RESULTADOS:
             
             if filename:
                 with open(filename, 'w', encoding='utf-8') as f:
-                    json.dump(backup_data, f, indent=2, ensure_ascii=False)
+                    total_ventas = self._escribir_backup_json(f, backup_data, db.iter_orders(direction='asc'))
                 
                 # Mostrar estadísticas del backup
                 estadisticas = f"""✅ BACKUP COMPLETADO EXITOSAMENTE
@@ -6059,7 +5746,7 @@ RESULTADOS:
 📊 Datos respaldados:
 • Productos: {len(productos)}
 • Ofertas: {len(ofertas)}
-• Ventas: {len(ventas)}
+• Ventas: {total_ventas}
 • Items en carrito: {len(carrito)}
 
 📁 Archivo: {os.path.basename(filename)}
@@ -6104,21 +5791,11 @@ RESULTADOS:
             # Limpiar datos actuales
             db.clear_cart()
             
-            # Restaurar productos
-            for producto in backup_data['productos']:
-                db.save_product(producto)
-            
-            # Restaurar ofertas
-            for oferta in backup_data['ofertas']:
-                db.save_offer(oferta)
-            
-            # Restaurar ventas
-            for venta in backup_data['ventas']:
-                db.save_order(venta)
+            # Restaurar productos, ofertas y ventas en una sola transacción
+            self._restaurar_lotes_en_bd(backup_data['productos'], backup_data['ofertas'], backup_data['ventas'])
             
             # Actualizar datos en memoria
             self.ofertas = backup_data['ofertas']
-            self.ventas = backup_data['ventas']
             
             # Mostrar estadísticas de restauración
             fecha_backup = backup_data.get('fecha_backup', 'Desconocida')
@@ -6190,22 +5867,15 @@ RESULTADOS:
                 p2_inicio = datetime.datetime.strptime(periodo2_inicio.get(), "%Y-%m-%d")
                 p2_fin = datetime.datetime.strptime(periodo2_fin.get(), "%Y-%m-%d")
                 
-                # Filtrar ventas por períodos
-                ventas_p1 = []
-                ventas_p2 = []
-                
-                for venta in self.ventas:
-                    fecha_venta = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S')
-                    if p1_inicio <= fecha_venta <= p1_fin:
-                        ventas_p1.append(venta)
-                    elif p2_inicio <= fecha_venta <= p2_fin:
-                        ventas_p2.append(venta)
+                # Totales de cada período calculados en SQL (ambas fechas incluidas)
+                resumen_p1 = reportes.sales_summary((p1_inicio.date(), p1_fin.date()))
+                resumen_p2 = reportes.sales_summary((p2_inicio.date(), p2_fin.date()))
                 
                 # Calcular métricas
-                total_p1 = sum(v['total_final'] for v in ventas_p1)
-                total_p2 = sum(v['total_final'] for v in ventas_p2)
-                cantidad_p1 = len(ventas_p1)
-                cantidad_p2 = len(ventas_p2)
+                total_p1 = resumen_p1['ingresos_totales']
+                total_p2 = resumen_p2['ingresos_totales']
+                cantidad_p1 = resumen_p1['total_ventas']
+                cantidad_p2 = resumen_p2['total_ventas']
                 
                 # Calcular diferencias
                 diferencia_ingresos = total_p2 - total_p1
@@ -6270,38 +5940,17 @@ RESULTADOS:
                 messagebox.showerror("Error", "Formato de fecha inválido. Use YYYY-MM-DD")
                 return
             
-            # Cargar datos frescos desde BD
-            ventas_bd = db.load_orders()
-            if ventas_bd:
-                self.ventas = ventas_bd
-            
-            # Filtrar ventas
-            ventas_filtradas = []
-            for venta in self.ventas:
-                try:
-                    fecha_venta = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S')
-                    fecha_venta_solo = fecha_venta.date()
-                    
-                    # Filtro por fecha
-                    if not (fecha_inicio_dt.date() <= fecha_venta_solo <= fecha_fin_dt.date()):
-                        continue
-                    
-                    # Filtro por producto
-                    if producto_filtro and producto_filtro.strip():
-                        productos_en_venta = [p['nombre'].lower() for p in venta['productos']]
-                        if not any(producto_filtro.lower() in prod for prod in productos_en_venta):
-                            continue
-                    
-                    ventas_filtradas.append(venta)
-                except Exception as e:
-                    print(f"Error al procesar venta {venta.get('id', 'unknown')}: {e}")
-                    continue
-            
-            # Actualizar ventas con filtros aplicados
-            self.ventas = ventas_filtradas
+            # Filtrar ventas directamente en la BD (búsqueda parcial del producto)
+            ventas_filtradas = db.query_orders(
+                fecha_desde=fecha_inicio_dt.date(),
+                fecha_hasta=fecha_fin_dt.date(),
+                producto=producto_filtro.strip() if producto_filtro else None,
+                producto_parcial=True,
+            )
             
-            # Refrescar reportes
+            # Refrescar reportes y conservar el resultado filtrado para exportarlo
             self.mostrar_reportes()
+            self.ventas_filtradas = ventas_filtradas
             
             # Mostrar resultado del filtro
             messagebox.showinfo("Filtros Aplicados", 
@@ -6327,18 +5976,13 @@ RESULTADOS:
             
             self.filtro_producto.delete(0, 'end')
             
-            # Recargar todos los datos desde BD
-            ventas_bd = db.load_orders()
-            if ventas_bd:
-                self.ventas = ventas_bd
-            
-            # Refrescar reportes
+            # Refrescar reportes (sin filtro: los totales salen de la BD completa)
             self.mostrar_reportes()
             
             messagebox.showinfo("Filtros Limpiados", "Se han limpiado todos los filtros y se muestran todos los datos")
             
             # Actualizar estado
-            self.status_label.config(text=f"✅ Filtros limpiados - {len(self.ventas)} ventas totales mostradas")
+            self.status_label.config(text=f"✅ Filtros limpiados - {db.count_orders()} ventas totales mostradas")
             
         except Exception as e:
             messagebox.showerror("Error", f"Error al limpiar filtros: {str(e)}")
@@ -6378,17 +6022,26 @@ RESULTADOS:
             elementos.append(Paragraph("🍣 REPORTE DE VENTAS - MIZU SUSHI BAR", titulo_style))
             elementos.append(Spacer(1, 20))
             
+            # Recorrer las ventas de la BD una sola vez (más recientes primero): totales y últimas 20
+            total_ventas = 0
+            ingresos_totales = 0
+            descuentos_totales = 0
+            ventas_recientes = []
+            for venta in db.iter_orders():
+                total_ventas += 1
+                ingresos_totales += venta['total_final']
+                descuentos_totales += venta['descuento_aplicado']
+                if len(ventas_recientes) < 20:
+                    ventas_recientes.append(venta)
+            
             # Información general
             fecha_actual = datetime.datetime.now().strftime('%d/%m/%Y %H:%M:%S')
             elementos.append(Paragraph(f"Fecha del reporte: {fecha_actual}", styles['Normal']))
-            elementos.append(Paragraph(f"Total de ventas analizadas: {len(self.ventas)}", styles['Normal']))
+            elementos.append(Paragraph(f"Total de ventas analizadas: {total_ventas}", styles['Normal']))
             elementos.append(Spacer(1, 20))
             
             # Métricas principales
-            if self.ventas:
-                total_ventas = len(self.ventas)
-                ingresos_totales = sum(venta['total_final'] for venta in self.ventas)
-                descuentos_totales = sum(venta['descuento_aplicado'] for venta in self.ventas)
+            if total_ventas:
                 promedio = ingresos_totales / total_ventas
                 
                 metricas_data = [
@@ -6419,7 +6072,7 @@ RESULTADOS:
             elementos.append(Paragraph("📋 VENTAS RECIENTES", styles['Heading2']))
             
             ventas_data = [['ID', 'Fecha', 'Total', 'Descuento']]
-            for venta in sorted(self.ventas, key=lambda x: x['fecha'], reverse=True)[:20]:
+            for venta in ventas_recientes:
                 fecha_corta = datetime.datetime.strptime(venta['fecha'], '%Y-%m-%d %H:%M:%S').strftime('%d/%m/%Y')
                 ventas_data.append([
                     venta['id'],
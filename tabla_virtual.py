@@ -0,0 +1,375 @@
+import tkinter as tk
+from collections import OrderedDict
+from tkinter import ttk
+from typing import List, Dict, Any, Optional, Callable, Iterable, Tuple
+
+import db
+
+# Tabla virtual sobre ttk.Treeview para listados grandes. El Treeview solo contiene las
+# filas que caben en pantalla; la barra de desplazamiento se traduce a una posición en la
+# fuente de datos (una lista en memoria o los pedidos de la BD) y los registros se piden
+# por bloques, que se guardan en un caché pequeño. La selección se guarda por clave de
+# registro, así sobrevive al desplazamiento y al reordenamiento.
+#
+# Una fuente de datos implementa:
+#   __len__()                   cantidad de registros
+#   rows(inicio, fin)           registros en esas posiciones (fin excluido)
+#   key(registro)               clave única del registro (se usa como iid del Treeview)
+#   sort(columna, descendente)  reordena por una columna visible; False si no se puede
+
+# Registros que se piden de una vez a la fuente y bloques que se conservan en caché
+BLOQUE_FILAS = 200
+BLOQUES_EN_CACHE = 4
+
+# iid de la fila que se muestra cuando una tabla virtual no tiene registros
+IID_VACIA = '__vacia__'
+
+
+def sync_rows(tree: ttk.Treeview, filas: Iterable[Tuple[Any, tuple]], parent: str = '') -> Tuple[int, int, int]:
+    """Deja los hijos de `parent` iguales a `filas` [(iid, valores)] tocando solo lo que cambió.
+
+    Compara por iid con las filas actuales: borra las que ya no están, actualiza los valores
+    que cambiaron, inserta las nuevas y reordena solo las filas fuera de lugar. Las filas que
+    siguen existiendo conservan la selección y la posición de scroll no se pierde (sin el
+    parpadeo de vaciar y volver a llenar). Devuelve (insertadas, actualizadas, eliminadas).
+    """
+    deseadas: Dict[str, tuple] = {}
+    orden: List[str] = []
+    for iid, valores in filas:
+        iid = str(iid)
+        if iid in deseadas:
+            continue
+        deseadas[iid] = tuple(valores)
+        orden.append(iid)
+
+    posicion_scroll = tree.yview()[0]
+    actuales = tree.get_children(parent)
+    eliminar = [iid for iid in actuales if iid not in deseadas]
+    if eliminar:
+        tree.delete(*eliminar)
+
+    existentes = set(actuales).difference(eliminar)
+    insertadas = actualizadas = 0
+    for iid in orden:
+        valores = deseadas[iid]
+        if iid in existentes:
+            # El Treeview devuelve los valores convertidos por Tcl: comparar como texto
+            if tuple(str(v) for v in tree.item(iid, 'values')) != tuple(str(v) for v in valores):
+                tree.item(iid, values=valores)
+                actualizadas += 1
+        else:
+            tree.insert(parent, 'end', iid=iid, values=valores)
+            insertadas += 1
+
+    hijos = list(tree.get_children(parent))
+    if hijos != orden:
+        for destino, iid in enumerate(orden):
+            if hijos[destino] != iid:
+                tree.move(iid, parent, destino)
+                hijos.remove(iid)
+                hijos.insert(destino, iid)
+
+    if eliminar or insertadas:
+        tree.yview_moveto(posicion_scroll)
+    return insertadas, actualizadas, len(eliminar)
+
+
+class ListSource:
+    """Fuente de datos sobre una lista de registros en memoria."""
+
+    def __init__(self, registros: Iterable[Any], key: Optional[Callable[[Any], Any]] = None,
+                 sort_keys: Optional[Dict[str, Callable[[Any], Any]]] = None):
+        self._registros = list(registros)
+        self._key = key or (lambda r: r['id'])
+        self._claves_orden = sort_keys or {}
+
+    def __len__(self) -> int:
+        return len(self._registros)
+
+    def rows(self, inicio: int, fin: int) -> List[Any]:
+        return self._registros[inicio:fin]
+
+    def key(self, registro) -> str:
+        return str(self._key(registro))
+
+    def sort(self, columna: str, descendente: bool) -> bool:
+        clave = self._claves_orden.get(columna)
+        if clave is None:
+            return False
+        self._registros.sort(key=clave, reverse=descendente)
+        return True
+
+
+class OrdersSource:
+    """Fuente de datos sobre los pedidos de la BD (mismos filtros que db.query_orders).
+
+    Los bloques se piden con db.load_orders_page por clave (valor de orden, id): al terminar
+    cada bloque se guarda la clave de su última fila, y el bloque siguiente continúa desde
+    ahí sobre el índice en lugar de contar y descartar filas con OFFSET. Un salto con la
+    barra parte de la clave conocida más cercana hacia atrás. Nunca se cargan todos los
+    pedidos. `sort_columns` asocia columnas visibles con campos de db.query_orders.
+    """
+
+    def __init__(self, filtros: Optional[Dict[str, Any]] = None,
+                 sort_columns: Optional[Dict[str, str]] = None):
+        self._filtros = dict(filtros or {})
+        self._columnas_orden = sort_columns or {}
+        self._orden = ('fecha', 'desc')
+        self._total: Optional[int] = None
+        # posición → clave (valor de orden, id) de la fila anterior a esa posición
+        self._claves: Dict[int, tuple] = {}
+
+    def __len__(self) -> int:
+        if self._total is None:
+            self._total = db.count_orders(**self._filtros)
+        return self._total
+
+    def rows(self, inicio: int, fin: int) -> List[db.Order]:
+        campo, direccion = self._orden
+        desde = max((p for p in self._claves if p <= inicio), default=0)
+        registros = db.load_orders_page(after=self._claves.get(desde), limit=fin - inicio,
+                                        offset=inicio - desde, order_by=campo,
+                                        direction=direccion, **self._filtros)
+        if registros:
+            ultimo = registros[-1]
+            self._claves[inicio + len(registros)] = (ultimo[campo], ultimo['id'])
+        return registros
+
+    def key(self, registro) -> str:
+        return str(registro['id'])
+
+    def sort(self, columna: str, descendente: bool) -> bool:
+        campo = self._columnas_orden.get(columna)
+        if campo is None:
+            return False
+        self._orden = (campo, 'desc' if descendente else 'asc')
+        self._claves.clear()
+        return True
+
+    def invalidate(self):
+        """Olvida el total y las claves de página (p. ej. tras registrar o borrar pedidos)."""
+        self._total = None
+        self._claves.clear()
+
+
+class VirtualTable(tk.Frame):
+    """Treeview con scroll virtual: solo las filas visibles existen en el widget.
+
+    `columnas` es una lista de (nombre, ancho, anchor); `valores(registro)` devuelve la
+    tupla de valores de la fila. `fila_vacia` se muestra si la fuente no tiene registros.
+    El Treeview queda en `self.tree` (bindings, estilos); la selección se lee con
+    selection(), que devuelve claves de registro aunque las filas no estén en pantalla.
+    """
+
+    def __init__(self, parent, columnas: List[Tuple[str, int, str]], fuente, valores: Callable[[Any], tuple],
+                 fila_vacia: Optional[tuple] = None, horizontal: bool = False, bg=None, **opciones):
+        super().__init__(parent, bg=bg)
+        self.valores = valores
+        self.fila_vacia = fila_vacia
+        self._filas = int(opciones.get('height', 10))
+        self._inicio = 0
+        self._total = 0
+        self._cache: 'OrderedDict[int, List[Any]]' = OrderedDict()
+        self._seleccion: set = set()
+        self._visibles: List[str] = []
+        self._orden: Optional[Tuple[str, bool]] = None
+        self._titulos = {nombre: nombre for nombre, _, _ in columnas}
+
+        self.tree = ttk.Treeview(self, columns=[c[0] for c in columnas], show='headings', **opciones)
+        for nombre, ancho, anchor in columnas:
+            self.tree.heading(nombre, text=nombre, command=lambda c=nombre: self.sort_by(c))
+            self.tree.column(nombre, width=ancho, anchor=anchor)
+        self.scroll = ttk.Scrollbar(self, orient='vertical', command=self._on_scrollbar)
+
+        self.tree.grid(row=0, column=0, sticky='nsew')
+        self.scroll.grid(row=0, column=1, sticky='ns')
+        if horizontal:
+            scroll_h = ttk.Scrollbar(self, orient='horizontal', command=self.tree.xview)
+            self.tree.configure(xscrollcommand=scroll_h.set)
+            scroll_h.grid(row=1, column=0, sticky='ew')
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self.tree.bind('<Configure>', self._on_resize)
+        self.tree.bind('<<TreeviewSelect>>', self._on_select)
+        self.tree.bind('<MouseWheel>', lambda e: self._desplazar(-3 if e.delta > 0 else 3))
+        self.tree.bind('<Button-4>', lambda e: self._desplazar(-3))
+        self.tree.bind('<Button-5>', lambda e: self._desplazar(3))
+        self.tree.bind('<Up>', lambda e: self._mover_foco(-1))
+        self.tree.bind('<Down>', lambda e: self._mover_foco(1))
+        self.tree.bind('<Prior>', lambda e: self._desplazar(-self._filas))
+        self.tree.bind('<Next>', lambda e: self._desplazar(self._filas))
+        self.tree.bind('<Home>', lambda e: self._ir_a(0))
+        self.tree.bind('<End>', lambda e: self._ir_a(self._total))
+
+        self.set_source(fuente)
+
+    # Fuente de datos y lectura por bloques
+
+    def set_source(self, fuente, keep_state: bool = False):
+        """Cambia la fuente de datos y vuelve al principio (se descarta la selección).
+
+        Con keep_state=True (p. ej. al recargar los mismos datos) se conservan la posición,
+        la selección y el orden por columna, que se vuelve a aplicar a la nueva fuente.
+        """
+        self.fuente = fuente
+        if keep_state and self._orden and not fuente.sort(*self._orden):
+            self._orden = None
+        if not keep_state:
+            self._seleccion = set()
+            self._orden = None
+            self._inicio = 0
+        self._actualizar_titulos()
+        self.refresh()
+
+    def refresh(self):
+        """Vuelve a leer la fuente manteniendo la posición y la selección."""
+        if hasattr(self.fuente, 'invalidate'):
+            self.fuente.invalidate()
+        self._cache.clear()
+        try:
+            self._total = len(self.fuente)
+        except Exception as e:
+            print(f"Error al leer la fuente de la tabla: {e}")
+            self._total = 0
+        self._pintar()
+
+    def _bloque(self, numero: int) -> List[Any]:
+        bloque = self._cache.get(numero)
+        if bloque is None:
+            inicio = numero * BLOQUE_FILAS
+            bloque = self.fuente.rows(inicio, min(self._total, inicio + BLOQUE_FILAS))
+            self._cache[numero] = bloque
+            while len(self._cache) > BLOQUES_EN_CACHE:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(numero)
+        return bloque
+
+    def _registros(self, inicio: int, fin: int) -> List[Any]:
+        registros: List[Any] = []
+        posicion = inicio
+        while posicion < fin:
+            numero, desde = divmod(posicion, BLOQUE_FILAS)
+            bloque = self._bloque(numero)
+            trozo = bloque[desde:desde + (fin - posicion)]
+            if not trozo:
+                break
+            registros.extend(trozo)
+            posicion += len(trozo)
+        return registros
+
+    # Pintado de la ventana visible
+
+    def _pintar(self):
+        self._inicio = max(0, min(self._inicio, self._total - self._filas))
+        try:
+            registros = self._registros(self._inicio, min(self._total, self._inicio + self._filas))
+        except Exception as e:
+            print(f"Error al leer filas de la tabla: {e}")
+            registros = []
+
+        filas = []
+        for registro in registros:
+            try:
+                filas.append((self.fuente.key(registro), self.valores(registro)))
+            except Exception:
+                # Registro inválido: omitir la fila
+                continue
+        if not filas and self.fila_vacia:
+            filas.append((IID_VACIA, self.fila_vacia))
+        # Solo se tocan las filas que cambiaron respecto de la ventana anterior
+        sync_rows(self.tree, filas)
+        self._visibles = [iid for iid in self.tree.get_children() if iid != IID_VACIA]
+        seleccion = [c for c in self._visibles if c in self._seleccion]
+        if list(self.tree.selection()) != seleccion:
+            self.tree.selection_set(seleccion)
+
+        if self._total:
+            self.scroll.set(self._inicio / self._total, (self._inicio + len(self._visibles)) / self._total)
+        else:
+            self.scroll.set(0, 1)
+
+    def _ir_a(self, inicio: int):
+        inicio = max(0, min(int(inicio), self._total - self._filas))
+        if inicio != self._inicio:
+            self._inicio = inicio
+            self._pintar()
+        return 'break'
+
+    def _desplazar(self, filas: int):
+        return self._ir_a(self._inicio + filas)
+
+    def _on_scrollbar(self, accion, cantidad, unidad=None):
+        if accion == 'moveto':
+            self._ir_a(float(cantidad) * self._total)
+        elif accion == 'scroll':
+            paso = self._filas if unidad == 'pages' else 1
+            self._desplazar(int(cantidad) * paso)
+
+    def _on_resize(self, event=None):
+        alto_fila = 20
+        try:
+            alto_fila = int(ttk.Style().lookup('Treeview', 'rowheight') or 20)
+        except (tk.TclError, ValueError):
+            pass
+        encabezado = 25
+        if self._visibles:
+            caja = self.tree.bbox(self._visibles[0])
+            if caja:
+                encabezado = caja[1]
+        filas = max(1, (self.tree.winfo_height() - encabezado) // alto_fila)
+        if filas != self._filas:
+            self._filas = filas
+            self._pintar()
+
+    def _mover_foco(self, paso: int):
+        """Flechas en el borde de la ventana visible: desplazar y mantener el foco en el borde."""
+        foco = self.tree.focus()
+        if not self._visibles or foco not in self._visibles:
+            return None
+        posicion = self._visibles.index(foco) + paso
+        if 0 <= posicion < len(self._visibles):
+            return None
+        self._desplazar(paso)
+        destino = self._visibles[0 if paso < 0 else -1]
+        self.tree.focus(destino)
+        self.tree.selection_set(destino)
+        return 'break'
+
+    # Selección y orden por clave de registro
+
+    def _on_select(self, event=None):
+        seleccionadas = set(self.tree.selection())
+        for clave in self._visibles:
+            if clave in seleccionadas:
+                self._seleccion.add(clave)
+            else:
+                self._seleccion.discard(clave)
+
+    def selection(self) -> List[str]:
+        """Claves de los registros seleccionados (estén o no en pantalla)."""
+        visibles = [c for c in self._visibles if c in self._seleccion]
+        return visibles + [c for c in self._seleccion if c not in visibles]
+
+    def selection_set(self, claves: Iterable[Any]):
+        self._seleccion = {str(c) for c in claves}
+        self.tree.selection_set([c for c in self._visibles if c in self._seleccion])
+
+    def sort_by(self, columna: str, descendente: Optional[bool] = None):
+        """Ordena por una columna; sin `descendente`, alterna el sentido al repetir la columna."""
+        if descendente is None:
+            descendente = bool(self._orden and self._orden[0] == columna and not self._orden[1])
+        if not self.fuente.sort(columna, descendente):
+            return
+        self._orden = (columna, descendente)
+        self._actualizar_titulos()
+        self._inicio = 0
+        self._cache.clear()
+        self._pintar()
+
+    def _actualizar_titulos(self):
+        for columna, titulo in self._titulos.items():
+            if self._orden and self._orden[0] == columna:
+                titulo = f"{titulo} {'▼' if self._orden[1] else '▲'}"
+            self.tree.heading(columna, text=titulo)